@@ -1,14 +1,27 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
-from app.routers import text_build, text_search, image_search
+from app.routers import text_build, text_search, text_suggest, image_search, health
+from app.services.engines import warm_up
+from app.services.executors import shutdown_executors
+from app.services.text.shards import shutdown_pools
 #from app.routers import image_search
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Los motores cargan en hilos de fondo: la API atiende desde el arranque
+    warm_up()
+    yield
+    shutdown_executors()
+    shutdown_pools()
+
 app = FastAPI(
     title="Mini Multimodal DB",
     version="1.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -23,7 +36,9 @@ app.add_middleware(
 async def root():
     return JSONResponse(status_code=200, content="Hello from Mini Multimodal DB")
 
+app.include_router(health.router, tags=["Health"])
 app.include_router(text_build.router, prefix="/index")
 app.include_router(text_search.router, prefix="/search")
+app.include_router(text_suggest.router, prefix="/suggest")
 app.include_router(image_search.router, prefix="/image", tags=["Image Search"])
 app.mount("/static", StaticFiles(directory="data/fashion/images"), name="static")
\ No newline at end of file
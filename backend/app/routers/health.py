@@ -0,0 +1,22 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from app.services.engines import engines_status
+from app.services.executors import limiters_status
+
+router = APIRouter()
+
+@router.get("/health")
+def health():
+    """
+    Liveness: la API responde (aunque los motores sigan cargando).
+    Incluye el estado y el tiempo de carga de cada motor, y la carga de
+    cada endpoint limitado (en ejecución, en cola, rechazadas).
+    """
+    status, ready = engines_status()
+    return {"status": "ok", "ready": ready, "engines": status, "endpoints": limiters_status()}
+
+@router.get("/ready")
+def readiness():
+    """Readiness: 200 cuando todos los motores están listos, 503 mientras tanto."""
+    status, ready = engines_status()
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "engines": status})
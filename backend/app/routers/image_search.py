@@ -1,39 +1,276 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+import os
+import zipfile
+import tempfile
+from typing import List, Optional
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, Response
 from app.services.image.vector_engine import ImageSearchEngine
+from app.services.engines import register_engine, EngineNotReadyError
+from app.services.executors import cpu_executor, endpoint_limiter, OverloadedError
+from app.services.image.hnsw import HNSW_EF_SEARCH
+from app.services.image.quantized import RERANK_CANDIDATES
+from app.services.image.delta_segment import add_images, DATA_DIR, MODELS_DIR
+from app.services.image.thumbnails import ThumbnailStore, make_thumbnail, thumbnail_etag, MEDIA_TYPES, THUMB_FORMAT
+from app.services.image.feature_extractor import (
+    ImageTooLargeError, UnsupportedImageError, MAX_UPLOAD_BYTES, check_image_limits
+)
 
 router = APIRouter()
 
+# Búsqueda en lote
+MAX_BATCH_IMAGES = 2000
+BATCH_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Miniaturas: contenido inmutable por id (el ETag es el hash del contenido)
+THUMB_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
 # --- INSTANCIA GLOBAL ---
-# Se carga UNA sola vez cuando inicias el servidor.
-print("Cargando Motor Multimedia en memoria")
-try:
-    engine = ImageSearchEngine()
-except Exception as e:
-    print(f"Error cargando motor: {e}")
-    engine = None
+# Solo se registra: se carga en segundo plano al arrancar (main.lifespan)
+# y hasta entonces los endpoints responden 503 con Retry-After.
+# SIFT de las consultas corre en el pool de procesos compartido.
+image_engine = register_engine("image", lambda: ImageSearchEngine(sift_executor=cpu_executor()))
+
+# Concurrencia y cola por endpoint (ENDPOINT_LIMITS en executors)
+search_limiter = endpoint_limiter("image_search")
+batch_limiter = endpoint_limiter("image_batch")
+add_limiter = endpoint_limiter("image_add")
+
+# Pila de miniaturas: se abre en la primera petición
+thumbnails = None
+
+def _engine():
+    try:
+        return image_engine.get()
+    except EngineNotReadyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def _run_limited(limiter, fn, *args, **kwargs):
+    """fn en el pool de hilos (el event loop queda libre); 503 si la cola del endpoint está llena."""
+    try:
+        return await limiter.run(fn, *args, **kwargs)
+    except OverloadedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
 
 @router.post("/")
 async def search_image(
     file: UploadFile = File(...), 
-    k: int = 8
+    k: int = 8,
+    method: str = "inverted",
+    ef_search: int = HNSW_EF_SEARCH,
+    rerank: int = RERANK_CANDIDATES,
+    gender: Optional[str] = None,
+    masterCategory: Optional[str] = None,
+    subCategory: Optional[str] = None,
+    articleType: Optional[str] = None,
+    baseColour: Optional[str] = None,
+    season: Optional[str] = None,
+    year_min: Optional[int] = None,
+    year_max: Optional[int] = None,
+    min_idf: Optional[float] = None,
+    max_postings: Optional[int] = None,
+    collapse: bool = False
 ):
     """
     Busca imágenes similares.
     - file: Imagen a buscar (Body form-data)
     - k: Número de resultados (Query param, default 8)
+    - method: "inverted" (default), "secuencial", "hnsw" (aproximado),
+              "sq" o "pq" (scan sobre códigos comprimidos)
+    - ef_search: candidatos explorados por HNSW (más alto = más recall)
+    - rerank: candidatos de sq/pq re-puntuados con los pesos float (0 = sin re-rank)
+    - gender, masterCategory, subCategory, articleType, baseColour, season:
+      filtros sobre styles.csv (varios valores separados por coma)
+    - year_min, year_max: rango de años (inclusive)
+    - min_idf: (inverted) omite las palabras de la query con idf menor
+    - max_postings: (inverted) postings recorridos como máximo por lista
+    - collapse: un solo resultado por grupo de casi-duplicados (near_duplicates)
     """
-    if engine is None:
-        raise HTTPException(status_code=500, detail="El motor no está activo. Revisa los logs del servidor.")
+    engine = _engine()
+
+    if method not in ("inverted", "secuencial", "hnsw", "sq", "pq"):
+        raise HTTPException(status_code=400, detail=f"Método desconocido: {method}")
+
+    if method == "hnsw" and engine.models.hnsw is None:
+        raise HTTPException(status_code=400, detail="El índice HNSW no está construido.")
+
+    if method in ("sq", "pq") and getattr(engine.models, method) is None:
+        raise HTTPException(status_code=400, detail=f"Los códigos '{method}' no están construidos.")
+
+    # Leer imagen (como máximo MAX_UPLOAD_BYTES + 1 para detectar el exceso)
+    content = await file.read(MAX_UPLOAD_BYTES + 1)
+    if len(content) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"La imagen supera el máximo de {MAX_UPLOAD_BYTES // 1024 ** 2} MB")
+
+    filters = {
+        column: [v.strip() for v in value.split(",") if v.strip()]
+        for column, value in (
+            ("gender", gender), ("masterCategory", masterCategory), ("subCategory", subCategory),
+            ("articleType", articleType), ("baseColour", baseColour), ("season", season)
+        )
+        if value
+    }
+    if year_min is not None: filters["year_min"] = year_min
+    if year_max is not None: filters["year_max"] = year_max
 
     try:
-        # Leer imagen
-        content = await file.read()
-        
-        # Buscar (Usando el método invertido)
-        results = engine.search(content, k=k, method="inverted")
+        # Buscar (por defecto con el método invertido) fuera del event loop
+        results = await _run_limited(
+            search_limiter, engine.search, content, k=k, method=method, ef_search=ef_search,
+            rerank_candidates=rerank, filters=filters or None,
+            min_idf=min_idf, max_postings=max_postings, collapse=collapse
+        )
         
         return {"results": results}
         
+    except HTTPException:
+        raise
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedImageError as e:
+        raise HTTPException(status_code=415, detail=str(e))
     except Exception as e:
         print(f"Error en búsqueda: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _batch_items(files):
+    """
+    (nombre, bytes) de cada imagen subida; los .zip se expanden a sus
+    imágenes. Los miembros del zip se validan por su tamaño declarado
+    antes de descomprimirlos.
+    """
+    for file in files:
+        name = os.path.basename(file.filename or "")
+
+        if name.lower().endswith(".zip"):
+            try:
+                archive = zipfile.ZipFile(file.file)
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"Zip inválido: '{name}'")
+
+            with archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not info.filename.lower().endswith(BATCH_EXTENSIONS):
+                        continue
+                    if info.file_size > MAX_UPLOAD_BYTES:
+                        yield info.filename, None
+                        continue
+                    yield info.filename, archive.read(info)
+        else:
+            content = file.file.read(MAX_UPLOAD_BYTES + 1)
+            yield name, content if len(content) <= MAX_UPLOAD_BYTES else None
+
+@router.post("/batch")
+async def search_image_batch(files: List[UploadFile] = File(...), k: int = 8):
+    """
+    Busca muchas imágenes en una sola llamada (KNN secuencial exacto).
+    - files: imágenes y/o archivos .zip con imágenes (Body form-data)
+    - k: resultados por imagen
+    SIFT corre en el pool de procesos, la cuantización es un solo predict y
+    el scoring un solo producto disperso contra el índice. Las imágenes
+    que superan los límites se reportan con "error" sin abortar el lote.
+    """
+    engine = _engine()
+    return await _run_limited(batch_limiter, _search_batch, engine, files, k)
+
+def _search_batch(engine, files, k):
+    names, contents, errors = [], [], {}
+    for name, content in _batch_items(files):
+        if len(names) + len(errors) >= MAX_BATCH_IMAGES:
+            raise HTTPException(status_code=413, detail=f"El lote supera el máximo de {MAX_BATCH_IMAGES} imágenes")
+        try:
+            if content is None:
+                raise ImageTooLargeError(f"Supera el máximo de {MAX_UPLOAD_BYTES // 1024 ** 2} MB")
+            check_image_limits(content)
+        except (ImageTooLargeError, UnsupportedImageError) as e:
+            errors[len(names) + len(errors)] = (name, str(e))
+            continue
+        names.append(name)
+        contents.append(content)
+
+    try:
+        batch_results = iter(engine.search_batch(contents, k=k))
+    except Exception as e:
+        print(f"Error en búsqueda en lote: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    results = []
+    found = iter(names)
+    for pos in range(len(names) + len(errors)):
+        if pos in errors:
+            name, error = errors[pos]
+            results.append({"file": name, "error": error, "results": []})
+        else:
+            results.append({"file": next(found), "results": next(batch_results)})
+
+    return {"results": results}
+
+@router.get("/thumb/{img_id}")
+def get_thumbnail(img_id: str, request: Request):
+    """
+    Miniatura de una imagen del catálogo, desde la pila pre-generada.
+    Responde con ETag fuerte y caché de un año; If-None-Match -> 304.
+    Las imágenes aún sin miniatura empaquetada se reducen al vuelo.
+    """
+    global thumbnails
+    if thumbnails is None or thumbnails.is_stale():
+        thumbnails = ThumbnailStore.load(MODELS_DIR)
+
+    found = thumbnails.get(img_id) if thumbnails is not None else None
+    if found is None:
+        path = os.path.join(DATA_DIR, os.path.basename(img_id))
+        data = make_thumbnail(path) if os.path.exists(path) else None
+        if data is None:
+            raise HTTPException(status_code=404, detail=f"Imagen no encontrada: {img_id}")
+        found = data, thumbnail_etag(data)
+
+    data, etag = found
+    headers = {"ETag": f'"{etag}"', "Cache-Control": THUMB_CACHE_CONTROL}
+
+    # If-None-Match usa comparación débil: se ignora el prefijo W/
+    client_tags = [t.strip().removeprefix("W/") for t in request.headers.get("if-none-match", "").split(",")]
+    if f'"{etag}"' in client_tags or "*" in client_tags:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type=MEDIA_TYPES[THUMB_FORMAT], headers=headers)
+
+@router.get("/cache")
+def query_cache_stats():
+    """
+    Métricas de la caché de consultas del worker que atiende la petición:
+    entradas, aciertos de ranking (k cortado de la lista guardada), aciertos
+    de vector (solo se re-busca) y fallos (SIFT completo).
+    """
+    engine = _engine()
+    return engine.query_cache.stats()
+
+@router.post("/add")
+async def add_image_files(files: List[UploadFile] = File(...)):
+    """
+    Agrega imágenes al índice sin reindexar (segmento delta).
+    - files: imágenes (Body form-data); el nombre del archivo es su id
+    Las imágenes con un id ya indexado se omiten y las que superan los
+    límites se reportan en "rejected". Los motores de todos los
+    workers ven las nuevas imágenes en su siguiente búsqueda.
+    """
+    return await _run_limited(add_limiter, _add_image_files, files)
+
+def _add_image_files(files):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = []
+        for file in files:
+            name = os.path.basename(file.filename or "")
+            if not name.lower().endswith(".jpg"):
+                raise HTTPException(status_code=400, detail=f"Solo se aceptan imágenes .jpg: '{file.filename}'")
+
+            content = file.file.read(MAX_UPLOAD_BYTES + 1)
+            if len(content) > MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail=f"'{name}' supera el máximo de {MAX_UPLOAD_BYTES // 1024 ** 2} MB")
+
+            path = os.path.join(tmp_dir, name)
+            with open(path, "wb") as f:
+                f.write(content)
+            paths.append(path)
+
+        try:
+            return add_images(paths)
+        except Exception as e:
+            print(f"Error agregando imágenes: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
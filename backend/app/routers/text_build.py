@@ -1,6 +1,6 @@
 from pydantic import BaseModel
-from fastapi import APIRouter
-from app.services.text.build_index import build_index
+from fastapi import APIRouter, HTTPException
+from app.services.text.build_jobs import submit_build, get_job, list_jobs, cancel_job
 
 router = APIRouter()
 
@@ -8,9 +8,47 @@ class BuildRequest(BaseModel):
     file: str
     docIdIdx: int
     textColumnIdx: int
+    shards: int = 1
 
-@router.post("/")
+@router.post("/", status_code=202)
 def build_text_index(req: BuildRequest):
-    build_index(req.file, req.docIdIdx, req.textColumnIdx)
+    """
+    Encola la construcción del índice y responde al instante con el id
+    del job; el avance se consulta en GET /index/jobs/{job_id}.
+    """
+    job = submit_build(req.file, req.docIdIdx, req.textColumnIdx, shards=req.shards)
 
-    return {"message": "Índice textual construido con éxito."}
+    return {
+        "message": "Construcción del índice textual encolada.",
+        "job_id": job.id,
+        "status_url": f"/index/jobs/{job.id}"
+    }
+
+
+@router.get("/jobs")
+def build_jobs():
+    return {"jobs": list_jobs()}
+
+
+@router.get("/jobs/{job_id}")
+def build_job_status(job_id: str):
+    """
+    Estado del job: fase (spimi / merge / docs), documentos procesados,
+    bloques escritos, bytes/s y ETA de la fase en curso.
+    """
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' no encontrado")
+    return job.to_dict()
+
+
+@router.delete("/jobs/{job_id}")
+def cancel_build_job(job_id: str):
+    """
+    Cancela el job. Si ya estaba corriendo se descarta su staging y el
+    índice en uso del dataset queda como estaba.
+    """
+    job = cancel_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' no encontrado")
+    return job.to_dict()
@@ -1,15 +1,41 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
 from app.services.text.search_engine import search_query
+from app.services.text.shards import is_sharded, search_sharded, similar_sharded
+from app.services.text.similar import similar_documents, DEFAULT_TERMS
+from app.services.executors import endpoint_limiter, OverloadedError
 import time
 
 router = APIRouter()
 
+# Las búsquedas corren en el pool de hilos, acotadas (ver ENDPOINT_LIMITS)
+text_limiter = endpoint_limiter("text_search")
+
+async def _run_limited(fn, *args, **kwargs):
+    try:
+        return await text_limiter.run(fn, *args, **kwargs)
+    except OverloadedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
 @router.get("/")
-def text_search(q: str, k: int = 10, file_name: str = "spotify_songs"):
+async def text_search(
+    q: str,
+    k: int = 10,
+    file_name: str = "spotify_songs",
+    filters: str = None,
+    collapse_duplicates: bool = False
+):
+    """
+    - filters: rangos sobre atributos de audio, p. ej. "valence<=0.3,tempo<100"
+    - collapse_duplicates: un solo resultado por cluster de covers/remixes
+    """
     start = time.time()  # inicio
 
     # Llamas a tu función de búsqueda
-    results = search_query(q, k, file_name)
+    search = search_sharded if is_sharded(file_name) else search_query
+    try:
+        results = await _run_limited(search, q, k, file_name, filters=filters, collapse=collapse_duplicates)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     end = time.time()  # fin
     execution_time = round((end - start) * 1000, 3)  # ms con 3 decimales
@@ -18,3 +44,26 @@ def text_search(q: str, k: int = 10, file_name: str = "spotify_songs"):
         "results": results,
         "execution_time": execution_time
     }
+
+
+@router.get("/similar/{docId}")
+async def similar_search(docId: str, k: int = 10, file_name: str = "spotify_songs", terms: int = DEFAULT_TERMS):
+    """
+    "More like this": canciones con letra similar a docId.
+    - terms: cuántos términos del documento se usan como query (acota la latencia)
+    """
+    start = time.time()
+
+    similar = similar_sharded if is_sharded(file_name) else similar_documents
+    results = await _run_limited(similar, docId, k, file_name, n_terms=terms)
+
+    if results is None:
+        raise HTTPException(status_code=404, detail=f"Documento '{docId}' no encontrado")
+
+    end = time.time()
+    execution_time = round((end - start) * 1000, 3)
+
+    return {
+        "results": results,
+        "execution_time": execution_time
+    }
@@ -0,0 +1,19 @@
+from fastapi import APIRouter
+from app.services.text.suggest import suggest
+import time
+
+router = APIRouter()
+
+@router.get("/")
+def text_suggest(q: str, k: int = 10, file_name: str = "spotify_songs"):
+    start = time.perf_counter()
+
+    suggestions = suggest(q, k, file_name)
+
+    end = time.perf_counter()
+    execution_time = round((end - start) * 1000, 3)  # ms con 3 decimales
+
+    return {
+        "suggestions": suggestions,
+        "execution_time": execution_time
+    }
@@ -0,0 +1,128 @@
+import time
+import threading
+import traceback
+
+# Segundos sugeridos al cliente (Retry-After) mientras un motor carga
+RETRY_AFTER_LOADING = 2
+# Espera antes de reintentar la carga de un motor que falló (p. ej.
+# modelos ausentes o a medio publicar): el siguiente get() la relanza
+RETRY_AFTER_FAILED = 30
+
+
+class EngineNotReadyError(Exception):
+    """El motor todavía carga (o falló): la API responde 503 con Retry-After."""
+
+    def __init__(self, name, state, retry_after, detail=""):
+        self.name = name
+        self.state = state
+        self.retry_after = retry_after
+        super().__init__(detail or f"El motor '{name}' está en estado '{state}'")
+
+
+class LazyEngine:
+    """
+    Motor registrado por nombre que se construye en un hilo de fondo.
+    Nunca bloquea al que lo pide: get() retorna el motor si está listo
+    o lanza EngineNotReadyError (y arranca la carga si nadie lo hizo).
+
+    Estados: registered -> loading -> ready | failed
+    Un motor en failed vuelve a loading con el primer get() pasados
+    RETRY_AFTER_FAILED segundos desde la falla.
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.state = "registered"
+        self.engine = None
+        self.error = None
+        self.started_at = None
+        self.load_seconds = None
+        self.failed_at = None
+        self._lock = threading.Lock()
+
+    def _retry_in(self):
+        """Segundos que faltan para poder reintentar una carga fallida."""
+        return max(0.0, self.failed_at + RETRY_AFTER_FAILED - time.time())
+
+    def start(self):
+        """Lanza la carga en segundo plano (una vez, o de nuevo tras la espera si falló)."""
+        with self._lock:
+            if self.state == "failed" and self._retry_in() == 0:
+                print(f"[MOTORES] '{self.name}': reintentando la carga")
+            elif self.state != "registered":
+                return
+            self.state = "loading"
+            self.started_at = time.time()
+        threading.Thread(target=self._load, name=f"warmup-{self.name}", daemon=True).start()
+
+    def _load(self):
+        start = time.perf_counter()
+        try:
+            engine = self.factory()
+        except Exception as e:
+            traceback.print_exc()
+            self.error = str(e)
+            self.failed_at = time.time()
+            self.state = "failed"
+        else:
+            self.engine = engine
+            self.error = None
+            self.state = "ready"
+        self.load_seconds = time.perf_counter() - start
+        print(f"[MOTORES] '{self.name}': {self.state} en {self.load_seconds:.2f}s")
+
+    def get(self):
+        if self.state == "ready":
+            return self.engine
+        self.start()
+
+        state = self.state
+        if state == "ready":    # la carga pudo terminar recién
+            return self.engine
+        if state == "failed":
+            retry_after = max(1, round(self._retry_in()))
+            raise EngineNotReadyError(self.name, state, retry_after,
+                                      f"El motor '{self.name}' no pudo cargarse ({self.error}); "
+                                      f"se reintenta en {retry_after}s")
+        raise EngineNotReadyError(self.name, state, RETRY_AFTER_LOADING,
+                                  f"El motor '{self.name}' se está cargando, reintenta en unos segundos")
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def status(self):
+        elapsed = self.load_seconds
+        if self.state == "loading":
+            elapsed = time.time() - self.started_at
+        return {
+            "state": self.state,
+            "load_ms": round(elapsed * 1000, 1) if elapsed is not None else None,
+            "error": self.error,
+        }
+
+
+# ============================================================
+# REGISTRO
+# ============================================================
+
+ENGINES = {}
+
+
+def register_engine(name, factory):
+    """Registra un motor sin construirlo (la carga la dispara warm_up o el primer get)."""
+    ENGINES[name] = LazyEngine(name, factory)
+    return ENGINES[name]
+
+
+def warm_up():
+    """Arranca en segundo plano la carga de todos los motores registrados."""
+    for engine in ENGINES.values():
+        engine.start()
+
+
+def engines_status():
+    """({nombre: estado}, todos_listos)"""
+    status = {name: engine.status() for name, engine in ENGINES.items()}
+    return status, all(engine.ready for engine in ENGINES.values())
@@ -0,0 +1,186 @@
+import os
+import asyncio
+import functools
+import threading
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Procesos para el trabajo CPU (SIFT): uno menos que los núcleos, para
+# dejarle CPU al event loop y a los hilos de scoring
+CPU_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+# Por endpoint: (en ejecución a la vez, en cola). Más allá -> 503 + Retry-After.
+# Cada endpoint tiene su propio pool de hilos de max_concurrent hilos
+# (numpy/scipy liberan el GIL): un endpoint saturado no le quita hilos
+# a los demás y cada límite se cumple tal cual.
+ENDPOINT_LIMITS = {
+    "image_search": (CPU_WORKERS * 2, 64),
+    "image_batch": (1, 2),
+    "image_add": (1, 4),
+    "text_search": (8, 64),
+}
+DEFAULT_LIMITS = (4, 16)
+RETRY_AFTER_OVERLOADED = 1
+
+_cpu_executor = None
+_cpu_lock = threading.Lock()
+
+
+class RestartingProcessPool:
+    """
+    ProcessPoolExecutor que se reemplaza si queda roto: cuando un worker
+    muere (OOM, crash dentro de cv2) el pool entero pasa a
+    BrokenProcessPool y rechazaría todas las tareas siguientes. run() y
+    map() crean un pool nuevo bajo el lock y reintentan la tarea una vez.
+    """
+
+    def __init__(self, max_workers, mp_context):
+        self.max_workers = max_workers
+        self.mp_context = mp_context
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self.mp_context)
+            return self._pool
+
+    def _replace(self, broken):
+        with self._lock:
+            # Otro hilo pudo haberlo reemplazado ya
+            if self._pool is broken:
+                print("[EXECUTORS] Pool de procesos roto (murió un worker), se crea uno nuevo")
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=self.mp_context)
+            return self._pool
+
+    def run(self, fn, *args):
+        """fn(*args) en un worker; espera el resultado."""
+        pool = self._get()
+        try:
+            return pool.submit(fn, *args).result()
+        except BrokenProcessPool:
+            return self._replace(pool).submit(fn, *args).result()
+
+    def map(self, fn, items, chunksize=1):
+        """[fn(x) for x in items] repartido en el pool (en orden)."""
+        items = list(items)
+        pool = self._get()
+        try:
+            return list(pool.map(fn, items, chunksize=chunksize))
+        except BrokenProcessPool:
+            return list(self._replace(pool).map(fn, items, chunksize=chunksize))
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+def cpu_executor():
+    """
+    Pool de procesos para SIFT (los procesos arrancan en el primer uso).
+    spawn y no fork: el proceso padre ya tiene hilos (event loop,
+    warm-up) y un fork con hilos vivos puede heredar locks tomados.
+    """
+    global _cpu_executor
+    with _cpu_lock:
+        if _cpu_executor is None:
+            _cpu_executor = RestartingProcessPool(CPU_WORKERS, mp.get_context("spawn"))
+        return _cpu_executor
+
+
+def shutdown_executors():
+    global _cpu_executor
+    if _cpu_executor is not None:
+        _cpu_executor.shutdown()
+        _cpu_executor = None
+    for limiter in LIMITERS.values():
+        limiter.shutdown()
+
+
+# ============================================================
+# LÍMITES POR ENDPOINT (BACKPRESSURE)
+# ============================================================
+
+class OverloadedError(Exception):
+    """La cola del endpoint está llena: la API responde 503 con Retry-After."""
+
+    def __init__(self, name, retry_after=RETRY_AFTER_OVERLOADED):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(f"Servidor saturado en '{name}', reintenta en {retry_after}s")
+
+
+class EndpointLimiter:
+    """
+    Acota un endpoint: a lo sumo max_concurrent llamadas ejecutándose en
+    su pool de hilos (del mismo tamaño) y max_queue esperando turno; las
+    demás se rechazan al instante (OverloadedError) en vez de acumularse
+    sin límite.
+
+    Los contadores solo se tocan desde el event loop (un solo hilo).
+    """
+
+    def __init__(self, name, max_concurrent, max_queue):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._executor = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix=self.name)
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn, *args, **kwargs):
+        """Ejecuta fn(*args, **kwargs) en el pool del endpoint sin bloquear el event loop."""
+        if self.pending >= self.max_concurrent + self.max_queue:
+            self.rejected += 1
+            raise OverloadedError(self.name)
+
+        self.pending += 1
+        try:
+            async with self._semaphore:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self.executor(), functools.partial(fn, *args, **kwargs))
+            self.completed += 1
+            return result
+        finally:
+            self.pending -= 1
+
+    def stats(self):
+        return {
+            "running": min(self.pending, self.max_concurrent),
+            "queued": max(0, self.pending - self.max_concurrent),
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+LIMITERS = {}
+
+
+def endpoint_limiter(name):
+    """Limitador del endpoint `name` (límites de ENDPOINT_LIMITS)."""
+    if name not in LIMITERS:
+        LIMITERS[name] = EndpointLimiter(name, *ENDPOINT_LIMITS.get(name, DEFAULT_LIMITS))
+    return LIMITERS[name]
+
+
+def limiters_status():
+    return {name: limiter.stats() for name, limiter in LIMITERS.items()}
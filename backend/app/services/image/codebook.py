@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import joblib
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from app.services.image.sparse_index import model_path
+from app.services.image.vocab_tree import VocabularyTree
+
+# Entrenamiento en streaming (partial_fit) del diccionario visual
+STREAM_BATCH_SIZE = 20_000      # descriptores por mini-batch (memoria acotada)
+STREAM_EPOCHS = 1               # pasadas completas sobre los descriptores
+LOG_EVERY = 10                  # mini-batches entre mediciones de inercia
+CHECKPOINT_EVERY = 50           # mini-batches entre checkpoints
+MAX_NO_IMPROVEMENT = 10         # mediciones sin mejora antes de cortar la época
+EWA_ALPHA = 0.3                 # suavizado de la inercia medida
+
+CHECKPOINT_FILE = "codebook_checkpoint.pkl"
+TRAINING_LOG_FILE = "codebook_training_log.json"
+CODEBOOK_META_FILE = "codebook.json"   # dentro de MODEL_DIR, junto a los centroides
+PREDICT_CHUNK = 4096
+
+
+# ============================================================
+# CODEBOOK PLANO DESDE ARREGLOS (SIN SKLEARN NI PICKLE)
+# ============================================================
+
+class FlatCodebook:
+    """
+    Codebook plano a partir de la matriz de centroides (puede ser mmap).
+    Misma interfaz que MiniBatchKMeans para la asignación
+    (n_clusters, cluster_centers_, predict).
+    """
+
+    def __init__(self, centers):
+        self.cluster_centers_ = centers
+        self.n_clusters = centers.shape[0]
+        self._sq_norms = np.einsum("kd,kd->k", centers, centers)
+
+    def predict(self, X):
+        # argmin ||x - c||^2 = argmin (||c||^2 - 2 x.c)
+        X = np.asarray(X, dtype=self.cluster_centers_.dtype)
+        words = np.empty(len(X), dtype=np.int64)
+        for start in range(0, len(X), PREDICT_CHUNK):
+            dots = X[start:start + PREDICT_CHUNK] @ self.cluster_centers_.T
+            words[start:start + len(dots)] = np.argmin(self._sq_norms - 2 * dots, axis=1)
+        return words
+
+
+def codebook_exists(models_dir):
+    return os.path.exists(model_path(models_dir, CODEBOOK_META_FILE))
+
+
+def save_codebook(models_dir, codebook):
+    """
+    Guarda los centroides como .npy en MODEL_DIR:
+      plano -> centroids.npy
+      árbol -> tree_level_<l>.npy (un arreglo por nivel)
+    """
+    out_dir = model_path(models_dir)
+    if not os.path.exists(out_dir): os.makedirs(out_dir)
+
+    if isinstance(codebook, VocabularyTree):
+        for level, centers in enumerate(codebook.level_centers):
+            np.save(os.path.join(out_dir, f"tree_level_{level}.npy"), centers)
+        meta = {"type": "tree", "branch": codebook.branch, "depth": codebook.depth}
+    else:
+        np.save(os.path.join(out_dir, "centroids.npy"), codebook.cluster_centers_)
+        meta = {"type": "flat"}
+
+    meta["n_clusters"] = int(codebook.n_clusters)
+    with open(os.path.join(out_dir, CODEBOOK_META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+
+def load_codebook(models_dir):
+    """Abre el codebook (plano o árbol) con mmap."""
+    with open(model_path(models_dir, CODEBOOK_META_FILE), encoding="utf-8") as f:
+        meta = json.load(f)
+
+    if meta["type"] == "tree":
+        levels = [
+            np.load(model_path(models_dir, f"tree_level_{level}.npy"), mmap_mode="r")
+            for level in range(meta["depth"])
+        ]
+        return VocabularyTree.from_levels(meta["branch"], meta["depth"], levels)
+
+    return FlatCodebook(np.load(model_path(models_dir, "centroids.npy"), mmap_mode="r"))
+
+
+# ============================================================
+# ASIGNACIÓN DE PALABRAS VISUALES
+# ============================================================
+
+def predict_words(kmeans, descriptors):
+    """
+    kmeans.predict con el dtype de los centroides: un codebook entrenado
+    en streaming es float32 y uno entrenado con fit() es float64, y
+    sklearn exige que coincidan.
+    """
+    return kmeans.predict(np.asarray(descriptors, dtype=kmeans.cluster_centers_.dtype))
+
+
+# ============================================================
+# ENTRENAMIENTO EN STREAMING (partial_fit)
+# ============================================================
+
+def _image_order(n_images, epoch, seed):
+    """Permutación reproducible de imágenes para una época."""
+    return np.random.default_rng(seed + epoch).permutation(n_images)
+
+
+def _iter_batches(store, order, start_pos, batch_size):
+    """
+    Agrupa imágenes (en el orden dado) hasta juntar batch_size descriptores.
+    Genera (posición siguiente en `order`, batch float32).
+    Solo un batch vive en RAM a la vez; el resto queda en el memmap.
+    """
+    parts, rows = [], 0
+    pos = start_pos
+
+    while pos < len(order):
+        des = store.get(order[pos])
+        pos += 1
+        if des is None:
+            continue
+
+        parts.append(des)
+        rows += len(des)
+
+        if rows >= batch_size:
+            yield pos, np.vstack(parts).astype(np.float32)
+            parts, rows = [], 0
+
+    if parts:
+        yield pos, np.vstack(parts).astype(np.float32)
+
+
+def _save_checkpoint(path, state):
+    # Escritura atómica: un corte a mitad no deja un checkpoint corrupto
+    tmp_path = path + ".tmp"
+    joblib.dump(state, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def train_codebook_streaming(store, n_clusters, output_dir, batch_size=STREAM_BATCH_SIZE,
+                             epochs=STREAM_EPOCHS, max_images=None, seed=42, resume=True):
+    """
+    Entrena el codebook con MiniBatchKMeans.partial_fit recorriendo los
+    descriptores de TODAS las imágenes de la caché (o de max_images) en
+    mini-batches float32, sin apilar la muestra completa en float64.
+
+    - Inercia: antes de cada partial_fit (cada LOG_EVERY batches) se mide
+      la inercia media por descriptor del batch con los centroides actuales,
+      o sea sobre datos aún no vistos en esa época. Se guarda en
+      TRAINING_LOG_FILE y se corta la época si no mejora en
+      MAX_NO_IMPROVEMENT mediciones seguidas.
+    - Checkpoint: cada CHECKPOINT_EVERY batches se guarda el modelo y la
+      posición (época, imagen); con resume=True se continúa desde ahí.
+
+    Retorna: el MiniBatchKMeans entrenado (centroides float32)
+    """
+    # El primer partial_fit inicializa con k-means++ sobre ese batch
+    batch_size = max(batch_size, 3 * n_clusters)
+
+    checkpoint_path = os.path.join(output_dir, CHECKPOINT_FILE)
+    log_path = os.path.join(output_dir, TRAINING_LOG_FILE)
+
+    n_images = len(store) if max_images is None else min(max_images, len(store))
+
+    state = None
+    if resume and os.path.exists(checkpoint_path):
+        state = joblib.load(checkpoint_path)
+        if state["n_clusters"] != n_clusters or state["n_images"] != n_images or state["seed"] != seed:
+            print("[CODEBOOK] El checkpoint es de otra configuración, se ignora")
+            state = None
+        else:
+            print(f"[CODEBOOK] Reanudando desde época {state['epoch'] + 1}, imagen {state['pos']} de {n_images}")
+
+    if state is None:
+        state = {
+            "kmeans": MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size, n_init=1, random_state=seed),
+            "n_clusters": n_clusters, "n_images": n_images, "seed": seed,
+            "epoch": 0, "pos": 0, "batches": 0, "best": None, "no_improvement": 0, "log": [],
+        }
+
+    kmeans = state["kmeans"]
+    ewa = state["log"][-1]["ewa_inertia"] if state["log"] else None
+    start = time.time()
+
+    while state["epoch"] < epochs:
+        # Muestra fija (las primeras max_images de una permutación) y orden por época
+        subset = _image_order(len(store), 0, seed)[:n_images]
+        order = subset[_image_order(n_images, state["epoch"], seed)]
+
+        for pos, batch in _iter_batches(store, order, state["pos"], batch_size):
+            fitted = hasattr(kmeans, "cluster_centers_")
+
+            if fitted and state["batches"] % LOG_EVERY == 0:
+                inertia = -kmeans.score(batch) / len(batch)
+                ewa = inertia if ewa is None else EWA_ALPHA * inertia + (1 - EWA_ALPHA) * ewa
+
+                state["log"].append({
+                    "epoch": state["epoch"], "batch": state["batches"], "images": pos,
+                    "inertia": float(inertia), "ewa_inertia": float(ewa),
+                    "elapsed": round(time.time() - start, 2),
+                })
+                print(f"[CODEBOOK] época {state['epoch'] + 1} batch {state['batches']} "
+                      f"({pos}/{n_images} imágenes): inercia {inertia:.1f} (ewa {ewa:.1f})")
+
+                if state["best"] is None or ewa < state["best"]:
+                    state["best"], state["no_improvement"] = ewa, 0
+                else:
+                    state["no_improvement"] += 1
+
+            kmeans.partial_fit(batch)
+            state["batches"] += 1
+            state["pos"] = pos
+
+            if state["batches"] % CHECKPOINT_EVERY == 0:
+                _save_checkpoint(checkpoint_path, state)
+
+            if state["no_improvement"] >= MAX_NO_IMPROVEMENT:
+                print(f"[CODEBOOK] Sin mejora en {MAX_NO_IMPROVEMENT} mediciones, fin de la época")
+                break
+
+        state["epoch"] += 1
+        state["pos"] = 0
+        state["no_improvement"] = 0
+        _save_checkpoint(checkpoint_path, state)
+
+    with open(log_path, "w", encoding="utf-8") as f:
+        json.dump(state["log"], f, indent=1)
+
+    print(f"[CODEBOOK] {state['batches']} mini-batches en {time.time() - start:.1f}s, log en {log_path}")
+    return kmeans
@@ -0,0 +1,297 @@
+import os
+import sys
+import json
+import time
+import shutil
+import numpy as np
+import scipy.sparse as sp
+from app.services.image.codebook import load_codebook, predict_words
+from app.services.image.feature_extractor import (
+    check_image_limits, extract_descriptors, ImageTooLargeError, UnsupportedImageError
+)
+from app.services.executors import cpu_executor
+from app.services.image.thumbnails import append_thumbnails
+from app.services.image.sparse_index import (
+    model_path, save_array, build_tf_matrix, apply_idf, normalize_rows, top_k,
+    save_sparse_models, load_sparse_models, load_tf_matrix, load_manifest, publish_manifest, model_lock
+)
+
+# Segmento delta: imágenes agregadas después del último build/compactación
+DELTA_DIR = "delta"                 # dentro de MODEL_DIR
+DELTA_MANIFEST = "delta.json"
+COMPACT_RATIO = 0.10                # compactar cuando el delta supera el 10% de la base
+DATA_DIR = "data/fashion/images"
+MODELS_DIR = "data/fashion/models"
+
+
+def delta_path(models_dir, name=""):
+    return os.path.join(model_path(models_dir, DELTA_DIR), name)
+
+
+# ============================================================
+# LECTURA DEL SEGMENTO DELTA
+# ============================================================
+
+class DeltaSegment:
+    """
+    Imágenes agregadas con add_images, pendientes de compactar.
+
+    Guarda los histogramas TF (sin idf) y el df de sus palabras, así el
+    idf y las normas globales se recalculan recién al compactar. Hasta
+    entonces el delta se puntúa con el idf de la base, para que sus
+    scores sean comparables con los de la base y se puedan mezclar.
+    """
+
+    def __init__(self, tf_csr, img_ids, df):
+        self.tf_csr = tf_csr
+        self.img_ids = img_ids
+        self.df = df
+        self.normalized = None
+
+    def __len__(self):
+        return len(self.img_ids)
+
+    @classmethod
+    def load(cls, models_dir):
+        """Retorna el segmento, o None si no hay imágenes pendientes."""
+        manifest_path = delta_path(models_dir, DELTA_MANIFEST)
+        if not os.path.exists(manifest_path):
+            return None
+
+        with open(manifest_path, encoding="utf-8") as f:
+            meta = json.load(f)
+
+        arrays = tuple(np.load(delta_path(models_dir, f"tf_{part}.npy")) for part in ("data", "indices", "indptr"))
+        tf_csr = sp.csr_matrix(arrays, shape=(meta["n_images"], meta["n_words"]))
+        img_ids = [str(i) for i in np.load(delta_path(models_dir, "img_ids.npy"))]
+        df = np.load(delta_path(models_dir, "df.npy"))
+        return cls(tf_csr, img_ids, df)
+
+    def weight(self, idf):
+        """TF-IDF normalizado del delta con el idf dado (el de la base)."""
+        tfidf, norms = apply_idf(self.tf_csr, idf)
+        self.normalized = normalize_rows(tfidf, norms)
+        return self
+
+    def search(self, q, k):
+        """q: query TF-IDF normalizada. Retorna [(img_id, score)]."""
+        if self.normalized is None or len(self) == 0:
+            return []
+        scores = self.normalized @ q
+        return [(self.img_ids[i], scores[i]) for i in top_k(scores, k) if scores[i] > 0]
+
+
+def merge_results(base, delta, k):
+    """Mezcla dos listas [(img_id, score)] y deja las k de mayor score."""
+    if not delta:
+        return base
+    return sorted(base + delta, key=lambda r: r[1], reverse=True)[:k]
+
+
+def delta_mtime(models_dir):
+    """mtime del manifest del delta (0 si no hay): el motor lo usa para recargar."""
+    try:
+        return os.path.getmtime(delta_path(models_dir, DELTA_MANIFEST))
+    except FileNotFoundError:   # sin delta, o compact lo está borrando
+        return 0
+
+
+def _write_delta(models_dir, tf_csr, img_ids, df):
+    out_dir = delta_path(models_dir)
+    if not os.path.exists(out_dir): os.makedirs(out_dir)
+
+    save_array(os.path.join(out_dir, "tf_data.npy"), tf_csr.data.astype(np.float32))
+    save_array(os.path.join(out_dir, "tf_indices.npy"), tf_csr.indices.astype(np.int32))
+    save_array(os.path.join(out_dir, "tf_indptr.npy"), tf_csr.indptr.astype(np.int64))
+    save_array(os.path.join(out_dir, "img_ids.npy"), np.asarray(img_ids, dtype=str))
+    save_array(os.path.join(out_dir, "df.npy"), df.astype(np.int64))
+
+    # El manifest al final: su mtime avisa a los motores que hay datos nuevos
+    tmp_path = os.path.join(out_dir, DELTA_MANIFEST + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"n_images": tf_csr.shape[0], "n_words": tf_csr.shape[1]}, f)
+    os.replace(tmp_path, os.path.join(out_dir, DELTA_MANIFEST))
+
+
+def clear_delta(models_dir):
+    path = delta_path(models_dir)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+
+
+# ============================================================
+# AGREGAR IMÁGENES
+# ============================================================
+
+def add_images(image_paths, models_dir=MODELS_DIR, data_dir=DATA_DIR, compact_ratio=COMPACT_RATIO):
+    """
+    Agrega imágenes sin reindexar: SIFT solo de las nuevas, palabras
+    visuales con el codebook existente y append al segmento delta
+    (TF + df). Las imágenes se copian a data_dir para que /static las sirva.
+    SIFT corre en el pool de procesos de la API (cpu_executor), igual que
+    las búsquedas: el proceso que llama no cambia su configuración de cv2.
+
+    Compacta automáticamente si el delta supera compact_ratio de la base.
+
+    Leer el delta, sumarle las nuevas y reescribirlo va bajo el lock
+    exclusivo del modelo: dos workers (o un script) agregando a la vez
+    perderían uno de los lotes.
+
+    Las imágenes que superan los límites de feature_extractor no se copian
+    ni se indexan; se reportan en "rejected" sin abortar el lote.
+
+    Retorna: {"added": [...], "skipped": [...], "rejected": [{"id", "error"}],
+              "delta_size": n, "compacted": bool}
+    """
+    with model_lock(models_dir):
+        return _add_images(image_paths, models_dir, data_dir, compact_ratio)
+
+
+def _add_images(image_paths, models_dir, data_dir, compact_ratio):
+    codebook = load_codebook(models_dir)
+    _, _, base_ids, _, _ = load_sparse_models(models_dir)
+    delta = DeltaSegment.load(models_dir)
+
+    known = set(str(i) for i in base_ids)
+    if delta is not None:
+        known.update(delta.img_ids)
+
+    new_paths, new_ids, skipped, rejected = [], [], [], []
+    for path in image_paths:
+        img_id = os.path.basename(path)
+        if img_id in known:
+            skipped.append(img_id)
+            continue
+
+        try:
+            with open(path, "rb") as f:
+                check_image_limits(f.read())
+        except (ImageTooLargeError, UnsupportedImageError) as e:
+            rejected.append({"id": img_id, "error": str(e)})
+            continue
+        known.add(img_id)
+
+        target = os.path.join(data_dir, img_id)
+        if os.path.abspath(path) != os.path.abspath(target):
+            shutil.copyfile(path, target)
+
+        new_paths.append(target)
+        new_ids.append(img_id)
+
+    if not new_paths:
+        return {
+            "added": [], "skipped": skipped, "rejected": rejected,
+            "delta_size": len(delta) if delta else 0, "compacted": False
+        }
+
+    start = time.time()
+    word_rows = [
+        predict_words(codebook, des) if des is not None and len(des) > 0 else None
+        for des in cpu_executor().map(extract_descriptors, new_paths, chunksize=16)
+    ]
+    tf_new, df_new = build_tf_matrix(word_rows, codebook.n_clusters)
+
+    if delta is not None:
+        tf_csr = sp.vstack([delta.tf_csr, tf_new], format="csr")
+        img_ids = delta.img_ids + new_ids
+        df = delta.df + df_new
+    else:
+        tf_csr, img_ids, df = tf_new, new_ids, df_new
+
+    _write_delta(models_dir, tf_csr, img_ids, df)
+    append_thumbnails(new_paths, models_dir)
+    print(f"[DELTA] {len(new_ids)} imágenes agregadas en {time.time() - start:.1f}s ({len(img_ids)} en el delta)")
+
+    compacted = False
+    n_base = load_manifest(models_dir)["n_images"]
+    if len(img_ids) >= compact_ratio * n_base:
+        _compact(models_dir)
+        compacted = True
+
+    return {
+        "added": new_ids, "skipped": skipped, "rejected": rejected,
+        "delta_size": 0 if compacted else len(img_ids), "compacted": compacted
+    }
+
+
+# ============================================================
+# COMPACTACIÓN: BASE + DELTA -> NUEVA BASE
+# ============================================================
+
+def compact(models_dir=MODELS_DIR):
+    """
+    Une el delta a la base: df global = df base + df delta, idf y normas
+    recalculados para TODAS las imágenes, y se regeneran las estructuras
+    derivadas que existan (SQ, PQ con sus codebooks actuales, HNSW
+    insertando solo los nodos nuevos).
+
+    El manifest se publica recién cuando todo está escrito: un motor que
+    recarga nunca ve la base nueva con SQ, PQ o HNSW de la anterior.
+    Corre bajo el lock exclusivo del modelo (como add_images).
+    """
+    with model_lock(models_dir):
+        _compact(models_dir)
+
+
+def _compact(models_dir):
+    from app.services.image.hnsw import HNSWIndex, hnsw_exists
+    from app.services.image.quantized import (
+        load_scalar, load_product, build_scalar_codes, save_scalar, encode_product, save_product
+    )
+
+    delta = DeltaSegment.load(models_dir)
+    if delta is None or len(delta) == 0:
+        print("[DELTA] No hay imágenes pendientes de compactar")
+        return
+
+    start = time.time()
+    _, _, base_ids, _, _ = load_sparse_models(models_dir)
+    base_tf = load_tf_matrix(models_dir)
+
+    tf_csr = sp.vstack([base_tf, delta.tf_csr], format="csr")
+    img_ids = [str(i) for i in base_ids] + delta.img_ids
+    N = tf_csr.shape[0]
+
+    # df de la base = entradas por columna de sus histogramas
+    df = np.bincount(base_tf.indices, minlength=base_tf.shape[1]) + delta.df
+    idf = np.log(N / (df + 1))
+
+    # Se conservan las palabras stop y el tope de postings del build
+    manifest = load_manifest(models_dir)
+    stop_words = manifest.get("stop_words", [])
+    idf[stop_words] = 0
+    tfidf_csr, norms = apply_idf(tf_csr, idf)
+
+    had_sq = load_scalar(models_dir) is not None
+    pq = load_product(models_dir)
+    pq_codebooks = np.array(pq[1]) if pq is not None else None
+    hnsw = HNSWIndex.load(models_dir, np.zeros((0, 0), dtype=np.float32)) if hnsw_exists(models_dir) else None
+
+    new_manifest = save_sparse_models(models_dir, tfidf_csr, img_ids, norms, idf, tf_csr=tf_csr,
+                                      stop_words=stop_words, max_postings=manifest.get("max_postings"),
+                                      publish=False)
+
+    X_norm = normalize_rows(tfidf_csr, norms)
+    if had_sq:
+        save_scalar(models_dir, *build_scalar_codes(X_norm))
+    if pq_codebooks is not None:
+        save_product(models_dir, encode_product(X_norm, pq_codebooks), pq_codebooks)
+    if hnsw is not None:
+        hnsw.add_items(X_norm)
+        hnsw.save(models_dir)
+
+    publish_manifest(models_dir, new_manifest)
+    clear_delta(models_dir)
+    print(f"[DELTA] Compactación: {len(delta)} imágenes unidas a la base ({N} en total) en {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    # Uso:
+    #   python -m app.services.image.delta_segment add img1.jpg img2.jpg ...
+    #   python -m app.services.image.delta_segment compact
+    if len(sys.argv) > 2 and sys.argv[1] == "add":
+        print(add_images(sys.argv[2:]))
+    elif len(sys.argv) > 1 and sys.argv[1] == "compact":
+        compact()
+    else:
+        print("Uso: python -m app.services.image.delta_segment add <imagenes...> | compact")
@@ -0,0 +1,127 @@
+import os
+import json
+import random
+import numpy as np
+from app.services.image.codebook import predict_words
+
+# Archivos del almacén (dentro de store_dir)
+DESCRIPTORS_FILE = "descriptors.bin"   # todos los descriptores contiguos (uint8, fila = 128 valores)
+OFFSETS_FILE = "offsets.npy"           # imagen i -> filas [offsets[i], offsets[i+1])
+IMG_IDS_FILE = "img_ids.npy"
+META_FILE = "meta.json"
+
+DESCRIPTOR_DIM = 128
+
+
+# ============================================================
+# ESCRITURA (UNA SOLA EXTRACCIÓN)
+# ============================================================
+
+def write_descriptor_store(store_dir, img_ids, descriptors_iter, params=None):
+    """
+    Escribe el almacén en streaming (no acumula los descriptores en RAM).
+
+    img_ids: lista de ids, en el mismo orden que descriptors_iter
+    descriptors_iter: iterable de matrices (n_i, 128) o None
+    params: parámetros de extracción (feature_extractor.extraction_params)
+
+    Los descriptores SIFT de OpenCV son enteros en [0, 255] guardados como
+    float32, así que se almacenan como uint8 sin pérdida (4x menos espacio).
+    """
+    if not os.path.exists(store_dir): os.makedirs(store_dir)
+
+    offsets = [0]
+    with open(os.path.join(store_dir, DESCRIPTORS_FILE), "wb") as f:
+        for des in descriptors_iter:
+            if des is not None and len(des) > 0:
+                f.write(np.clip(np.rint(des), 0, 255).astype(np.uint8).tobytes())
+                offsets.append(offsets[-1] + len(des))
+            else:
+                offsets.append(offsets[-1])
+
+    np.save(os.path.join(store_dir, OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+    np.save(os.path.join(store_dir, IMG_IDS_FILE), np.asarray(img_ids))
+
+    with open(os.path.join(store_dir, META_FILE), "w") as f:
+        json.dump({"count": offsets[-1], "dim": DESCRIPTOR_DIM, "dtype": "uint8", "params": params}, f)
+
+    print(f"[DESCRIPTORES] {offsets[-1]} descriptores de {len(img_ids)} imágenes -> {store_dir}")
+
+
+# ============================================================
+# LECTURA (MEMORY-MAPPED)
+# ============================================================
+
+class DescriptorStore:
+    """
+    Acceso a los descriptores de todas las imágenes sin decodificarlas:
+    la matriz completa se abre con np.memmap y cada imagen es un slice.
+    """
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, META_FILE)) as f:
+            meta = json.load(f)
+
+        self.offsets = np.load(os.path.join(store_dir, OFFSETS_FILE))
+        self.img_ids = [str(i) for i in np.load(os.path.join(store_dir, IMG_IDS_FILE))]
+        # Cachés anteriores no guardaban parámetros: None nunca coincide
+        self.params = meta.get("params")
+
+        count = meta["count"]
+        if count > 0:
+            self.descriptors = np.memmap(
+                os.path.join(store_dir, DESCRIPTORS_FILE),
+                dtype=np.uint8, mode="r", shape=(count, meta["dim"])
+            )
+        else:
+            self.descriptors = np.zeros((0, meta["dim"]), dtype=np.uint8)
+
+    @staticmethod
+    def exists(store_dir):
+        return os.path.exists(os.path.join(store_dir, META_FILE))
+
+    def __len__(self):
+        return len(self.img_ids)
+
+    @property
+    def total_descriptors(self):
+        return len(self.descriptors)
+
+    def get(self, i):
+        """Descriptores (n_i, 128) uint8 de la imagen i, o None si no tiene."""
+        start, end = self.offsets[i], self.offsets[i + 1]
+        if start == end: return None
+        return self.descriptors[start:end]
+
+    def sample(self, n_images, seed=42):
+        """Descriptores apilados (float32) de una muestra reproducible de imágenes."""
+        idx = random.Random(seed).sample(range(len(self)), min(n_images, len(self)))
+        parts = [self.get(i) for i in sorted(idx)]
+        parts = [p for p in parts if p is not None]
+        if not parts: return np.zeros((0, self.descriptors.shape[1]), dtype=np.float32)
+        return np.vstack(parts).astype(np.float32)
+
+    def iter_chunks(self, chunk_size=500_000):
+        """Recorre TODOS los descriptores en bloques contiguos (float32)."""
+        for start in range(0, self.total_descriptors, chunk_size):
+            yield start, np.asarray(self.descriptors[start:start + chunk_size], dtype=np.float32)
+
+    def assign_words(self, kmeans, chunk_size=500_000):
+        """
+        Palabra visual de cada descriptor (predict por bloques grandes)
+        y reparto por imagen.
+
+        Retorna: lista (una por imagen) de arreglos int32, o None si no tiene descriptores.
+        """
+        labels = np.empty(self.total_descriptors, dtype=np.int32)
+        for start, chunk in self.iter_chunks(chunk_size):
+            labels[start:start + len(chunk)] = predict_words(kmeans, chunk)
+
+        return self.split_labels(labels)
+
+    def split_labels(self, labels):
+        """Reparte las palabras de todos los descriptores (en orden) por imagen."""
+        return [
+            labels[self.offsets[i]:self.offsets[i + 1]] if self.offsets[i + 1] > self.offsets[i] else None
+            for i in range(len(self))
+        ]
@@ -1,32 +1,248 @@
 import cv2
 import numpy as np
 
+# Límites de entrada (consultas subidas por HTTP)
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024    # 10 MB
+MAX_PIXELS = 40_000_000                # ancho x alto declarado en la cabecera
+
+# Lado mayor canónico: el de las imágenes del catálogo (60x80). Toda imagen
+# (indexada o de consulta) más grande se reduce a este tamaño antes de SIFT,
+# así la latencia no depende de la resolución subida y los descriptores de
+# la consulta salen a la misma escala que los indexados.
+CANONICAL_MAX_SIDE = 80
+
+# Keypoints SIFT por imagen (catálogo y consultas)
+SIFT_FEATURES = 100
+
+# Decodificación JPEG a 1/2, 1/4 o 1/8 de resolución (libjpeg escala en la IDCT)
+_REDUCED_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+
+
+class ImageTooLargeError(ValueError):
+    """La imagen supera MAX_UPLOAD_BYTES o MAX_PIXELS."""
+
+
+class UnsupportedImageError(ValueError):
+    """Formato sin cabecera reconocible: no se puede validar MAX_PIXELS antes de decodificar."""
+
+
+# ============================================================
+# CABECERAS (TAMAÑO SIN DECODIFICAR)
+# ============================================================
+
+def _jpeg_size(data):
+    """(ancho, alto) leído del marcador SOF de un JPEG, o None."""
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+            continue
+
+        # SOF0..SOF15 (excepto DHT, JPG y DAC, que comparten el rango)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(data[i + 5:i + 7], "big")
+            width = int.from_bytes(data[i + 7:i + 9], "big")
+            return width, height
+
+        i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    return None
+
+
+def _webp_size(data):
+    """(ancho, alto) del chunk VP8 / VP8L / VP8X de un WebP, o None."""
+    chunk = data[12:16]
+    if chunk == b"VP8 " and len(data) >= 30 and data[23:26] == b"\x9d\x01\x2a":
+        return int.from_bytes(data[26:28], "little") & 0x3FFF, int.from_bytes(data[28:30], "little") & 0x3FFF
+    if chunk == b"VP8L" and len(data) >= 25 and data[20] == 0x2F:
+        bits = int.from_bytes(data[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X" and len(data) >= 30:
+        return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+    return None
+
+
+def _bmp_size(data):
+    """(ancho, alto) del encabezado DIB de un BMP, o None."""
+    if len(data) < 26:
+        return None
+    if int.from_bytes(data[14:18], "little") == 12:   # BITMAPCOREHEADER (OS/2)
+        return int.from_bytes(data[18:20], "little"), int.from_bytes(data[20:22], "little")
+    # El alto es negativo en los BMP guardados de arriba hacia abajo
+    width = int.from_bytes(data[18:22], "little", signed=True)
+    height = int.from_bytes(data[22:26], "little", signed=True)
+    return abs(width), abs(height)
+
+
+def _tiff_size(data):
+    """(ancho, alto) de las etiquetas 256/257 del primer IFD de un TIFF, o None."""
+    order = "little" if data[:2] == b"II" else "big"
+    offset = int.from_bytes(data[4:8], order)
+    if offset + 2 > len(data):
+        return None
+
+    size = {}
+    n_entries = int.from_bytes(data[offset:offset + 2], order)
+    for i in range(n_entries):
+        entry = data[offset + 2 + 12 * i:offset + 14 + 12 * i]
+        if len(entry) < 12:
+            break
+        tag, kind = int.from_bytes(entry[0:2], order), int.from_bytes(entry[2:4], order)
+        if tag in (256, 257):
+            # SHORT (3) ocupa los 2 primeros bytes del valor, LONG (4) los 4
+            size[tag] = int.from_bytes(entry[8:10] if kind == 3 else entry[8:12], order)
+    if 256 in size and 257 in size:
+        return size[256], size[257]
+    return None
+
+
+def image_size(data):
+    """
+    (ancho, alto, es_jpeg) desde la cabecera (JPEG, PNG, WebP, BMP o
+    TIFF), o None si el formato no se reconoce.
+    """
+    size = None
+    if data[:2] == b"\xff\xd8":
+        size = _jpeg_size(data)
+        return (*size, True) if size else None
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        size = int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+    elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        size = _webp_size(data)
+    elif data[:2] == b"BM":
+        size = _bmp_size(data)
+    elif data[:4] in (b"II*\x00", b"MM\x00*"):
+        size = _tiff_size(data)
+    return (*size, False) if size else None
+
+
+# ============================================================
+# DECODIFICACIÓN ACOTADA + TAMAÑO CANÓNICO
+# ============================================================
+
+def check_image_limits(data):
+    """
+    Lanza ImageTooLargeError si los bytes superan MAX_UPLOAD_BYTES o la
+    cabecera declara más de MAX_PIXELS, y UnsupportedImageError si el
+    formato no tiene una cabecera que image_size sepa leer (OpenCV lo
+    decodificaría sin que se haya validado su tamaño).
+    Retorna image_size(data).
+    """
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise ImageTooLargeError(f"La imagen pesa {len(data) / 1024 ** 2:.1f} MB (máximo {MAX_UPLOAD_BYTES / 1024 ** 2:.0f} MB)")
+
+    size = image_size(data)
+    if size is None:
+        raise UnsupportedImageError("Formato de imagen no soportado (se aceptan JPEG, PNG, WebP, BMP y TIFF)")
+    if size[0] * size[1] > MAX_PIXELS:
+        raise ImageTooLargeError(f"La imagen tiene {size[0]}x{size[1]} píxeles (máximo {MAX_PIXELS})")
+    return size
+
+
+def decode_image(data):
+    """
+    Decodifica bytes de imagen con costo acotado:
+      1. rechaza archivos > MAX_UPLOAD_BYTES, cabeceras > MAX_PIXELS y
+         formatos cuya cabecera no se sabe leer
+      2. JPEG: decodifica directamente a la menor escala 1/2, 1/4 u 1/8
+         cuyo lado mayor siga siendo >= CANONICAL_MAX_SIDE
+      3. reduce (INTER_AREA) al lado mayor canónico
+
+    Retorna: imagen BGR o None si no se pudo decodificar.
+    """
+    flag = cv2.IMREAD_COLOR
+    width, height, is_jpeg = check_image_limits(data)
+    if is_jpeg:
+        for factor, reduced_flag in _REDUCED_FLAGS.items():
+            if max(width, height) / factor >= CANONICAL_MAX_SIDE:
+                flag = reduced_flag
+                break
+
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+    if img is None:
+        return None
+
+    return to_canonical_size(img)
+
+
+def to_canonical_size(img):
+    """Reduce la imagen para que su lado mayor sea CANONICAL_MAX_SIDE (nunca amplía)."""
+    height, width = img.shape[:2]
+    if max(height, width) <= CANONICAL_MAX_SIDE:
+        return img
+
+    scale = CANONICAL_MAX_SIDE / max(height, width)
+    new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(img, new_size, interpolation=cv2.INTER_AREA)
+
+
+def extraction_params():
+    """
+    Parámetros que determinan los descriptores de una imagen. Se guardan
+    con la caché de descriptores: si cambian, la caché ya no sirve.
+    """
+    return {
+        "canonical_max_side": CANONICAL_MAX_SIDE,
+        "max_pixels": MAX_PIXELS,
+        "max_upload_bytes": MAX_UPLOAD_BYTES,
+        "sift_features": SIFT_FEATURES,
+    }
+
+
 class SIFTFeatureExtractor:
-    def __init__(self, n_features=100):
+    def __init__(self, n_features=SIFT_FEATURES):
         self.sift = cv2.SIFT_create(nfeatures=n_features)
 
     def extract(self, image_source):
         """
         Acepta ruta de archivo o bytes de imagen.
         Devuelve matriz de descriptores (N, 128).
+
+        Indexación y consulta pasan por el mismo decode_image, así que
+        ambas ven la imagen al mismo tamaño canónico.
+        Lanza ImageTooLargeError si la imagen supera los límites y
+        UnsupportedImageError si su formato no se puede validar.
         """
         try:
             if isinstance(image_source, str):
-                img = cv2.imread(image_source)
-            else:
-                # Convertir bytes a imagen OpenCV
-                nparr = np.frombuffer(image_source, np.uint8)
-                img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+                with open(image_source, "rb") as f:
+                    image_source = f.read()
 
+            img = decode_image(image_source)
             if img is None: return None
 
             # Escala de grises
             gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            
+
             # Extracción de vectores característicos
             keypoints, descriptors = self.sift.detectAndCompute(gray, None)
             return descriptors
-            
+
+        except (ImageTooLargeError, UnsupportedImageError):
+            raise
         except Exception as e:
             print(f"Error en SIFT: {e}")
-            return None
\ No newline at end of file
+            return None
+
+
+# Un extractor por proceso para los pools de procesos (no es serializable)
+_process_extractor = None
+
+
+def extract_descriptors(image_source):
+    """SIFT con el extractor del proceso actual (para ProcessPoolExecutor)."""
+    global _process_extractor
+    if _process_extractor is None:
+        cv2.setNumThreads(1)
+        _process_extractor = SIFTFeatureExtractor()
+    return _process_extractor.extract(image_source)
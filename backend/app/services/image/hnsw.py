@@ -0,0 +1,397 @@
+import os
+import heapq
+import numpy as np
+import scipy.sparse as sp
+from app.services.image.sparse_index import model_path, save_array
+
+# Parámetros por defecto (Malkov & Yashunin)
+HNSW_M = 16                  # vecinos por nodo en niveles >= 1 (nivel 0: 2 * M)
+HNSW_EF_CONSTRUCTION = 100   # tamaño de la lista de candidatos al insertar
+HNSW_EF_SEARCH = 64          # tamaño de la lista de candidatos al buscar (>= k)
+HNSW_PREFIX = "hnsw"          # MODEL_DIR/hnsw_<arreglo>.npy
+HNSW_LEGACY_FILE = "hnsw.npz"  # formato anterior (se lee completo en RAM)
+
+
+class HNSWIndex:
+    """
+    Grafo HNSW (Hierarchical Navigable Small World) sobre los vectores
+    TF-IDF normalizados: similitud = producto punto = coseno.
+
+    El índice guarda solo el grafo; los vectores (fila = imagen) se pasan
+    en build()/attach() y no se persisten aquí. Normalmente son la CSR
+    normalizada (en RAM al construir, abierta con mmap al servir): el
+    scoring de candidatos lee solo las filas visitadas y nunca se arma la
+    matriz densa N x K.
+
+    Persistencia (MODEL_DIR/hnsw_<arreglo>.npy, abiertos con mmap al cargar):
+      params     M, ef_construction, entry_point, max_level (se escribe último)
+      levels     (N,) nivel máximo de cada nodo
+      level0     (N, 2M) vecinos en el nivel 0 (-1 = vacío)
+      nodes_l    ids (ordenados) de los nodos presentes en el nivel l >= 1
+      neigh_l    (len(nodes_l), M) vecinos de esos nodos
+
+    Un índice cargado consulta directamente esas filas empaquetadas
+    (PackedLayer); recién add_items las pasa a dicts para poder insertar.
+    """
+
+    def __init__(self, M=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, seed=42):
+        self.M = M
+        self.M0 = 2 * M
+        self.ef_construction = ef_construction
+        self.level_mult = 1 / np.log(M)
+        self.rng = np.random.default_rng(seed)
+
+        self.vectors = None
+        self.levels = None
+        self.graph = []            # graph[l]: dict (o PackedLayer) nodo -> np.array de vecinos
+        self.entry_point = -1
+        self.max_level = -1
+
+    # ============================================================
+    # BÚSQUEDA EN UN NIVEL
+    # ============================================================
+
+    def _similarity(self, q, ids):
+        """Producto punto de q con las filas ids (denso o CSR)."""
+        if sp.issparse(self.vectors):
+            return csr_rows_dot(self.vectors, ids, q)
+        return self.vectors[ids] @ q
+
+    def _vector(self, node):
+        """Fila densa del nodo (para construir), armada desde indptr sin slicing de scipy."""
+        X = self.vectors
+        if sp.issparse(X):
+            start, end = X.indptr[node], X.indptr[node + 1]
+            row = np.zeros(X.shape[1], dtype=np.float32)
+            row[X.indices[start:end]] = X.data[start:end]
+            return row
+        return X[node]
+
+    def _search_layer(self, q, entry_points, entry_sims, ef, level, visited):
+        """
+        Búsqueda voraz con lista dinámica de tamaño ef.
+        Los vecinos de cada nodo expandido se evalúan en un solo producto.
+
+        Retorna: lista [(sim, nodo)] ordenada de mayor a menor similitud.
+        """
+        candidates = [(-s, e) for e, s in zip(entry_points, entry_sims)]   # max-heap
+        results = [(s, e) for e, s in zip(entry_points, entry_sims)]       # min-heap (tamaño ef)
+        heapq.heapify(candidates)
+        heapq.heapify(results)
+        visited[entry_points] = True
+
+        layer = self.graph[level]
+
+        while candidates:
+            neg_sim, node = heapq.heappop(candidates)
+            if -neg_sim < results[0][0] and len(results) >= ef:
+                break
+
+            neighbors = layer.get(node)
+            if neighbors is None or len(neighbors) == 0:
+                continue
+
+            new = neighbors[~visited[neighbors]]
+            if len(new) == 0:
+                continue
+            visited[new] = True
+
+            for sim, n in zip(self._similarity(q, new).tolist(), new.tolist()):
+                if len(results) < ef or sim > results[0][0]:
+                    heapq.heappush(candidates, (-sim, n))
+                    heapq.heappush(results, (sim, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+        return sorted(results, reverse=True)
+
+    def _greedy_descent(self, q, level_from, level_to):
+        """Bajada voraz (ef = 1) desde el punto de entrada hasta level_to."""
+        node = self.entry_point
+        sim = float(self._similarity(q, np.array([node]))[0])
+
+        for level in range(level_from, level_to, -1):
+            changed = True
+            while changed:
+                changed = False
+                neighbors = self.graph[level].get(node)
+                if neighbors is None or len(neighbors) == 0:
+                    break
+                sims = self._similarity(q, neighbors)
+                best = int(np.argmax(sims))
+                if sims[best] > sim:
+                    sim, node = float(sims[best]), int(neighbors[best])
+                    changed = True
+
+        return node, sim
+
+    # ============================================================
+    # CONSTRUCCIÓN
+    # ============================================================
+
+    def _pairwise(self, ids):
+        """Similitudes entre todas las filas ids (matriz len(ids) x len(ids))."""
+        rows = self.vectors[ids]
+        gram = rows @ rows.T
+        return gram.toarray() if sp.issparse(gram) else gram
+
+    def _select_neighbors(self, candidates, m):
+        """
+        Heurística de selección: un candidato entra si está más cerca del
+        nodo base que de cualquier vecino ya elegido (mantiene aristas en
+        direcciones distintas y el grafo navegable). Las similitudes entre
+        candidatos salen de un solo producto (sin una fila densa por par).
+
+        candidates: lista [(sim_con_base, nodo)] ordenada de mayor a menor
+        """
+        nodes = np.array([n for _, n in candidates], dtype=np.int64)
+        if len(candidates) <= m:
+            return nodes
+
+        gram = self._pairwise(nodes)
+        selected = []
+        for i, (sim, _) in enumerate(candidates):
+            if len(selected) >= m:
+                break
+            if not selected or np.all(gram[i, selected] < sim):
+                selected.append(i)
+
+        # Completar con los más cercanos descartados
+        if len(selected) < m:
+            chosen = set(selected)
+            for i in range(len(candidates)):
+                if len(selected) >= m:
+                    break
+                if i not in chosen:
+                    selected.append(i)
+
+        return nodes[selected]
+
+    def _insert(self, node, visited):
+        q = self._vector(node)
+        level = self.levels[node]
+
+        for l in range(level + 1):
+            self.graph[l][node] = np.zeros(0, dtype=np.int64)
+
+        if self.entry_point < 0:
+            self.entry_point, self.max_level = node, level
+            return
+
+        ep, ep_sim = self._greedy_descent(q, self.max_level, level)
+
+        entry, entry_sims = [ep], [ep_sim]
+        for l in range(min(level, self.max_level), -1, -1):
+            visited[:] = False
+            found = self._search_layer(q, np.array(entry), np.array(entry_sims), self.ef_construction, l, visited)
+
+            m_max = self.M0 if l == 0 else self.M
+            neighbors = self._select_neighbors(found, self.M)
+            self.graph[l][node] = neighbors
+
+            # Aristas de vuelta (recortando si el vecino se pasa de m_max)
+            for n in neighbors.tolist():
+                current = np.append(self.graph[l][n], node)
+                if len(current) > m_max:
+                    base = self._vector(n)
+                    sims = self._similarity(base, current)
+                    order = np.argsort(-sims)
+                    current = self._select_neighbors([(sims[i], current[i]) for i in order], m_max)
+                self.graph[l][n] = current
+
+            entry = [n for _, n in found]
+            entry_sims = [s for s, _ in found]
+
+        if level > self.max_level:
+            self.entry_point, self.max_level = node, level
+
+    def build(self, vectors, verbose=True):
+        """vectors: CSR o matriz densa (N, dim) con filas normalizadas."""
+        self.attach(vectors)
+        N = self.vectors.shape[0]
+
+        self.levels = np.floor(-np.log(self.rng.random(N)) * self.level_mult).astype(np.int32)
+        self.graph = [dict() for _ in range(int(self.levels.max()) + 1)]
+        self.entry_point, self.max_level = -1, -1
+
+        visited = np.zeros(N, dtype=bool)
+        for i in range(N):
+            self._insert(i, visited)
+            if verbose and (i + 1) % 5000 == 0:
+                print(f"[HNSW] {i + 1}/{N} nodos insertados")
+
+        return self
+
+    def add_items(self, vectors, verbose=True):
+        """
+        Inserta en el grafo las filas nuevas de `vectors` (las que están
+        después de las ya indexadas). Las filas existentes pueden traer
+        pesos actualizados: el grafo se mantiene y solo se reasocian.
+        """
+        n_old = len(self.levels)
+        self.attach(vectors)
+        N = self.vectors.shape[0]
+        if N <= n_old:
+            return self
+
+        # Niveles cargados con mmap (solo lectura) -> dicts modificables
+        self.graph = [layer.to_dict() if isinstance(layer, PackedLayer) else layer for layer in self.graph]
+
+        new_levels = np.floor(-np.log(self.rng.random(N - n_old)) * self.level_mult).astype(np.int32)
+        self.levels = np.concatenate([self.levels, new_levels])
+        while len(self.graph) <= int(self.levels.max()):
+            self.graph.append(dict())
+
+        visited = np.zeros(N, dtype=bool)
+        for i in range(n_old, N):
+            self._insert(i, visited)
+
+        if verbose:
+            print(f"[HNSW] {N - n_old} nodos agregados ({N} en total)")
+        return self
+
+    # ============================================================
+    # CONSULTA
+    # ============================================================
+
+    def search(self, q, k=8, ef_search=HNSW_EF_SEARCH):
+        """
+        q: vector de query normalizado (float32)
+        Retorna: (ids, sims) de los k vecinos aproximados, de mayor a menor.
+        """
+        if self.entry_point < 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        q = np.asarray(q, dtype=np.float32)
+        ep, ep_sim = self._greedy_descent(q, self.max_level, 0)
+
+        visited = np.zeros(self.vectors.shape[0], dtype=bool)
+        found = self._search_layer(q, np.array([ep]), np.array([ep_sim]), max(ef_search, k), 0, visited)[:k]
+
+        ids = np.array([n for _, n in found], dtype=np.int64)
+        sims = np.array([s for s, _ in found], dtype=np.float32)
+        return ids, sims
+
+    # ============================================================
+    # PERSISTENCIA
+    # ============================================================
+
+    @staticmethod
+    def _pack(layer, nodes, width):
+        packed = np.full((len(nodes), width), -1, dtype=np.int32)
+        for row, node in enumerate(nodes):
+            neighbors = layer.get(node)
+            packed[row, :len(neighbors)] = neighbors
+        return packed
+
+    def save(self, models_dir):
+        """
+        Un .npy por arreglo (save_array: temporal + os.replace) y params al
+        final, con el mismo papel que el manifest del modelo disperso.
+        """
+        N = len(self.levels)
+        save_array(hnsw_path(models_dir, "levels"), np.asarray(self.levels, dtype=np.int32))
+        save_array(hnsw_path(models_dir, "level0"), self._pack(self.graph[0], range(N), self.M0))
+        for l in range(1, len(self.graph)):
+            nodes = np.array(sorted(self.graph[l].keys()), dtype=np.int32)
+            save_array(hnsw_path(models_dir, f"nodes_{l}"), nodes)
+            save_array(hnsw_path(models_dir, f"neigh_{l}"), self._pack(self.graph[l], nodes.tolist(), self.M))
+
+        save_array(hnsw_path(models_dir, "params"),
+                   np.array([self.M, self.ef_construction, self.entry_point, self.max_level], dtype=np.int64))
+
+        legacy_path = model_path(models_dir, HNSW_LEGACY_FILE)
+        if os.path.exists(legacy_path): os.remove(legacy_path)
+
+    @classmethod
+    def load(cls, models_dir, vectors):
+        """
+        Abre el grafo con mmap: los niveles quedan empaquetados (sin dicts
+        por worker) y las páginas se comparten entre procesos.
+        vectors: CSR normalizada (mmap) o matriz densa.
+        """
+        if os.path.exists(hnsw_path(models_dir, "params")):
+            def read(name):
+                return np.load(hnsw_path(models_dir, name), mmap_mode="r")
+        else:
+            legacy = np.load(model_path(models_dir, HNSW_LEGACY_FILE))
+
+            def read(name):
+                return legacy[name]
+
+        M, ef_construction, entry_point, max_level = read("params").tolist()
+
+        index = cls(M, ef_construction)
+        index.entry_point, index.max_level = entry_point, max_level
+        index.levels = read("levels")
+
+        index.graph = [PackedLayer(read("level0"))]
+        for l in range(1, max_level + 1):
+            index.graph.append(PackedLayer(read(f"neigh_{l}"), read(f"nodes_{l}")))
+
+        index.attach(vectors)
+        return index
+
+    def attach(self, vectors):
+        """Asocia la matriz de vectores (misma fila = mismo nodo); CSR se usa tal cual."""
+        if sp.issparse(vectors):
+            self.vectors = vectors.tocsr()
+        else:
+            self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        return self
+
+
+class PackedLayer:
+    """
+    Nivel del grafo tal como está en disco: vecinos de cada nodo en una
+    fila de ancho fijo (-1 = vacío). nodes: ids ordenados de las filas
+    (None en el nivel 0, donde fila = nodo). Misma interfaz get() que un dict.
+    """
+
+    def __init__(self, neighbors, nodes=None):
+        self.neighbors = neighbors
+        self.nodes = nodes
+
+    def get(self, node, default=None):
+        row = node
+        if self.nodes is not None:
+            row = int(np.searchsorted(self.nodes, node))
+            if row >= len(self.nodes) or self.nodes[row] != node:
+                return default
+        neighbors = self.neighbors[row]
+        return neighbors[neighbors >= 0]
+
+    def keys(self):
+        return range(len(self.neighbors)) if self.nodes is None else self.nodes.tolist()
+
+    def to_dict(self):
+        return {int(node): np.asarray(self.get(node), dtype=np.int64) for node in self.keys()}
+
+
+def csr_rows_dot(X, ids, q):
+    """
+    X[ids] @ q sin armar la submatriz: junta los tramos de data/indices de
+    esas filas (CSR abierta con mmap) y suma por fila con bincount.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    starts = X.indptr[ids].astype(np.int64)
+    lengths = X.indptr[ids + 1] - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(len(ids), dtype=np.float32)
+
+    # Posición de cada entrada dentro de data/indices
+    offsets = np.cumsum(lengths) - lengths
+    pos = np.arange(total) + np.repeat(starts - offsets, lengths)
+    rows = np.repeat(np.arange(len(ids)), lengths)
+    products = X.data[pos] * q[X.indices[pos]]
+    return np.bincount(rows, weights=products, minlength=len(ids)).astype(np.float32)
+
+
+def hnsw_path(models_dir, name):
+    return model_path(models_dir, f"{HNSW_PREFIX}_{name}.npy")
+
+
+def hnsw_exists(models_dir):
+    return (os.path.exists(hnsw_path(models_dir, "params"))
+            or os.path.exists(model_path(models_dir, HNSW_LEGACY_FILE)))
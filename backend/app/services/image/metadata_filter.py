@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+# Columnas de styles.csv filtrables desde /image
+FILTER_COLUMNS = ("gender", "masterCategory", "subCategory", "articleType", "baseColour", "season", "year")
+
+
+class MetadataIndex:
+    """
+    Índice de metadata por fila del modelo: para cada columna de
+    FILTER_COLUMNS y cada valor, el arreglo ORDENADO de filas (int32) de
+    las imágenes con ese valor (equivalente a un bitmap comprimido: ocupa
+    4 bytes por imagen y columna).
+
+    Un filtro se resuelve con uniones dentro de cada columna (valores
+    separados por coma, rango de años) e intersecciones entre columnas.
+    Las imágenes sin fila en styles.csv no pasan ningún filtro.
+    """
+
+    def __init__(self, styles, img_ids):
+        """
+        styles: DataFrame de styles.csv indexado por id (str)
+        img_ids: ids del modelo ("10001.jpg"), en orden de fila
+        """
+        self.n_images = len(img_ids)
+        ids = [str(i).replace(".jpg", "") for i in img_ids]
+        meta = styles.reindex(ids).reset_index(drop=True)
+
+        self.rows = {}
+        for column in FILTER_COLUMNS:
+            values = meta[column] if column in meta else pd.Series(dtype=object)
+            if column == "year":
+                values = pd.to_numeric(values, errors="coerce").dropna().astype(int)
+            else:
+                values = values.dropna().astype(str).str.lower()
+
+            self.rows[column] = {
+                value: np.asarray(rows, dtype=np.int32)
+                for value, rows in values.groupby(values).indices.items()
+            }
+
+    def _column_rows(self, column, values):
+        """Unión de las filas de los valores pedidos en una columna."""
+        found = [self.rows[column][v] for v in values if v in self.rows[column]]
+        if not found:
+            return np.zeros(0, dtype=np.int32)
+        # Los valores de una columna son disjuntos: basta concatenar y ordenar
+        return np.sort(np.concatenate(found))
+
+    def select(self, filters):
+        """
+        filters: {columna: [valores]} con opcionales "year_min" / "year_max".
+        Retorna: arreglo ordenado de filas que cumplen todo, o None si no hay filtros.
+        """
+        selected = None
+
+        for column, values in filters.items():
+            if column in ("year_min", "year_max") or not values:
+                continue
+            if column == "year":
+                values = [int(v) for v in values]
+            else:
+                values = [str(v).lower() for v in values]
+            rows = self._column_rows(column, values)
+            selected = rows if selected is None else np.intersect1d(selected, rows, assume_unique=True)
+
+        year_min, year_max = filters.get("year_min"), filters.get("year_max")
+        if year_min is not None or year_max is not None:
+            years = [
+                y for y in self.rows["year"]
+                if (year_min is None or y >= year_min) and (year_max is None or y <= year_max)
+            ]
+            rows = self._column_rows("year", years)
+            selected = rows if selected is None else np.intersect1d(selected, rows, assume_unique=True)
+
+        return selected
+
+    def mask(self, rows):
+        """Bitmap booleano (n_images,) de las filas de select()."""
+        bitmap = np.zeros(self.n_images, dtype=bool)
+        bitmap[rows] = True
+        return bitmap
+
+    @staticmethod
+    def matches(meta, filters):
+        """Mismo filtro evaluado sobre un registro de meta_lookup (imágenes del delta)."""
+        for column, values in filters.items():
+            if column in ("year_min", "year_max") or not values:
+                continue
+            value = meta.get(column)
+            if value is None or pd.isna(value):
+                return False
+            if column == "year":
+                if int(value) not in [int(v) for v in values]:
+                    return False
+            elif str(value).lower() not in [str(v).lower() for v in values]:
+                return False
+
+        year_min, year_max = filters.get("year_min"), filters.get("year_max")
+        if year_min is not None or year_max is not None:
+            year = meta.get("year")
+            if year is None or pd.isna(year):
+                return False
+            if (year_min is not None and year < year_min) or (year_max is not None and year > year_max):
+                return False
+        return True
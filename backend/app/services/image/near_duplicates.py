@@ -0,0 +1,166 @@
+import os
+import sys
+import time
+import numpy as np
+import scipy.sparse as sp
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from app.services.image.sparse_index import load_normalized_matrix, load_sparse_models, model_path, save_array
+
+# Casi-duplicados: pares de imágenes con coseno TF-IDF >= DUP_THRESHOLD
+DUP_THRESHOLD = 0.90
+DUP_BLOCK_ROWS = 128         # filas por bloque del auto-producto (acota la memoria por worker)
+DUP_TILE_COLS = 4096         # imágenes por tile de columnas (transpuesto una sola vez por worker)
+DUP_IDS_FILE = "dup_ids.npy"          # img_ids que pertenecen a algún grupo
+DUP_GROUPS_FILE = "dup_groups.npy"    # grupo de cada uno (mismo orden)
+MODELS_DIR = "data/fashion/models"
+N_WORKERS = os.cpu_count() or 1
+
+# Matriz normalizada abierta con mmap en cada proceso (páginas compartidas)
+_worker_matrix = None
+# Tiles [(col_start, X[col_start:col_start + DUP_TILE_COLS].T en CSR)], armados una vez por proceso
+_worker_tiles = None
+
+
+# ============================================================
+# AUTO-PRODUCTO DISPERSO POR BLOQUES
+# ============================================================
+
+def _init_worker(models_dir, tile_cols=DUP_TILE_COLS):
+    global _worker_matrix, _worker_tiles
+    X = load_normalized_matrix(models_dir)
+    _worker_matrix = X
+    _worker_tiles = [(col, X[col:col + tile_cols].T.tocsr()) for col in range(0, X.shape[0], tile_cols)]
+
+
+def _block_pairs(args):
+    """
+    Pares (i, j) con i en [start, end), j > i y coseno >= threshold.
+
+    X[start:end] @ tile recorre, para cada palabra de las filas del
+    bloque, solo las imágenes del tile que la contienen (la fila de esa
+    palabra en la transpuesta): nunca se arma la matriz N x N. Los tiles
+    se transponen una vez por proceso, así ningún bloque copia X[start:];
+    los que quedan enteros antes de start se saltan y en el que contiene
+    start los pares con j <= i se descartan con la máscara.
+    """
+    start, end, threshold = args
+    block = _worker_matrix[start:end]
+
+    parts = []
+    for col_start, tile in _worker_tiles:
+        if col_start + tile.shape[1] <= start:
+            continue
+        sims = (block @ tile).tocoo()
+        rows = sims.row.astype(np.int64) + start
+        cols = sims.col.astype(np.int64) + col_start
+
+        keep = (sims.data >= threshold) & (cols > rows)
+        parts.append((rows[keep], cols[keep], sims.data[keep]))
+
+    return tuple(np.concatenate(part) for part in zip(*parts))
+
+
+def similar_pairs(models_dir=MODELS_DIR, threshold=DUP_THRESHOLD, block_rows=DUP_BLOCK_ROWS, n_workers=N_WORKERS):
+    """
+    Auto-similitud umbralizada de la matriz TF-IDF normalizada.
+    Retorna: (rows, cols, sims) de los pares con coseno >= threshold (i < j).
+    """
+    n_rows = load_normalized_matrix(models_dir).shape[0]
+    tasks = [(start, min(start + block_rows, n_rows), threshold) for start in range(0, n_rows, block_rows)]
+
+    if n_workers <= 1:
+        _init_worker(models_dir)
+        results = [_block_pairs(task) for task in tqdm(tasks, desc="Auto-similitud")]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(models_dir,)) as pool:
+            results = list(tqdm(pool.map(_block_pairs, tasks), total=len(tasks), desc="Auto-similitud"))
+
+    if not results:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.float32)
+    return tuple(np.concatenate(part) for part in zip(*results))
+
+
+# ============================================================
+# GRUPOS DE DUPLICADOS
+# ============================================================
+
+def find_duplicate_groups(models_dir=MODELS_DIR, threshold=DUP_THRESHOLD, block_rows=DUP_BLOCK_ROWS, n_workers=N_WORKERS):
+    """
+    Agrupa las imágenes a partir de los pares casi-duplicados y guarda los
+    grupos por img_id, así siguen valiendo tras agregar imágenes o compactar.
+
+    Agrupamiento por líder (no componentes conexas, que encadenan
+    variantes hasta formar grupos gigantes): las imágenes con más pares
+    van primero y cada una, si aún está libre, se lleva a sus vecinos
+    libres. Todo miembro es casi-duplicado de su líder.
+
+    Retorna: {grupo: [img_ids]} (solo grupos de 2 o más imágenes)
+    """
+    start = time.time()
+    _, _, img_ids, _, _ = load_sparse_models(models_dir)
+    n_rows = len(img_ids)
+
+    rows, cols, _ = similar_pairs(models_dir, threshold, block_rows, n_workers)
+    graph = sp.coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n_rows, n_rows)).tocsr()
+    graph = (graph + graph.T).tocsr()
+    degree = np.diff(graph.indptr)
+
+    labels = np.full(n_rows, -1, dtype=np.int64)
+    for leader in np.argsort(-degree, kind="stable")[:np.count_nonzero(degree)]:
+        if labels[leader] >= 0:
+            continue
+        members = graph.indices[graph.indptr[leader]:graph.indptr[leader + 1]]
+        members = members[labels[members] < 0]
+        if len(members) == 0:
+            continue
+        labels[leader] = leader
+        labels[members] = leader
+
+    grouped = np.flatnonzero(labels >= 0)
+    sizes = np.bincount(labels[grouped], minlength=1)
+
+    save_array(model_path(models_dir, DUP_GROUPS_FILE), labels[grouped].astype(np.int32))
+    save_array(model_path(models_dir, DUP_IDS_FILE), np.asarray(img_ids)[grouped].astype(str))
+
+    groups = {}
+    for row in grouped.tolist():
+        groups.setdefault(int(labels[row]), []).append(str(img_ids[row]))
+
+    print(f"[DUPLICADOS] {len(rows)} pares con coseno >= {threshold}: {len(groups)} grupos, "
+          f"{len(grouped)} imágenes ({len(grouped) / max(n_rows, 1) * 100:.1f}%), "
+          f"grupo más grande: {sizes.max()} en {time.time() - start:.1f}s")
+    return groups
+
+
+def load_duplicate_groups(models_dir=MODELS_DIR):
+    """{img_id: grupo} de las imágenes con casi-duplicados, o None si no se calcularon."""
+    ids_path = model_path(models_dir, DUP_IDS_FILE)
+    if not os.path.exists(ids_path):
+        return None
+    groups = np.load(model_path(models_dir, DUP_GROUPS_FILE))
+    return {str(img_id): int(group) for img_id, group in zip(np.load(ids_path), groups)}
+
+
+def collapse_duplicates(raw_results, groups):
+    """
+    Deja solo el primer resultado (el de mayor score) de cada grupo de
+    casi-duplicados. raw_results: [(img_id, score)] ordenado.
+    """
+    seen = set()
+    collapsed = []
+    for img_id, score in raw_results:
+        group = groups.get(img_id)
+        if group is not None:
+            if group in seen:
+                continue
+            seen.add(group)
+        collapsed.append((img_id, score))
+    return collapsed
+
+
+if __name__ == "__main__":
+    # Uso: python -m app.services.image.near_duplicates [umbral] [n_workers]
+    threshold = float(sys.argv[1]) if len(sys.argv) > 1 else DUP_THRESHOLD
+    n_workers = int(sys.argv[2]) if len(sys.argv) > 2 else N_WORKERS
+    find_duplicate_groups(MODELS_DIR, threshold, n_workers=n_workers)
@@ -1,111 +1,231 @@
 import os
+import sys
 import glob
+import time
+import cv2
 import numpy as np
-import joblib
-import random
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.cluster import MiniBatchKMeans
 from tqdm import tqdm
-from app.services.image.feature_extractor import SIFTFeatureExtractor
+from app.services.image.feature_extractor import (
+    SIFTFeatureExtractor, ImageTooLargeError, UnsupportedImageError, extraction_params
+)
+from app.services.image.sparse_index import (
+    build_tf_matrix, apply_idf, save_sparse_models, print_memory_report, normalize_rows,
+    select_stop_words, print_df_report, publish_manifest, model_lock
+)
+from app.services.image.hnsw import HNSWIndex, HNSW_M, HNSW_EF_CONSTRUCTION
+from app.services.image.quantized import (
+    build_scalar_codes, save_scalar, train_product_quantizer, encode_product,
+    save_product, print_quantization_report, PQ_M
+)
+from app.services.image.descriptor_store import DescriptorStore, write_descriptor_store
+from app.services.image.codebook import (
+    train_codebook_streaming, CHECKPOINT_FILE, codebook_exists, save_codebook, load_codebook, predict_words
+)
+from app.services.image.vocab_tree import VocabularyTree
+from app.services.image.delta_segment import clear_delta
+from app.services.image.thumbnails import make_thumbnail, build_thumbnails, THUMB_MAX_SIDE, THUMB_FORMAT
 
 # CONFIGURACIÓN
 DATA_DIR = "data/fashion/images"  
 OUTPUT_DIR = "data/fashion/models"
+DESCRIPTORS_DIR = os.path.join(OUTPUT_DIR, "descriptors")   # caché SIFT (se extrae una sola vez)
 K_CLUSTERS = 1000
 SAMPLE_SIZE_FOR_TRAINING =3000  
+SAMPLE_SEED = 42
+CODEBOOK_TYPE = "flat"              # "flat" (K_CLUSTERS centroides) o "tree" (árbol de vocabulario)
+TREE_BRANCH = 10                    # árbol: hijos por nodo
+TREE_DEPTH = 3                      # árbol: niveles -> TREE_BRANCH ** TREE_DEPTH palabras
+CODEBOOK_TRAINING = "streaming"     # "streaming" (partial_fit float32) o "sample" (fit sobre la muestra)
+STREAM_MAX_IMAGES = None            # None = descriptores de TODAS las imágenes
+BUILD_HNSW = True                   # grafo HNSW para method="hnsw"
+BUILD_QUANTIZED = ("sq", "pq")      # códigos comprimidos para method="sq" / "pq"
+STOP_WORDS_MAX_DF = None            # descartar palabras en más de esta fracción de imágenes (None = ninguna)
+STOP_WORDS_TOP = 0                  # descartar además las N palabras de mayor df
+MAX_POSTINGS = None                 # tope de largo por lista del índice invertido (None = sin tope)
+BUILD_THUMBNAILS = True             # pila de miniaturas para /image/thumb
+N_WORKERS = os.cpu_count() or 1     # procesos para extracción/predicción
+CHUNK_SIZE = 64                     # imágenes por tarea enviada a cada proceso
+ASSIGN_CHUNK = 100_000              # descriptores por tarea al asignar palabras visuales
 
-def run_indexing():
+# Estado por proceso (cada worker crea su propio SIFT; no es serializable)
+_worker_extractor = None
+# Fase 2: codebook y caché de descriptores, abiertos una vez por worker
+_worker_codebook = None
+_worker_store = None
+
+
+# ============================================================
+# WORKERS (un SIFTFeatureExtractor por proceso)
+# ============================================================
+
+def _init_worker():
+    global _worker_extractor
+    # Un hilo de OpenCV por proceso: el paralelismo lo dan los procesos
+    cv2.setNumThreads(1)
+    _worker_extractor = SIFTFeatureExtractor()
+
+
+def _extract_descriptors(path):
+    # Un archivo fuera de límites no aborta el pool: queda con histograma vacío
+    try:
+        return _worker_extractor.extract(path)
+    except (ImageTooLargeError, UnsupportedImageError) as e:
+        print(f"[WARN] {os.path.basename(path)} omitida: {e}")
+        return None
+
+
+def _init_assign_worker(models_dir, store_dir):
+    global _worker_codebook, _worker_store
+    _worker_codebook = load_codebook(models_dir)
+    _worker_store = DescriptorStore(store_dir)
+
+
+def _predict_chunk(start):
+    chunk = np.asarray(_worker_store.descriptors[start:start + ASSIGN_CHUNK], dtype=np.float32)
+    return predict_words(_worker_codebook, chunk).astype(np.int32)
+
+
+def assign_words_parallel(store, kmeans, n_workers=N_WORKERS):
+    """
+    Palabras visuales de toda la caché: bloques de ASSIGN_CHUNK
+    descriptores repartidos en el pool (cada worker abre el codebook ya
+    guardado y la caché con mmap; solo viajan los índices de inicio y
+    las etiquetas). Con un proceso se usa store.assign_words.
+    """
+    if n_workers <= 1:
+        return store.assign_words(kmeans)
+
+    starts = list(range(0, store.total_descriptors, ASSIGN_CHUNK))
+    labels = np.empty(store.total_descriptors, dtype=np.int32)
+
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_assign_worker,
+                             initargs=(OUTPUT_DIR, DESCRIPTORS_DIR)) as pool:
+        chunks = tqdm(pool.map(_predict_chunk, starts), total=len(starts), desc="Asignando palabras")
+        for start, words in zip(starts, chunks):
+            labels[start:start + len(words)] = words
+
+    return store.split_labels(labels)
+
+
+def parallel_imap(fn, paths, desc, n_workers=N_WORKERS):
+    """
+    Aplica fn a cada ruta en un pool de procesos, en bloques de CHUNK_SIZE.
+    Genera los resultados en el orden de `paths` (salida determinista)
+    para poder escribirlos en streaming. Al terminar reporta el
+    throughput de la fase en imágenes/s.
+    """
+    start = time.time()
+
+    if n_workers <= 1:
+        _init_worker()
+        for result in tqdm(map(fn, paths), total=len(paths), desc=desc):
+            yield result
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker) as pool:
+            for result in tqdm(pool.map(fn, paths, chunksize=CHUNK_SIZE), total=len(paths), desc=desc):
+                yield result
+
+    elapsed = time.time() - start
+    print(f"[{desc}] {len(paths)} imágenes en {elapsed:.1f}s -> {len(paths) / max(elapsed, 1e-9):.1f} imágenes/s ({n_workers} proceso(s))")
+
+
+def ensure_descriptor_store(all_image_paths, n_workers=N_WORKERS):
+    """
+    Abre la caché de descriptores; si no existe, no corresponde a la lista
+    actual de imágenes o se extrajo con otros parámetros de decodificación
+    /SIFT (extraction_params), extrae SIFT de TODAS las imágenes (en
+    paralelo) y la escribe. Cambiar K_CLUSTERS o SAMPLE_SIZE_FOR_TRAINING
+    ya no requiere volver a decodificar imágenes.
+    """
+    img_ids = [os.path.basename(path) for path in all_image_paths]
+    params = extraction_params()
+
+    if DescriptorStore.exists(DESCRIPTORS_DIR):
+        store = DescriptorStore(DESCRIPTORS_DIR)
+        if store.img_ids != img_ids:
+            print("FASE 0: La caché de descriptores no coincide con las imágenes, se regenera")
+        elif store.params != params:
+            print(f"FASE 0: La caché de descriptores se extrajo con {store.params}, se regenera con {params}")
+        else:
+            print(f"FASE 0: Caché de descriptores encontrada ({store.total_descriptors} descriptores)")
+            return store
+
+    print(f"FASE 0: Extrayendo SIFT de {len(all_image_paths)} imágenes a {DESCRIPTORS_DIR}")
+    descriptors = parallel_imap(_extract_descriptors, all_image_paths, "Extrayendo SIFT", n_workers)
+    write_descriptor_store(DESCRIPTORS_DIR, img_ids, descriptors, params)
+
+    return DescriptorStore(DESCRIPTORS_DIR)
+
+
+def run_indexing(n_workers=N_WORKERS):
     if not os.path.exists(OUTPUT_DIR): os.makedirs(OUTPUT_DIR)
-    
-    extractor = SIFTFeatureExtractor(n_features=100)
-    
-    # Obtener lista de todas las imágenes
+
+    # Obtener lista de todas las imágenes (ordenada: mismas filas en cada corrida)
     print("Leyendo lista de archivos...")
-    all_image_paths = glob.glob(os.path.join(DATA_DIR, "*.jpg"))
+    all_image_paths = sorted(glob.glob(os.path.join(DATA_DIR, "*.jpg")))
     print(f"Total de imágenes encontradas: {len(all_image_paths)}")
     
     if len(all_image_paths) == 0:
         print("No se encontraron imágenes en la carpeta indicada")
         return
 
+    # FASE 0: Descriptores SIFT (desde la caché en disco si ya existen)
+    store = ensure_descriptor_store(all_image_paths, n_workers)
+
     # FASE 1: Construir el Codebook
-    codebook_path = os.path.join(OUTPUT_DIR, "codebook.pkl")
-    
     # Verificamos si ya existe para no re-entrenar
-    if not os.path.exists(codebook_path):
-        print(f"FASE 1: Entrenando Diccionario Visual con muestra de {SAMPLE_SIZE_FOR_TRAINING}")
-        
-        # Tomamos una muestra aleatoria
-        random.shuffle(all_image_paths)
-        training_paths = all_image_paths[:SAMPLE_SIZE_FOR_TRAINING]
-        
-        all_descriptors = []
-        
-        for path in tqdm(training_paths, desc="Extrayendo SIFT (Train)"):
-            des = extractor.extract(path)
-            if des is not None:
-                all_descriptors.append(des.astype(np.float64))
-
-        if len(all_descriptors) == 0:
-            print("Error: No se pudieron extraer descriptores.")
-            return
-
-        # Apilar vectores
-        stacked_descriptors = np.vstack(all_descriptors)
-        print(f"Total descriptores para K-Means: {stacked_descriptors.shape}")
-        
-        # Entrenar K-Means
-        print(f"Ejecutando K-Means ({K_CLUSTERS} clusters)")
-        kmeans = MiniBatchKMeans(n_clusters=K_CLUSTERS, batch_size=1000, n_init='auto')
-        kmeans.fit(stacked_descriptors.astype(np.float64))        
-        
-        # Guardar Codebook
-        joblib.dump(kmeans, codebook_path)
+    if not codebook_exists(OUTPUT_DIR):
+        if CODEBOOK_TYPE == "tree":
+            stacked_descriptors = store.sample(SAMPLE_SIZE_FOR_TRAINING, seed=SAMPLE_SEED)
+            print(f"FASE 1: Entrenando árbol de vocabulario {TREE_BRANCH}^{TREE_DEPTH} "
+                  f"({TREE_BRANCH ** TREE_DEPTH} palabras) con {len(stacked_descriptors)} descriptores")
+            kmeans = VocabularyTree(TREE_BRANCH, TREE_DEPTH, seed=SAMPLE_SEED).fit(stacked_descriptors)
+        elif CODEBOOK_TRAINING == "streaming":
+            n_images = STREAM_MAX_IMAGES or len(store)
+            print(f"FASE 1: Entrenando Diccionario Visual en streaming ({K_CLUSTERS} clusters, {n_images} imágenes)")
+            kmeans = train_codebook_streaming(store, K_CLUSTERS, OUTPUT_DIR, max_images=STREAM_MAX_IMAGES, seed=SAMPLE_SEED)
+        else:
+            print(f"FASE 1: Entrenando Diccionario Visual con muestra de {SAMPLE_SIZE_FOR_TRAINING}")
+
+            # Tomamos una muestra aleatoria (reproducible) desde la caché
+            stacked_descriptors = store.sample(SAMPLE_SIZE_FOR_TRAINING, seed=SAMPLE_SEED)
+
+            if len(stacked_descriptors) == 0:
+                print("Error: No se pudieron extraer descriptores.")
+                return
+
+            print(f"Total descriptores para K-Means: {stacked_descriptors.shape}")
+
+            # Entrenar K-Means
+            print(f"Ejecutando K-Means ({K_CLUSTERS} clusters)")
+            kmeans = MiniBatchKMeans(n_clusters=K_CLUSTERS, batch_size=1000, n_init='auto')
+            kmeans.fit(stacked_descriptors.astype(np.float64))
+
+        # Guardar Codebook como arreglos (el checkpoint ya no hace falta)
+        save_codebook(OUTPUT_DIR, kmeans)
+        checkpoint_path = os.path.join(OUTPUT_DIR, CHECKPOINT_FILE)
+        if os.path.exists(checkpoint_path): os.remove(checkpoint_path)
         print("Codebook guardado.")
     else:
         print("FASE 1: Codebook ya existe, cargando")
-        kmeans = joblib.load(codebook_path)
+        kmeans = load_codebook(OUTPUT_DIR)
 
     # FASE 2: Indexación (Procesar las 44k imágenes)
     print(f"FASE 2: Indexando TODAS las {len(all_image_paths)} imágenes")
     
-    inverted_index = {} 
-    histograms = {}     
-    doc_freq = np.zeros(K_CLUSTERS) 
+    img_ids = store.img_ids
     N = len(all_image_paths)
 
-    # Aquí iteramos sobre 'all_image_paths'
-    for path in tqdm(all_image_paths, desc="Generando Histogramas"):
-        img_id = os.path.basename(path) 
-        
-        # Extraer SIFT
-        des = extractor.extract(path)
-        
-        if des is None: 
-            histograms[img_id] = np.zeros(K_CLUSTERS)
-            continue
-        
-        # Predecir palabras visuales
-        visual_words = kmeans.predict(des.astype(np.float64))
-        
-        # Crear Histograma
-        hist, _ = np.histogram(visual_words, bins=range(K_CLUSTERS + 1))
-        
-        # Normalizar (TF)
-        total_words = np.sum(hist)
-        tf_hist = hist / total_words if total_words > 0 else hist
-        
-        histograms[img_id] = tf_hist
-        
-        # Calcular DF (Document Frequency) para luego hacer IDF
-        unique_words_in_img = set(visual_words)
-        for word in unique_words_in_img:
-            doc_freq[word] += 1
-            
-        # Llenar Índice Invertido (Preliminar)
-        for word_idx, tf_val in enumerate(tf_hist):
-            if tf_val > 0:
-                if word_idx not in inverted_index: inverted_index[word_idx] = []
-                inverted_index[word_idx].append([img_id, tf_val])
+    # Predecir palabras visuales desde la caché, en paralelo (None si no hubo descriptores)
+    start = time.time()
+    word_rows = assign_words_parallel(store, kmeans, n_workers)
+    elapsed = time.time() - start
+    print(f"[Generando Histogramas] {N} imágenes en {elapsed:.1f}s -> {N / max(elapsed, 1e-9):.1f} imágenes/s ({n_workers} proceso(s))")
+
+    # Histogramas TF (normalizados) como matriz CSR float32 + DF por palabra
+    tf_csr, doc_freq = build_tf_matrix(word_rows, kmeans.n_clusters)
 
     # FASE 3: Aplicar IDF y guardar
     print("\nCalculando pesos TF-IDF finales")
@@ -113,31 +233,65 @@ def run_indexing():
     # Calcular IDF global (Sumar 1 para evitar división por cero)
     idf = np.log(N / (doc_freq + 1))
     
-    final_inverted_index = {}
-    norms = {}
-
-    # Recorremos los histogramas para calcular normas y pesos finales
-    for img_id, hist in tqdm(histograms.items(), desc="Optimizando Datos"):
-        # Reconstruimos el vector TF-IDF
-        vec_tfidf = hist * idf
-        
-        # Calculamos la norma
-        norms[img_id] = np.linalg.norm(vec_tfidf)
-        
-        # Guardamos en el índice invertido el peso ya multiplicado por IDF
-        for word_idx, tf_val in enumerate(hist):
-            if tf_val > 0:
-                weighted_score = tf_val * idf[word_idx]
-                if word_idx not in final_inverted_index: final_inverted_index[word_idx] = []
-                final_inverted_index[word_idx].append([img_id, weighted_score])    
-
-    print("Guardando archivos en disco")
-    joblib.dump(histograms, os.path.join(OUTPUT_DIR, "histograms.pkl"))
-    joblib.dump(final_inverted_index, os.path.join(OUTPUT_DIR, "inverted_index.pkl"))
-    joblib.dump(idf, os.path.join(OUTPUT_DIR, "idf_weights.pkl"))
-    joblib.dump(norms, os.path.join(OUTPUT_DIR, "norms.pkl"))
+    # Palabras stop visuales: idf 0 -> sin postings y sin peso en la query
+    print_df_report(doc_freq, N)
+    stop_words = select_stop_words(doc_freq, N, STOP_WORDS_MAX_DF, STOP_WORDS_TOP)
+    if len(stop_words) > 0:
+        idf[stop_words] = 0
+        print(f"[DF] {len(stop_words)} palabras stop descartadas")
+
+    # Pesos TF-IDF (CSR) y normas por imagen
+    tfidf_csr, norms = apply_idf(tf_csr, idf)
+
+    # Lock exclusivo: add_images/compact de la API esperan, y los motores
+    # no recargan a mitad de la escritura
+    with model_lock(OUTPUT_DIR):
+        print("Guardando archivos en disco")
+        # El manifest se publica después de HNSW y cuantizados (ver más abajo)
+        manifest = save_sparse_models(OUTPUT_DIR, tfidf_csr, img_ids, norms, idf, tf_csr=tf_csr,
+                                      stop_words=stop_words, max_postings=MAX_POSTINGS, publish=False)
+        # Las imágenes agregadas con add_images ya están en DATA_DIR y entraron a este build
+        clear_delta(OUTPUT_DIR)
+        print_memory_report(tfidf_csr, img_ids, norms)
+
+        X_norm = normalize_rows(tfidf_csr, norms)
+
+        # FASE 4: Grafo HNSW sobre los vectores normalizados (búsqueda aproximada)
+        if BUILD_HNSW:
+            print(f"FASE 4: Construyendo grafo HNSW (M={HNSW_M}, ef_construction={HNSW_EF_CONSTRUCTION})")
+            start = time.time()
+            hnsw = HNSWIndex(HNSW_M, HNSW_EF_CONSTRUCTION, seed=SAMPLE_SEED)
+            hnsw.build(X_norm)
+            hnsw.save(OUTPUT_DIR)
+            print(f"[HNSW] {N} nodos, {hnsw.max_level + 1} niveles en {time.time() - start:.1f}s")
+
+        # FASE 5: Códigos cuantizados de los vectores normalizados (scan exhaustivo comprimido)
+        sq_codes = pq_codes = pq_codebooks = None
+        if "sq" in BUILD_QUANTIZED:
+            print("FASE 5: Cuantización escalar int8")
+            sq_codes, sq_scale = build_scalar_codes(X_norm)
+            save_scalar(OUTPUT_DIR, sq_codes, sq_scale)
+        if "pq" in BUILD_QUANTIZED:
+            print(f"FASE 5: Product quantization ({PQ_M} subespacios)")
+            pq_codebooks = train_product_quantizer(X_norm, seed=SAMPLE_SEED)
+            pq_codes = encode_product(X_norm, pq_codebooks)
+            save_product(OUTPUT_DIR, pq_codes, pq_codebooks)
+        if BUILD_QUANTIZED:
+            print_quantization_report(N, X_norm.shape[1], sq_codes, pq_codes, pq_codebooks)
+
+        # Recién ahora los motores en ejecución ven la base nueva
+        publish_manifest(OUTPUT_DIR, manifest)
+
+    # FASE 6: Miniaturas empaquetadas (las sirve /image/thumb con ETag)
+    if BUILD_THUMBNAILS:
+        print(f"FASE 6: Miniaturas {THUMB_FORMAT} de lado {THUMB_MAX_SIDE}")
+        thumbnails = parallel_imap(make_thumbnail, all_image_paths, "Miniaturas", n_workers)
+        with model_lock(OUTPUT_DIR):   # add_images también agrega a la pila
+            n_thumbs = build_thumbnails(all_image_paths, OUTPUT_DIR, thumbnails)
+        print(f"[THUMBS] {n_thumbs} miniaturas empaquetadas")
     
     print("Proceso Terminado, Base de datos multimedia lista")
 
 if __name__ == "__main__":
-    run_indexing()
\ No newline at end of file
+    # Uso: python -m app.services.image.offline_indexer [n_workers]
+    run_indexing(int(sys.argv[1]) if len(sys.argv) > 1 else N_WORKERS)
@@ -0,0 +1,174 @@
+import os
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from app.services.image.sparse_index import model_path, save_array
+
+# Archivos de los códigos comprimidos (dentro de MODEL_DIR)
+SQ_CODES_FILE = "sq_codes.npy"        # (N, dim) int8, column-major
+SQ_SCALE_FILE = "sq_scale.npy"        # (dim,) float32
+PQ_CODES_FILE = "pq_codes.npy"        # (N, m) uint8
+PQ_CODEBOOKS_FILE = "pq_codebooks.npy"  # (m, 256, dim / m) float32
+
+PQ_M = 125                # subespacios (1000 palabras -> 8 dimensiones por subespacio)
+PQ_CENTROIDS = 256        # un byte por subespacio
+PQ_TRAIN_SAMPLE = 20_000  # vectores para entrenar los codebooks de PQ
+ENCODE_CHUNK = 4096       # filas densificadas a la vez al codificar
+RERANK_CANDIDATES = 64    # candidatos re-puntuados con los pesos float (0 = sin re-rank)
+
+
+# ============================================================
+# SCALAR QUANTIZATION (int8 por dimensión)
+# ============================================================
+
+def build_scalar_codes(X_norm):
+    """
+    Cuantiza la matriz normalizada (CSR, valores >= 0) a int8 con una
+    escala por palabra visual: code = round(x / scale), scale = max / 127.
+
+    Los códigos se guardan column-major: la búsqueda solo lee las columnas
+    de las palabras presentes en la query (lecturas contiguas).
+
+    Retorna: (codes int8 (N, dim) Fortran, scale float32 (dim,))
+    """
+    n_rows, dim = X_norm.shape
+    col_max = X_norm.max(axis=0).toarray().ravel().astype(np.float32)
+
+    scale = np.ones(dim, dtype=np.float32)
+    np.divide(col_max, 127.0, out=scale, where=col_max > 0)
+
+    coo = X_norm.tocoo()
+    codes = np.zeros((n_rows, dim), dtype=np.int8, order="F")
+    codes[coo.row, coo.col] = np.clip(np.rint(coo.data / scale[coo.col]), 0, 127).astype(np.int8)
+
+    return codes, scale
+
+
+def scalar_scores(codes, scale, q):
+    """
+    Distancia asimétrica: la query queda en float32 y solo se
+    des-cuantizan las columnas de sus palabras.
+    """
+    words = np.flatnonzero(q)
+    if len(words) == 0:
+        return np.zeros(codes.shape[0], dtype=np.float32)
+    return codes[:, words].astype(np.float32) @ (q[words] * scale[words])
+
+
+# ============================================================
+# PRODUCT QUANTIZATION
+# ============================================================
+
+def _pad(X, dim_padded):
+    if X.shape[1] == dim_padded:
+        return X
+    out = np.zeros((X.shape[0], dim_padded), dtype=np.float32)
+    out[:, :X.shape[1]] = X
+    return out
+
+
+def train_product_quantizer(X_norm, m=PQ_M, n_centroids=PQ_CENTROIDS, sample=PQ_TRAIN_SAMPLE, seed=42):
+    """
+    Un k-means de n_centroids por subespacio, entrenado sobre una muestra
+    de filas (densificadas solo esas filas). Si dim no es múltiplo de m se
+    rellena con ceros.
+
+    Retorna: codebooks float32 (m, n_centroids, dim_sub)
+    """
+    n_rows, dim = X_norm.shape
+    m = min(m, dim)
+    dim_sub = -(-dim // m)
+
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(n_rows, size=min(sample, n_rows), replace=False))
+    X = _pad(X_norm[rows].toarray().astype(np.float32), m * dim_sub)
+
+    n_centroids = min(n_centroids, len(rows))
+    codebooks = np.zeros((m, n_centroids, dim_sub), dtype=np.float32)
+    for j in range(m):
+        sub = X[:, j * dim_sub:(j + 1) * dim_sub]
+        km = MiniBatchKMeans(n_clusters=n_centroids, batch_size=2048, n_init=1, random_state=seed).fit(sub)
+        codebooks[j] = km.cluster_centers_
+
+    return codebooks
+
+
+def encode_product(X_norm, codebooks):
+    """Código (un byte por subespacio) del centroide más cercano, por bloques de filas."""
+    m, n_centroids, dim_sub = codebooks.shape
+    codes = np.empty((X_norm.shape[0], m), dtype=np.uint8)
+    sq_norms = np.einsum("jcd,jcd->jc", codebooks, codebooks)
+
+    for start in range(0, X_norm.shape[0], ENCODE_CHUNK):
+        X = _pad(X_norm[start:start + ENCODE_CHUNK].toarray().astype(np.float32), m * dim_sub)
+        X = X.reshape(len(X), m, dim_sub)
+
+        # argmin ||x - c||^2 = argmin (||c||^2 - 2 x.c)
+        dots = np.einsum("njd,jcd->njc", X, codebooks)
+        codes[start:start + len(X)] = np.argmin(sq_norms[None] - 2 * dots, axis=2)
+
+    return codes
+
+
+def product_scores(codes, codebooks, q):
+    """
+    Distancia asimétrica (ADC): tabla de productos query-centroide por
+    subespacio (m x 256) y score de cada imagen = suma de m lookups.
+    """
+    m, _, dim_sub = codebooks.shape
+    q_sub = _pad(q[None, :].astype(np.float32), m * dim_sub).reshape(m, dim_sub)
+    lut = np.einsum("jcd,jd->jc", codebooks, q_sub)
+
+    scores = np.zeros(codes.shape[0], dtype=np.float32)
+    for j in range(m):
+        scores += lut[j][codes[:, j]]
+    return scores
+
+
+# ============================================================
+# RE-RANK CON PESOS FLOAT
+# ============================================================
+
+def rerank(candidates, X_norm, q):
+    """Re-puntúa los candidatos con la matriz float (CSR) y retorna sus scores exactos."""
+    return np.asarray(X_norm[candidates] @ q).ravel()
+
+
+# ============================================================
+# PERSISTENCIA
+# ============================================================
+
+def save_scalar(models_dir, codes, scale):
+    save_array(model_path(models_dir, SQ_CODES_FILE), codes)
+    save_array(model_path(models_dir, SQ_SCALE_FILE), scale)
+
+
+def save_product(models_dir, codes, codebooks):
+    save_array(model_path(models_dir, PQ_CODES_FILE), codes)
+    save_array(model_path(models_dir, PQ_CODEBOOKS_FILE), codebooks)
+
+
+def load_scalar(models_dir):
+    """Retorna (codes, scale) con mmap, o None si no se construyó."""
+    path = model_path(models_dir, SQ_CODES_FILE)
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode="r"), np.load(model_path(models_dir, SQ_SCALE_FILE))
+
+
+def load_product(models_dir):
+    """Retorna (codes, codebooks) con mmap, o None si no se construyó."""
+    path = model_path(models_dir, PQ_CODES_FILE)
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode="r"), np.load(model_path(models_dir, PQ_CODEBOOKS_FILE))
+
+
+def print_quantization_report(n_rows, dim, sq_codes=None, pq_codes=None, pq_codebooks=None):
+    dense = n_rows * dim * 8
+    print("[CUANTIZACIÓN] Memoria de los vectores:")
+    print(f"  Denso float64: {dense / 1024 ** 2:.1f} MB")
+    if sq_codes is not None:
+        print(f"  SQ int8: {sq_codes.nbytes / 1024 ** 2:.1f} MB  ->  x{dense / sq_codes.nbytes:.1f} menos")
+    if pq_codes is not None:
+        total = pq_codes.nbytes + pq_codebooks.nbytes
+        print(f"  PQ ({pq_codes.shape[1]} bytes/imagen + codebooks): {total / 1024 ** 2:.1f} MB  ->  x{dense / total:.1f} menos")
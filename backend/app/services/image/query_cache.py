@@ -0,0 +1,115 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+QUERY_CACHE_SIZE = 512      # imágenes de consulta distintas en memoria
+RESULT_CACHE_DEPTH = 64     # largo de la lista rankeada guardada (k mayores se recalculan)
+
+
+class QueryCache:
+    """
+    LRU acotado por contenido de la imagen de consulta.
+
+    Por cada imagen (hash de sus bytes) guarda:
+      - el vector TF-IDF de la query (evita SIFT + predict)
+      - la lista rankeada [(img_id, score)] por variante de búsqueda
+        (método y parámetros), de largo RESULT_CACHE_DEPTH: un k distinto
+        se responde cortando la lista.
+
+    Thread-safe: los endpoints síncronos corren en el threadpool de FastAPI.
+    """
+
+    def __init__(self, max_entries=QUERY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.vector_hits = 0
+        self.ranking_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(image_source):
+        """
+        blake2b de los bytes subidos. Las rutas (benchmarks, scripts) no se
+        cachean: retorna None.
+        """
+        if isinstance(image_source, str):
+            return None
+        return hashlib.blake2b(image_source, digest_size=16).hexdigest()
+
+    def _entry(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def get_ranking(self, key, variant, k):
+        """
+        Lista rankeada cacheada con al menos k resultados (o completa), o None.
+        """
+        with self._lock:
+            entry = self._entry(key)
+            ranking = entry["rankings"].get(variant) if entry else None
+
+            if ranking is not None:
+                results, complete = ranking
+                if k <= len(results) or complete:
+                    self.ranking_hits += 1
+                    return results[:k]
+            return None
+
+    def get_vector(self, key):
+        """(query_vec, norm_q) cacheado o None. query_vec None = imagen sin descriptores."""
+        with self._lock:
+            entry = self._entry(key)
+            if entry is not None:
+                self.vector_hits += 1
+                return entry["vector"]
+            self.misses += 1
+            return None
+
+    def put_vector(self, key, query_vec, norm_q):
+        with self._lock:
+            entry = self._entry(key)
+            if entry is None:
+                self._entries[key] = {"vector": (query_vec, norm_q), "rankings": {}}
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+    def put_ranking(self, key, variant, results, depth, complete=None):
+        """
+        complete = no hay más candidatos; por defecto, si la búsqueda
+        devolvió menos de `depth`.
+        """
+        if complete is None:
+            complete = len(results) < depth
+        with self._lock:
+            entry = self._entry(key)
+            if entry is not None:
+                entry["rankings"][variant] = (results, complete)
+
+    def clear(self, keep_vectors=False):
+        """
+        Se llama cuando cambia el índice. Con un delta nuevo el idf no cambia
+        y los vectores siguen valiendo (keep_vectors); tras compactar, no.
+        """
+        with self._lock:
+            if keep_vectors:
+                for entry in self._entries.values():
+                    entry["rankings"].clear()
+            else:
+                self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            requests = self.ranking_hits + self.vector_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "requests": requests,
+                "ranking_hits": self.ranking_hits,
+                "vector_hits": self.vector_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.ranking_hits + self.vector_hits) / requests, 4) if requests else 0.0,
+                "ranking_hit_rate": round(self.ranking_hits / requests, 4) if requests else 0.0,
+            }
@@ -0,0 +1,480 @@
+import os
+import sys
+import json
+import joblib
+import numpy as np
+import scipy.sparse as sp
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin lock entre procesos
+    fcntl = None
+
+# Formato en disco del modelo: un directorio versionado de arreglos .npy
+# que se abren con mmap (los workers comparten páginas vía page cache)
+MODEL_FORMAT = "bovw-mmap"
+MODEL_FORMAT_VERSION = 1
+MODEL_DIR = f"bovw_v{MODEL_FORMAT_VERSION}"
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = "index.lock"
+
+# Arreglos del modelo disperso (MODEL_DIR/<nombre>.npy)
+#   csr_*   TF-IDF, filas = imágenes (recorrido secuencial)
+#   csc_*   TF-IDF, columnas = palabras visuales (índice invertido)
+#   ncsr_*  TF-IDF con filas normalizadas (coseno = un producto)
+#   tf_*    TF sin idf (para recalcular idf y normas al agregar imágenes)
+#   img_ids fila -> img_id (unicode de ancho fijo)
+#   norms   fila -> norma L2 del vector TF-IDF
+#   idf     palabra -> idf
+SPARSE_ARRAYS = ("csr", "csc", "ncsr")
+
+# Pickles del formato anterior (solo para la migración)
+LEGACY_IDF_FILE = "idf_weights.pkl"
+
+
+def model_path(models_dir, name=""):
+    return os.path.join(models_dir, MODEL_DIR, name)
+
+
+@contextmanager
+def model_lock(models_dir, shared=False, blocking=True):
+    """
+    Lock entre procesos (flock sobre MODEL_DIR/index.lock): los workers de
+    uvicorn y los scripts offline no comparten memoria, solo el disco.
+      exclusivo  -> add_images, compact, offline_indexer (escriben el modelo)
+      compartido -> un motor que carga o recarga el modelo
+    Con blocking=False no espera: produce False si otro proceso lo tiene.
+    """
+    out_dir = model_path(models_dir)
+    if not os.path.exists(out_dir): os.makedirs(out_dir, exist_ok=True)
+
+    with open(os.path.join(out_dir, LOCK_FILE), "a") as f:
+        if fcntl is None:
+            yield True
+            return
+
+        mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        try:
+            fcntl.flock(f, mode if blocking else mode | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# ============================================================
+# CONSTRUCCIÓN
+# ============================================================
+
+def build_tf_matrix(word_rows, n_clusters):
+    """
+    word_rows: lista (una por imagen) de arreglos de palabras visuales
+               (resultado de kmeans.predict), o None si no hubo descriptores.
+
+    Retorna: (tf_csr float32 normalizado por fila, doc_freq por palabra)
+    """
+    indptr = [0]
+    indices = []
+    data = []
+    doc_freq = np.zeros(n_clusters, dtype=np.int64)
+
+    for visual_words in word_rows:
+        if visual_words is not None and len(visual_words) > 0:
+            words, counts = np.unique(visual_words, return_counts=True)
+            indices.append(words.astype(np.int32))
+            data.append((counts / counts.sum()).astype(np.float32))
+            doc_freq[words] += 1
+            indptr.append(indptr[-1] + len(words))
+        else:
+            indptr.append(indptr[-1])
+
+    indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32)
+    data = np.concatenate(data) if data else np.zeros(0, dtype=np.float32)
+
+    tf_csr = sp.csr_matrix(
+        (data, indices, np.asarray(indptr, dtype=np.int64)),
+        shape=(len(word_rows), n_clusters),
+        dtype=np.float32
+    )
+    return tf_csr, doc_freq
+
+
+def apply_idf(tf_csr, idf):
+    """
+    Multiplica cada entrada TF por el idf de su palabra.
+    Retorna: (tfidf_csr float32, norms float32)
+    """
+    tfidf = tf_csr.copy()
+    tfidf.data = (tfidf.data * idf[tfidf.indices]).astype(np.float32)
+    # Palabras con idf 0 (stop words visuales) no dejan postings
+    tfidf.eliminate_zeros()
+
+    norms = np.sqrt(np.asarray(tfidf.multiply(tfidf).sum(axis=1)).ravel()).astype(np.float32)
+    return tfidf, norms
+
+
+def normalize_rows(tfidf_csr, norms):
+    """
+    Divide cada fila por su norma L2 (filas vacías quedan en cero).
+    Con esta matriz el coseno contra una query normalizada es un solo
+    producto matriz-vector.
+    """
+    inv = np.zeros_like(norms, dtype=np.float32)
+    np.divide(1.0, norms, out=inv, where=norms > 0)
+    return sp.diags(inv).dot(tfidf_csr).tocsr().astype(np.float32)
+
+
+def top_k(scores, k):
+    """
+    Índices de los k mayores scores, ordenados de mayor a menor
+    (argpartition + sort solo de los k elegidos).
+    """
+    if len(scores) > k:
+        idx = np.argpartition(scores, -k)[-k:]
+    else:
+        idx = np.arange(len(scores))
+    return idx[np.argsort(scores[idx])[::-1]]
+
+
+# ============================================================
+# PALABRAS STOP VISUALES Y LISTAS DE POSTINGS
+# ============================================================
+
+def select_stop_words(doc_freq, n_images, max_df=None, top_n=0):
+    """
+    Palabras visuales "stop": las top_n de mayor df y las que aparecen en
+    más de max_df (fracción) de las imágenes. Retorna sus ids ordenados.
+    Se eliminan dejando su idf en 0 (apply_idf descarta sus postings).
+    """
+    stop = set()
+    if top_n:
+        stop.update(np.argsort(doc_freq)[::-1][:top_n].tolist())
+    if max_df is not None:
+        stop.update(np.flatnonzero(doc_freq > max_df * n_images).tolist())
+    return np.array(sorted(stop), dtype=np.int64)
+
+
+def print_df_report(doc_freq, n_images, top=10):
+    """Distribución del df: cuánto del trabajo del índice invertido se llevan las palabras más frecuentes."""
+    order = np.argsort(doc_freq)[::-1]
+    total = max(int(doc_freq.sum()), 1)
+    K = len(doc_freq)
+
+    print("[DF] Distribución de frecuencia documental por palabra visual:")
+    print(f"  min / mediana / p90 / p99 / max: {doc_freq.min()} / {np.median(doc_freq):.0f} / "
+          f"{np.percentile(doc_freq, 90):.0f} / {np.percentile(doc_freq, 99):.0f} / {doc_freq.max()} (de {n_images} imágenes)")
+    for pct in (1, 5, 10):
+        n = max(1, K * pct // 100)
+        print(f"  top {pct}% de palabras ({n}): {doc_freq[order[:n]].sum() / total * 100:.1f}% de los postings")
+    print("  palabras de mayor df: " + ", ".join(f"{w} ({doc_freq[w] / n_images * 100:.0f}%)" for w in order[:top]))
+
+
+def impact_order(csc, max_postings=None):
+    """
+    Ordena cada lista de postings (columna CSC) por peso descendente y,
+    si se pasa max_postings, la trunca: así recorrer los primeros L
+    postings de una lista es recorrer sus L imágenes de mayor peso.
+    """
+    lengths = np.diff(csc.indptr)
+    cols = np.repeat(np.arange(csc.shape[1]), lengths)
+    order = np.lexsort((-csc.data, cols))
+    data, indices = csc.data[order], csc.indices[order]
+
+    if max_postings is not None:
+        rank = np.arange(len(order)) - np.repeat(csc.indptr[:-1], lengths)
+        keep = rank < max_postings
+        data, indices = data[keep], indices[keep]
+        lengths = np.minimum(lengths, max_postings)
+
+    indptr = np.concatenate([[0], np.cumsum(lengths)])
+    return sp.csc_matrix((data, indices, indptr), shape=csc.shape)
+
+
+def inverted_scores(tfidf_csc, query_vec, words, max_postings=None, mask=None):
+    """
+    Producto punto (sin normalizar) de la query contra las imágenes,
+    recorriendo solo las listas de `words`. Con max_postings cada lista
+    se corta a sus primeros max_postings postings (los de mayor peso si
+    el CSC está en impact_order). mask: bitmap booleano por fila; los
+    postings de filas en False se descartan antes de acumular.
+    """
+    weights = query_vec[words].astype(np.float32)
+    if max_postings is None and mask is None:
+        return tfidf_csc[:, words] @ weights
+
+    starts = tfidf_csc.indptr[words]
+    lengths = tfidf_csc.indptr[words + 1] - starts
+    if max_postings is not None:
+        lengths = np.minimum(lengths, max_postings)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    pos = offsets + np.arange(lengths.sum())
+
+    docs = tfidf_csc.indices[pos]
+    contrib = tfidf_csc.data[pos] * np.repeat(weights, lengths)
+    if mask is not None:
+        keep = mask[docs]
+        docs, contrib = docs[keep], contrib[keep]
+    return np.bincount(docs, weights=contrib, minlength=tfidf_csc.shape[0]).astype(np.float32)
+
+
+def save_array(path, array):
+    """
+    np.save a un archivo temporal + os.replace: un proceso que tenga el
+    archivo anterior abierto con mmap conserva su copia (otro inodo) en
+    vez de ver el archivo truncado a mitad de la escritura.
+    """
+    tmp_path = path[:-len(".npy")] + ".tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def _save_sparse(out_dir, prefix, matrix):
+    # int32 si alcanza: scipy conserva los arreglos (sin copia) al abrirlos
+    index_dtype = np.int32 if matrix.nnz < 2 ** 31 else np.int64
+    save_array(os.path.join(out_dir, f"{prefix}_data.npy"), matrix.data.astype(np.float32))
+    save_array(os.path.join(out_dir, f"{prefix}_indices.npy"), matrix.indices.astype(index_dtype))
+    save_array(os.path.join(out_dir, f"{prefix}_indptr.npy"), matrix.indptr.astype(index_dtype))
+
+
+def recover_tf(tfidf_csr, idf):
+    """
+    TF a partir del TF-IDF (modelos guardados sin tf_*). Las palabras con
+    idf == 0 no se pueden recuperar y quedan en 0.
+    """
+    tf = tfidf_csr.tocsr().astype(np.float32)
+    word_idf = np.asarray(idf)[tf.indices]
+    tf.data = np.divide(tf.data, word_idf, out=np.zeros_like(tf.data), where=word_idf != 0).astype(np.float32)
+    return tf
+
+
+def save_sparse_models(models_dir, tfidf_csr, img_ids, norms, idf, tf_csr=None,
+                       stop_words=(), max_postings=None, publish=True):
+    """
+    Escribe el modelo en MODEL_DIR. El manifest se escribe al final:
+    un directorio sin manifest es un build incompleto.
+
+    tf_csr: histogramas TF sin idf; si no se pasa se recupera del TF-IDF.
+    stop_words: palabras con idf 0 (se anotan para que compact las mantenga).
+    max_postings: tope de largo de cada lista del índice invertido (CSC);
+                  CSR y normas no se recortan.
+    publish: con False el manifest no se escribe sino que se retorna, para
+             publicarlo (publish_manifest) después de SQ, PQ y HNSW. El
+             manifest anterior nunca se borra: los motores comparan su
+             mtime en cada consulta y siguen con la base vieja (sus mmaps
+             apuntan a los inodos anteriores) hasta que aparece el nuevo.
+    """
+    out_dir = model_path(models_dir)
+    if not os.path.exists(out_dir): os.makedirs(out_dir)
+
+    tfidf_csr = tfidf_csr.tocsr()
+    tfidf_csr.sort_indices()
+    _save_sparse(out_dir, "csr", tfidf_csr)
+    _save_sparse(out_dir, "csc", impact_order(tfidf_csr.tocsc(), max_postings))
+    _save_sparse(out_dir, "ncsr", normalize_rows(tfidf_csr, norms))
+    _save_sparse(out_dir, "tf", tf_csr.tocsr() if tf_csr is not None else recover_tf(tfidf_csr, idf))
+
+    save_array(os.path.join(out_dir, "img_ids.npy"), np.asarray(img_ids, dtype=str))
+    save_array(os.path.join(out_dir, "norms.npy"), np.asarray(norms, dtype=np.float32))
+    save_array(os.path.join(out_dir, "idf.npy"), np.asarray(idf, dtype=np.float64))
+
+    manifest = {
+        "format": MODEL_FORMAT,
+        "version": MODEL_FORMAT_VERSION,
+        "n_images": tfidf_csr.shape[0],
+        "n_words": tfidf_csr.shape[1],
+        "nnz": int(tfidf_csr.nnz),
+        "postings_order": "impact",
+        "max_postings": max_postings,
+        "stop_words": [int(w) for w in stop_words],
+    }
+    if publish:
+        publish_manifest(models_dir, manifest)
+    return manifest
+
+
+def publish_manifest(models_dir, manifest):
+    """
+    Escribe el manifest con archivo temporal + os.replace: siempre existe
+    uno completo (viejo o nuevo) y su mtime avisa a los motores que recarguen.
+    """
+    path = model_path(models_dir, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def load_manifest(models_dir):
+    """
+    Lee y valida el manifest. ValueError si falta o es de otra versión.
+    """
+    path = model_path(models_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        raise ValueError(f"No existe {path}: ejecuta el offline_indexer o convert_legacy_models")
+
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    if manifest.get("format") != MODEL_FORMAT or manifest.get("version") != MODEL_FORMAT_VERSION:
+        raise ValueError(
+            f"Formato de modelo {manifest.get('format')} v{manifest.get('version')} no soportado "
+            f"(se espera {MODEL_FORMAT} v{MODEL_FORMAT_VERSION}): vuelve a indexar"
+        )
+    return manifest
+
+
+def _open_array(models_dir, name):
+    return np.load(model_path(models_dir, f"{name}.npy"), mmap_mode="r")
+
+
+def _open_sparse(models_dir, prefix, shape):
+    arrays = tuple(_open_array(models_dir, f"{prefix}_{part}") for part in ("data", "indices", "indptr"))
+    matrix_cls = sp.csc_matrix if prefix == "csc" else sp.csr_matrix
+    return matrix_cls(arrays, shape=shape, copy=False)
+
+
+def load_sparse_models(models_dir):
+    """
+    Abre el modelo con mmap (sin copiar a RAM privada).
+    Retorna: (tfidf_csr, tfidf_csc, img_ids, norms, idf)
+    """
+    manifest = load_manifest(models_dir)
+    shape = (manifest["n_images"], manifest["n_words"])
+
+    tfidf_csr = _open_sparse(models_dir, "csr", shape)
+    tfidf_csc = _open_sparse(models_dir, "csc", shape)
+    img_ids = _open_array(models_dir, "img_ids")
+    norms = _open_array(models_dir, "norms")
+    idf = _open_array(models_dir, "idf")
+    return tfidf_csr, tfidf_csc, img_ids, norms, idf
+
+
+def load_normalized_matrix(models_dir):
+    """TF-IDF con filas normalizadas (CSR, mmap)."""
+    manifest = load_manifest(models_dir)
+    return _open_sparse(models_dir, "ncsr", (manifest["n_images"], manifest["n_words"]))
+
+
+def load_tf_matrix(models_dir):
+    """Histogramas TF sin idf (CSR, mmap); recuperados del TF-IDF si el modelo no los tiene."""
+    manifest = load_manifest(models_dir)
+    if os.path.exists(model_path(models_dir, "tf_data.npy")):
+        return _open_sparse(models_dir, "tf", (manifest["n_images"], manifest["n_words"]))
+
+    tfidf_csr, _, _, _, idf = load_sparse_models(models_dir)
+    return recover_tf(tfidf_csr, idf)
+
+
+# ============================================================
+# REPORTE DE MEMORIA
+# ============================================================
+
+def sparse_nbytes(matrix):
+    return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+
+def legacy_nbytes(histograms, inverted_index):
+    """
+    Memoria aproximada del formato anterior:
+    dict {img_id: np.array denso} + dict {palabra: [[img_id, np.float64], ...]}
+    """
+    total = sys.getsizeof(histograms)
+    for img_id, hist in histograms.items():
+        total += sys.getsizeof(img_id) + hist.nbytes + 112  # cabecera ndarray
+
+    total += sys.getsizeof(inverted_index)
+    for postings in inverted_index.values():
+        total += sys.getsizeof(postings)
+        for pair in postings:
+            # la lista [img_id, peso] + el escalar numpy (el str img_id es compartido)
+            total += sys.getsizeof(pair) + sys.getsizeof(pair[1])
+
+    return total
+
+
+def process_memory_mb():
+    """
+    (RSS, parte compartida) del proceso actual en MB. Las páginas de los
+    arreglos mmap ya leídas cuentan como compartidas (page cache).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            _, resident, shared = (int(x) for x in f.read().split()[:3])
+        page = os.sysconf("SC_PAGE_SIZE")
+        return resident * page / 1024 ** 2, shared * page / 1024 ** 2
+    except (OSError, ValueError):
+        import resource
+        # Fuera de Linux: solo el pico de RSS (KB en Linux, bytes en macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 ** 2 if sys.platform == "darwin" else 1024), 0.0
+
+
+def print_memory_report(tfidf_csr, img_ids, norms, before_bytes=None):
+    csr_bytes = sparse_nbytes(tfidf_csr)
+    after = csr_bytes * 2 + np.asarray(img_ids).nbytes + norms.nbytes  # CSR + CSC
+    dense = tfidf_csr.shape[0] * tfidf_csr.shape[1] * 8
+
+    print("[MEMORIA] Modelo disperso:")
+    print(f"  Imágenes x palabras: {tfidf_csr.shape}, nnz = {tfidf_csr.nnz}")
+    print(f"  CSR + CSC + ids + normas: {after / 1024 ** 2:.1f} MB")
+    print(f"  (equivalente denso float64: {dense / 1024 ** 2:.1f} MB)")
+
+    if before_bytes is not None:
+        print(f"  Formato anterior (dicts): {before_bytes / 1024 ** 2:.1f} MB  ->  x{before_bytes / max(after, 1):.1f} menos")
+
+
+# ============================================================
+# MIGRACIÓN DESDE LOS PICKLES ANTERIORES
+# ============================================================
+
+def convert_legacy_models(models_dir="data/fashion/models"):
+    """
+    Convierte los modelos anteriores al formato mmap sin volver a extraer SIFT:
+      - tfidf_csr.npz + img_ids.npy + norms.npy + idf_weights.pkl (CSR en npz), o
+      - histograms.pkl + idf_weights.pkl (dicts originales)
+    y codebook.pkl (MiniBatchKMeans o VocabularyTree) a arreglos.
+    """
+    from app.services.image.codebook import save_codebook
+
+    print(f"Convirtiendo modelos de {models_dir} a {MODEL_DIR}/")
+    idf = joblib.load(os.path.join(models_dir, LEGACY_IDF_FILE))
+
+    before = None
+    npz_path = os.path.join(models_dir, "tfidf_csr.npz")
+    if os.path.exists(npz_path):
+        tfidf_csr = sp.load_npz(npz_path).tocsr()
+        img_ids = np.load(os.path.join(models_dir, "img_ids.npy"))
+        norms = np.load(os.path.join(models_dir, "norms.npy"))
+    else:
+        histograms = joblib.load(os.path.join(models_dir, "histograms.pkl"))
+
+        inverted_path = os.path.join(models_dir, "inverted_index.pkl")
+        if os.path.exists(inverted_path):
+            before = legacy_nbytes(histograms, joblib.load(inverted_path))
+
+        img_ids = list(histograms.keys())
+
+        # Por bloques para no materializar la matriz densa completa
+        chunks = []
+        for start in range(0, len(img_ids), 4096):
+            dense = np.vstack([histograms[i] for i in img_ids[start:start + 4096]])
+            chunks.append(sp.csr_matrix(dense.astype(np.float32)))
+        tf_csr = sp.vstack(chunks, format="csr")
+
+        tfidf_csr, norms = apply_idf(tf_csr, idf)
+
+    save_sparse_models(models_dir, tfidf_csr, img_ids, norms, idf)
+    print_memory_report(tfidf_csr, img_ids, norms, before)
+
+    codebook_pkl = os.path.join(models_dir, "codebook.pkl")
+    if os.path.exists(codebook_pkl):
+        save_codebook(models_dir, joblib.load(codebook_pkl))
+        print("Codebook convertido.")
+
+
+if __name__ == "__main__":
+    convert_legacy_models(*sys.argv[1:2])
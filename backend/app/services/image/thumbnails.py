@@ -0,0 +1,170 @@
+import os
+import glob
+import hashlib
+import cv2
+import numpy as np
+from app.services.image.sparse_index import save_array
+
+# Miniaturas pre-generadas para las páginas de resultados
+THUMBS_DIR = "thumbnails"           # dentro de models_dir
+THUMBS_PACK = "thumbs.bin"          # bytes de todas las miniaturas, uno tras otro
+THUMB_MAX_SIDE = 160                # lado mayor (nunca se amplía)
+THUMB_FORMAT = "webp"               # "webp" o "jpeg"
+THUMB_QUALITY = 80
+DATA_DIR = "data/fashion/images"
+MODELS_DIR = "data/fashion/models"
+
+MEDIA_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+def thumbs_path(models_dir, name=""):
+    return os.path.join(models_dir, THUMBS_DIR, name)
+
+
+def make_thumbnail(path):
+    """
+    Miniatura codificada (bytes) de la imagen en `path`, o None si no se
+    pudo leer. Se reduce con INTER_AREA a THUMB_MAX_SIDE de lado mayor.
+    """
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+
+    height, width = img.shape[:2]
+    if max(height, width) > THUMB_MAX_SIDE:
+        scale = THUMB_MAX_SIDE / max(height, width)
+        new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        img = cv2.resize(img, new_size, interpolation=cv2.INTER_AREA)
+
+    if THUMB_FORMAT == "webp":
+        ok, buf = cv2.imencode(".webp", img, [cv2.IMWRITE_WEBP_QUALITY, THUMB_QUALITY])
+    else:
+        ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, THUMB_QUALITY])
+    return buf.tobytes() if ok else None
+
+
+def thumbnail_etag(data):
+    """ETag fuerte: hash del contenido de la miniatura."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+# ============================================================
+# ARCHIVO EMPAQUETADO (thumbs.bin + índice de offsets)
+# ============================================================
+
+def _write_index(models_dir, img_ids, offsets, etags):
+    """
+    Índice de la pila: img_ids (fila -> id), offsets (N + 1, inicio de
+    cada miniatura en thumbs.bin) y etags. offsets se escribe al final:
+    su mtime avisa a los lectores que hay miniaturas nuevas.
+    """
+    save_array(thumbs_path(models_dir, "img_ids.npy"), np.asarray(img_ids, dtype=str))
+    save_array(thumbs_path(models_dir, "etags.npy"), np.asarray(etags, dtype=str))
+    save_array(thumbs_path(models_dir, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+
+
+def append_thumbnails(image_paths, models_dir=MODELS_DIR, thumbnails=None):
+    """
+    Agrega al final de thumbs.bin las miniaturas de `image_paths` (las de
+    ids ya empaquetados se omiten). Solo se escribe al final del archivo,
+    así los lectores con el índice anterior siguen leyendo bytes válidos.
+
+    thumbnails: miniaturas ya generadas (mismo orden que image_paths);
+                si no se pasan se generan aquí.
+    Retorna: número de miniaturas agregadas.
+    """
+    out_dir = thumbs_path(models_dir)
+    if not os.path.exists(out_dir): os.makedirs(out_dir)
+
+    store = ThumbnailStore.load(models_dir)
+    img_ids = list(store.img_ids) if store else []
+    offsets = list(store.offsets) if store else [0]
+    etags = list(store.etags) if store else []
+    known = set(img_ids)
+
+    if thumbnails is None:
+        thumbnails = map(make_thumbnail, image_paths)
+
+    added = 0
+    with open(thumbs_path(models_dir, THUMBS_PACK), "ab") as f:
+        # Un build anterior interrumpido pudo dejar bytes sin indexar
+        f.truncate(offsets[-1])
+        for path, data in zip(image_paths, thumbnails):
+            img_id = os.path.basename(path)
+            if data is None or img_id in known:
+                continue
+            known.add(img_id)
+
+            f.write(data)
+            img_ids.append(img_id)
+            offsets.append(offsets[-1] + len(data))
+            etags.append(thumbnail_etag(data))
+            added += 1
+
+    if added:
+        _write_index(models_dir, img_ids, offsets, etags)
+    return added
+
+
+def build_thumbnails(image_paths, models_dir=MODELS_DIR, thumbnails=None):
+    """Regenera la pila completa (borra la anterior)."""
+    for name in (THUMBS_PACK, "img_ids.npy", "etags.npy", "offsets.npy"):
+        path = thumbs_path(models_dir, name)
+        if os.path.exists(path): os.remove(path)
+    return append_thumbnails(image_paths, models_dir, thumbnails)
+
+
+# ============================================================
+# LECTURA
+# ============================================================
+
+class ThumbnailStore:
+    """
+    Lector de la pila de miniaturas: thumbs.bin abierto con mmap y un
+    dict img_id -> fila. get() es un slice del mmap (sin decodificar).
+    """
+
+    def __init__(self, models_dir, img_ids, offsets, etags):
+        self.models_dir = models_dir
+        self.img_ids = img_ids
+        self.offsets = offsets
+        self.etags = etags
+        self.rows = {img_id: i for i, img_id in enumerate(img_ids)}
+        self.media_type = MEDIA_TYPES[THUMB_FORMAT]
+        self._mtime = os.path.getmtime(thumbs_path(models_dir, "offsets.npy"))
+
+        pack_path = thumbs_path(models_dir, THUMBS_PACK)
+        self.pack = np.memmap(pack_path, dtype=np.uint8, mode="r") if offsets[-1] > 0 else np.zeros(0, np.uint8)
+
+    def __len__(self):
+        return len(self.img_ids)
+
+    @classmethod
+    def load(cls, models_dir=MODELS_DIR):
+        """Retorna la pila, o None si no se generaron miniaturas."""
+        if not os.path.exists(thumbs_path(models_dir, "offsets.npy")):
+            return None
+        img_ids = [str(i) for i in np.load(thumbs_path(models_dir, "img_ids.npy"))]
+        etags = [str(e) for e in np.load(thumbs_path(models_dir, "etags.npy"))]
+        offsets = np.load(thumbs_path(models_dir, "offsets.npy"))
+        return cls(models_dir, img_ids, offsets, etags)
+
+    def is_stale(self):
+        """True si otro proceso agregó miniaturas (add_images) o regeneró la pila."""
+        path = thumbs_path(self.models_dir, "offsets.npy")
+        return not os.path.exists(path) or os.path.getmtime(path) != self._mtime
+
+    def get(self, img_id):
+        """(bytes, etag) de la miniatura, o None si no está empaquetada."""
+        row = self.rows.get(img_id)
+        if row is None:
+            return None
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self.pack[start:end].tobytes(), self.etags[row]
+
+
+if __name__ == "__main__":
+    # Uso: python -m app.services.image.thumbnails   (regenera la pila desde DATA_DIR)
+    paths = sorted(glob.glob(os.path.join(DATA_DIR, "*.jpg")))
+    n = build_thumbnails(paths)
+    print(f"[THUMBS] {n} miniaturas en {thumbs_path(MODELS_DIR, THUMBS_PACK)}")
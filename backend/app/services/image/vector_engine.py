@@ -1,132 +1,480 @@
 import os
-import joblib
+import copy
+import time
+import threading
 import numpy as np
-import heapq
 import pandas as pd
-from app.services.image.feature_extractor import SIFTFeatureExtractor
+import scipy.sparse as sp
+from concurrent.futures import ThreadPoolExecutor
+from app.services.image.feature_extractor import SIFTFeatureExtractor, extract_descriptors
+from app.services.image.codebook import predict_words, load_codebook
+from app.services.image.hnsw import HNSWIndex, hnsw_exists, HNSW_EF_SEARCH
+from app.services.image.quantized import (
+    load_scalar, load_product, scalar_scores, product_scores, rerank, RERANK_CANDIDATES
+)
+from app.services.image.sparse_index import (
+    load_sparse_models, load_normalized_matrix, print_memory_report, process_memory_mb, top_k,
+    model_path, MANIFEST_FILE, build_tf_matrix, apply_idf, normalize_rows, load_manifest, inverted_scores,
+    model_lock
+)
+from app.services.image.delta_segment import DeltaSegment, delta_mtime, merge_results
+from app.services.image.query_cache import QueryCache, RESULT_CACHE_DEPTH
+from app.services.image.metadata_filter import MetadataIndex
+from app.services.image.near_duplicates import load_duplicate_groups, collapse_duplicates
+
+# Búsqueda en lote: hilos de extracción SIFT (OpenCV libera el GIL)
+BATCH_THREADS = min(8, os.cpu_count() or 1)
+
+# Al colapsar casi-duplicados se piden más candidatos para llenar k
+COLLAPSE_OVERFETCH = 4
+
+# URL pública del backend para armar las URLs de los resultados
+# (variable de entorno PUBLIC_BASE_URL; "" = URLs relativas)
+PUBLIC_BASE_URL = os.environ.get("PUBLIC_BASE_URL", "http://127.0.0.1:8000").rstrip("/")
+
+class EngineModels:
+    """
+    Lo que cambia al compactar o agregar imágenes: codebook, modelo
+    disperso, HNSW, cuantizados, índice de filtros, duplicados y delta
+    (con base_mtime/delta_mtime de lo que se cargó). Una búsqueda toma
+    self.models al empezar y usa esa instancia hasta el final; una
+    recarga arma otra y reemplaza la referencia (asignación atómica).
+    """
+
 
 class ImageSearchEngine:
-    def __init__(self, models_dir="data/fashion/models",data_dir="data/fashion"):
+    def __init__(self, models_dir="data/fashion/models",data_dir="data/fashion", base_url=PUBLIC_BASE_URL,
+                 sift_executor=None):
         # Inicializamos SIFT
-        self.extractor = SIFTFeatureExtractor(n_features=100)
-        
-        print(f"Cargando modelos desde {models_dir}")
-        try:
-            # Cargamos los 4 archivos esenciales
-            self.kmeans = joblib.load(os.path.join(models_dir, "codebook.pkl"))
-            self.histograms = joblib.load(os.path.join(models_dir, "histograms.pkl"))
-            self.inverted_index = joblib.load(os.path.join(models_dir, "inverted_index.pkl"))
-            self.idf = joblib.load(os.path.join(models_dir, "idf_weights.pkl"))
-            self.norms = joblib.load(os.path.join(models_dir, "norms.pkl"))        
+        self.extractor = SIFTFeatureExtractor()
+        self.models_dir = models_dir
+        self.base_url = base_url
+
+        # Pool de procesos opcional para SIFT (la API lo usa para no
+        # competir por el GIL con el resto de las peticiones); con la
+        # interfaz run/map de executors.RestartingProcessPool
+        self.sift_executor = sift_executor
+
+        # Un extractor SIFT por hilo para search_batch
+        self._thread_local = threading.local()
 
+        # Caché LRU por contenido de la imagen subida (vector + ranking)
+        self.query_cache = QueryCache()
+
+        # Recarga tras add_images/compact: una a la vez, sin frenar consultas
+        self._reload_lock = threading.Lock()
+
+        try:
+            # Metadata primero: _load_models arma con ella el índice de filtros
             print("Cargando metadata...")
             df = pd.read_csv(os.path.join(data_dir, "styles.csv"), on_bad_lines='skip')
             df['id'] = df['id'].astype(str)
-            self.meta_lookup = df.set_index('id').to_dict(orient='index')             
+            self.styles = df.drop_duplicates('id').set_index('id')
+            self.meta_lookup = self.styles.to_dict(orient='index')
 
-            self.k_clusters = self.kmeans.n_clusters
-            print("Motor Multimedia: Listo para buscar.")
+            # Lock compartido: si otro proceso está escribiendo el modelo, espera
+            with model_lock(models_dir, shared=True):
+                self.models = self._load_models(models_dir)
+
+            rss, shared = process_memory_mb()
+            print(f"Motor Multimedia: Listo para buscar (RSS del proceso {rss:.1f} MB, compartida {shared:.1f} MB).")
         except Exception as e:
             print(f"Error cargando índices: {e}")
+            raise
+
+    def _load_models(self, models_dir):
+        """Arma un EngineModels nuevo (no toca self.models)."""
+        print(f"Cargando modelos desde {models_dir}")
+        start = time.perf_counter()
+        m = EngineModels()
+
+        # Antes que nada: si el manifest cambia mientras cargamos, la próxima
+        # consulta vuelve a recargar
+        m.base_mtime = os.path.getmtime(model_path(models_dir, MANIFEST_FILE))
+
+        # Codebook + modelo disperso, abiertos con mmap (sin unpickle):
+        #   tfidf_csr (fila = imagen), tfidf_csc (columna = palabra visual),
+        #   img_ids (fila -> img_id), norms (fila -> norma)
+        # Las páginas se comparten entre workers a través del page cache.
+        m.kmeans = load_codebook(models_dir)
+        (m.tfidf_csr, m.tfidf_csc, m.img_ids,
+         m.norms, m.idf) = load_sparse_models(models_dir)
+        print_memory_report(m.tfidf_csr, m.img_ids, m.norms)
+
+        # Listas de postings ordenadas por peso: permite cortarlas en consulta
+        m.impact_ordered = load_manifest(models_dir).get("postings_order") == "impact"
+
+        # Matriz TF-IDF con filas normalizadas (float32) para el KNN secuencial:
+        # coseno = una multiplicación matriz-vector
+        m.tfidf_normalized = load_normalized_matrix(models_dir)
+
+        # Grafo HNSW (opcional): vecinos empaquetados con mmap y scoring
+        # sobre las filas de la CSR normalizada (nada denso por worker)
+        m.hnsw = None
+        if hnsw_exists(models_dir):
+            m.hnsw = HNSWIndex.load(models_dir, m.tfidf_normalized)
+            print(f"HNSW cargado: {m.hnsw.max_level + 1} niveles")
+
+        # Códigos cuantizados (opcionales): None si no se construyeron
+        m.sq = load_scalar(models_dir)
+        m.pq = load_product(models_dir)
+
+        m.k_clusters = m.kmeans.n_clusters
+        print(f"Codebook: {type(m.kmeans).__name__} con {m.k_clusters} palabras visuales")
+
+        # Filas por valor de gender, masterCategory, ..., year (filtros de /image)
+        m.metadata = MetadataIndex(self.styles, m.img_ids)
+
+        # Grupos de casi-duplicados (near_duplicates), None si no se calcularon
+        m.dup_groups = load_duplicate_groups(models_dir)
+        if m.dup_groups is not None:
+            print(f"Casi-duplicados: {len(m.dup_groups)} imágenes en {len(set(m.dup_groups.values()))} grupos")
+
+        # Imágenes agregadas después del build (add_images)
+        self._load_delta(m)
 
-    def _query_to_vector(self, image_source):
+        print(f"Modelos cargados en {(time.perf_counter() - start) * 1000:.0f} ms")
+        return m
+
+    def _load_delta(self, m):
+        m.delta_mtime = delta_mtime(self.models_dir)
+        m.delta = DeltaSegment.load(self.models_dir)
+        if m.delta is not None:
+            m.delta.weight(m.idf)
+            print(f"Segmento delta: {len(m.delta)} imágenes pendientes de compactar")
+        return m
+
+    def _refresh(self):
+        """
+        Retorna el EngineModels con el que debe correr la consulta.
+
+        Si otro proceso agregó imágenes (delta) o compactó (base nueva), UNA
+        consulta arma el estado nuevo aparte y lo publica en self.models;
+        las demás siguen mientras tanto con el anterior. Si un escritor
+        tiene el lock del modelo, se reintenta en la consulta siguiente.
+        Solo compara mtimes: un stat por archivo y por consulta.
+        """
+        models = self.models
+        try:
+            base_changed = os.path.getmtime(model_path(self.models_dir, MANIFEST_FILE)) != models.base_mtime
+        except FileNotFoundError:
+            return models
+        if not base_changed and delta_mtime(self.models_dir) == models.delta_mtime:
+            return models
+
+        if not self._reload_lock.acquire(blocking=False):
+            return models
+        try:
+            with model_lock(self.models_dir, shared=True, blocking=False) as locked:
+                if not locked:
+                    return models
+                if base_changed:
+                    new_models = self._load_models(self.models_dir)
+                else:
+                    new_models = self._load_delta(copy.copy(models))
+            self.models = new_models
+            # Las claves del caché llevan los mtimes: lo viejo ya no se lee
+            self.query_cache.clear(keep_vectors=not base_changed)
+            return new_models
+        finally:
+            self._reload_lock.release()
+
+    def _query_to_vector(self, m, image_source):
         """Convierte imagen de consulta a vector TF-IDF ponderado"""
         # Extraer SIFT
-        des = self.extractor.extract(image_source)
+        if self.sift_executor is not None:
+            des = self.sift_executor.run(extract_descriptors, image_source)
+        else:
+            des = self.extractor.extract(image_source)
         if des is None: return None
         
         # Predecir palabras visuales
-        visual_words = self.kmeans.predict(des.astype(np.float64))
+        visual_words = predict_words(m.kmeans, des)
         
-        # Histograma
-        hist, _ = np.histogram(visual_words, bins=range(self.k_clusters + 1))
+        # Histograma solo de las palabras presentes (cuesta según la
+        # cantidad de descriptores, no según K)
+        words, counts = np.unique(visual_words, return_counts=True)
         
-        # TF Normalizado
-        total = np.sum(hist)
-        tf = hist / total if total > 0 else hist
-        
-        # Aplicar TF-IDF
-        tfidf_vector = tf * self.idf
+        # TF Normalizado + TF-IDF, escritos únicamente en esas posiciones
+        tfidf_vector = np.zeros(m.k_clusters)
+        tfidf_vector[words] = counts / counts.sum() * m.idf[words]
         return tfidf_vector
 
-    def search(self, image_source, k=8, method="inverted"):
+    def search(self, image_source, k=8, method="inverted", ef_search=HNSW_EF_SEARCH,
+               rerank_candidates=RERANK_CANDIDATES, filters=None, min_idf=None, max_postings=None,
+               collapse=False):
         """
         Método unificado de búsqueda
+        - ef_search: solo para method="hnsw" (más alto = más recall, más lento)
+        - rerank_candidates: solo para method="sq"/"pq" (0 = sin re-rank)
+        - filters: {columna: [valores], "year_min": a, "year_max": b} sobre
+          styles.csv; cada método puntúa solo las filas que lo cumplen
+        - min_idf, max_postings: solo para method="inverted": omite las
+          palabras de la query con idf < min_idf y recorre como máximo
+          max_postings postings (los de mayor peso) por lista
+        - collapse: deja un solo resultado por grupo de casi-duplicados
+
+        El vector de la query se calcula una sola vez; cada método busca en
+        la base y los resultados se mezclan con los del segmento delta.
+
+        Si la imagen (bytes) ya se consultó, se reutiliza su vector y, para
+        el mismo método y parámetros, la lista rankeada: se guardan al menos
+        RESULT_CACHE_DEPTH resultados, así otro k se responde cortándola.
         """
-        if method == "secuencial":
-            return self._search_sequential(image_source, k)
+        m = self._refresh()
+
+        # El vector depende de la base (idf) y el ranking también del delta:
+        # con sus mtimes en la clave, una consulta que termina con el
+        # estado anterior nunca deja resultados viejos para las siguientes
+        key = self.query_cache.key(image_source)
+        if key is not None:
+            key = (m.base_mtime, key)
+        if method == "hnsw":
+            variant = (method, ef_search)
+        elif method in ("sq", "pq"):
+            variant = (method, rerank_candidates)
+        elif method == "secuencial":
+            variant = (method, None)
         else:
-            return self._search_inverted(image_source, k)
+            variant = (method, min_idf, max_postings)
+        collapse = collapse and bool(m.dup_groups)
+        if collapse:
+            variant += ("collapse",)
+        if filters:
+            variant += (tuple(sorted((c, tuple(v) if isinstance(v, list) else v) for c, v in filters.items())),)
+        variant += (m.delta_mtime,)
+
+        if key is not None:
+            cached = self.query_cache.get_ranking(key, variant, k)
+            if cached is not None:
+                return self._format_results(cached)
+
+            cached = self.query_cache.get_vector(key)
+            if cached is not None:
+                query_vec, norm_q = cached
+            else:
+                query_vec, norm_q = self._query_and_norm(m, image_source)
+                self.query_cache.put_vector(key, query_vec, norm_q)
+        else:
+            query_vec, norm_q = self._query_and_norm(m, image_source)
+
+        if query_vec is None or norm_q == 0: return []
+
+        depth = k if key is None else max(k, RESULT_CACHE_DEPTH)
+        fetch = depth * COLLAPSE_OVERFETCH if collapse else depth
+
+        # Filas de la base que cumplen los filtros (None = todas)
+        rows = m.metadata.select(filters) if filters else None
+
+        if rows is not None and len(rows) == 0:
+            raw = []
+        elif method == "secuencial":
+            raw = self._search_sequential(m, query_vec, norm_q, fetch, rows)
+        elif method == "hnsw":
+            raw = self._search_hnsw(m, query_vec, norm_q, fetch, ef_search, rows)
+        elif method in ("sq", "pq"):
+            raw = self._search_quantized(m, query_vec, norm_q, fetch, method, rerank_candidates, rows)
+        else:
+            raw = self._search_inverted(m, query_vec, norm_q, fetch, rows, min_idf, max_postings)
+
+        if m.delta is not None:
+            q = (query_vec / norm_q).astype(np.float32)
+            if filters:
+                delta_raw = [
+                    r for r in m.delta.search(q, len(m.delta))
+                    if MetadataIndex.matches(self.meta_lookup.get(r[0].replace(".jpg", ""), {}), filters)
+                ][:fetch]
+            else:
+                delta_raw = m.delta.search(q, fetch)
+            raw = merge_results(raw, delta_raw, fetch)
+
+        complete = len(raw) < fetch
+        if collapse:
+            raw = collapse_duplicates(raw, m.dup_groups)[:depth]
 
-    def _search_sequential(self, image_source, k):
+        if key is not None:
+            self.query_cache.put_ranking(key, variant, raw, depth, complete)
+
+        return self._format_results(raw[:k])
+
+    def _query_and_norm(self, m, image_source):
+        """(query_vec, norm_q); query_vec None si la imagen no tiene descriptores."""
+        query_vec = self._query_to_vector(m, image_source)
+        if query_vec is None: return None, 0.0
+        return query_vec, np.linalg.norm(query_vec)
+
+    def _search_sequential(self, m, query_vec, norm_q, k, rows=None):
         """
-        KNN Secuencial: Compara contra TODOS los histogramas.
-        Usa Heap para optimizar Top-K.
+        KNN Secuencial: Compara contra TODAS las imágenes (o solo las
+        filas filtradas). Un solo producto matriz-vector sobre la matriz
+        normalizada y argpartition para el Top-K.
         """        
-        query_vec = self._query_to_vector(image_source)
-        if query_vec is None: return []
+        q = (query_vec / norm_q).astype(np.float32)
 
-        heap = []
-        norm_q = np.linalg.norm(query_vec)
-        
-        for img_id, db_hist in self.histograms.items():
-            db_vec = db_hist * self.idf
+        if rows is not None:
+            scores = m.tfidf_normalized[rows] @ q
+            top = top_k(scores, k)
+            return [(str(m.img_ids[rows[i]]), scores[i]) for i in top]
 
-            norm_db = self.norms.get(img_id, 0)
-            
-            if norm_db == 0 or norm_q == 0: 
-                sim = 0
-            else:
-                sim = np.dot(query_vec, db_vec) / (norm_q * norm_db)
-            
-            if len(heap) < k:
-                heapq.heappush(heap, (sim, img_id))
-            else:
-                if sim > heap[0][0]:
-                    heapq.heapreplace(heap, (sim, img_id))
-        
-        return self._format_results(sorted(heap, key=lambda x: x[0], reverse=True))
+        scores = m.tfidf_normalized @ q
+        top = top_k(scores, k)
+
+        return [(str(m.img_ids[i]), scores[i]) for i in top]
+
+    def _thread_extract(self, image_source):
+        extractor = getattr(self._thread_local, "extractor", None)
+        if extractor is None:
+            extractor = self._thread_local.extractor = SIFTFeatureExtractor()
+        return extractor.extract(image_source)
+
+    def _batch_query_matrix(self, m, image_sources, n_threads=BATCH_THREADS):
+        """
+        Matriz dispersa Q (n_queries, k_clusters) con filas TF-IDF normalizadas:
+          1. SIFT de todas las imágenes en el pool de procesos (o de hilos)
+          2. UN solo predict sobre todos los descriptores apilados
+          3. histogramas TF en CSR (build_tf_matrix) + idf + normalización
+        Una imagen sin descriptores queda como fila vacía.
+        """
+        if self.sift_executor is not None:
+            descriptors = self.sift_executor.map(extract_descriptors, image_sources, chunksize=16)
+        else:
+            with ThreadPoolExecutor(max_workers=n_threads) as pool:
+                descriptors = list(pool.map(self._thread_extract, image_sources))
+
+        has_des = [d is not None and len(d) > 0 for d in descriptors]
+        valid = [d for d, ok in zip(descriptors, has_des) if ok]
+        if not valid:
+            return sp.csr_matrix((len(image_sources), m.k_clusters), dtype=np.float32)
+
+        words = predict_words(m.kmeans, np.vstack(valid))
+        per_image = iter(np.split(words, np.cumsum([len(d) for d in valid])[:-1]))
+        word_rows = [next(per_image) if ok else None for ok in has_des]
+
+        tf_csr, _ = build_tf_matrix(word_rows, m.k_clusters)
+        tfidf, norms = apply_idf(tf_csr, m.idf)
+        return normalize_rows(tfidf, norms)
+
+    def search_batch(self, image_sources, k=8, batch_size=256, n_threads=BATCH_THREADS):
+        """
+        KNN Secuencial para muchas queries a la vez: las queries forman una
+        matriz dispersa Q y se resuelven con un solo producto disperso
+        matriz-matriz por lote (batch_size acota la matriz de scores).
+
+        Retorna una lista de resultados por imagen (lista vacía si no hubo descriptores).
+        """
+        m = self._refresh()
+
+        Q = self._batch_query_matrix(m, image_sources, n_threads)
+        has_words = np.diff(Q.indptr) > 0
+        results = [[] for _ in image_sources]
+
+        for start in range(0, Q.shape[0], batch_size):
+            block = Q[start:start + batch_size]
+
+            # (N_imagenes, n_queries)
+            scores = (m.tfidf_normalized @ block.T).toarray()
+
+            for col in range(block.shape[0]):
+                pos = start + col
+                if not has_words[pos]: continue
 
-    def _search_inverted(self, image_source, k):
+                column = scores[:, col]
+                top = top_k(column, k)
+                raw = [(str(m.img_ids[i]), column[i]) for i in top]
+
+                if m.delta is not None:
+                    q = block[col].toarray().ravel()
+                    raw = merge_results(raw, m.delta.search(q, k), k)
+
+                results[pos] = self._format_results(raw)
+
+        return results
+
+    def _search_hnsw(self, m, query_vec, norm_q, k, ef_search=HNSW_EF_SEARCH, rows=None):
+        """
+        KNN aproximado con el grafo HNSW: solo compara contra los nodos
+        visitados en la búsqueda voraz (del orden de ef_search * M).
+
+        Con filtros el grafo no sirve (los vecinos filtrados cortan los
+        caminos): se hace el KNN exacto sobre las filas filtradas.
+        """
+        if m.hnsw is None:
+            raise ValueError("No hay índice HNSW: ejecuta el offline_indexer con BUILD_HNSW = True")
+
+        if rows is not None:
+            return self._search_sequential(m, query_vec, norm_q, k, rows)
+
+        ids, sims = m.hnsw.search((query_vec / norm_q).astype(np.float32), k, ef_search)
+
+        return [(str(m.img_ids[i]), s) for i, s in zip(ids, sims)]
+
+    def _search_quantized(self, m, query_vec, norm_q, k, method="sq", rerank_candidates=RERANK_CANDIDATES, rows=None):
+        """
+        KNN Secuencial sobre los códigos comprimidos (int8 o PQ) con
+        distancia asimétrica: la query no se cuantiza. Opcionalmente los
+        mejores rerank_candidates se re-puntúan con los pesos float.
+        Con filtros solo se leen los códigos de las filas filtradas.
+        """
+        model = m.sq if method == "sq" else m.pq
+        if model is None:
+            raise ValueError(f"No hay códigos '{method}': ejecuta el offline_indexer con BUILD_QUANTIZED")
+
+        codes, params = model
+        if rows is not None:
+            codes = codes[rows]
+
+        q = (query_vec / norm_q).astype(np.float32)
+        scores = scalar_scores(codes, params, q) if method == "sq" else product_scores(codes, params, q)
+
+        if rerank_candidates > 0:
+            candidates = top_k(scores, max(rerank_candidates, k))
+            if rows is not None: candidates = rows[candidates]
+            exact = rerank(candidates, m.tfidf_normalized, q)
+            top = top_k(exact, k)
+            return [(str(m.img_ids[candidates[i]]), exact[i]) for i in top]
+
+        top = top_k(scores, k)
+        ids = top if rows is None else rows[top]
+        return [(str(m.img_ids[i]), s) for i, s in zip(ids, scores[top])]
+
+    def _search_inverted(self, m, query_vec, norm_q, k, rows=None, min_idf=None, max_postings=None):
         """
         KNN con Indexación Invertida
-        Solo busca en las listas de las palabras visuales que aparecen en la query.
+        Solo recorre las columnas (listas de postings) de la matriz CSC
+        correspondientes a las palabras visuales que aparecen en la query.
+
+        Con filtros se recorren las mismas listas y sus postings se
+        enmascaran con el bitmap de filas de MetadataIndex (sin copiar
+        filas de la matriz); las imágenes descartadas no se puntúan.
+        Poda opcional: sin las palabras de idf < min_idf y con cada lista
+        cortada a max_postings (requiere el CSC ordenado por impacto; en
+        modelos anteriores, o con filtros, el corte se ignora).
         """        
-        query_vec = self._query_to_vector(image_source)
-        if query_vec is None: return []
+        # Palabras visuales presentes en la query
+        words = np.flatnonzero(query_vec > 0)
+        if min_idf is not None:
+            words = words[m.idf[words] >= min_idf]
+        # Con filtros, cortar las listas antes de enmascararlas dejaría
+        # afuera justo las imágenes filtradas de menor impacto
+        if not m.impact_ordered or rows is not None:
+            max_postings = None
 
-        norm_q = np.linalg.norm(query_vec)
-        scores = {} 
-        
-        # Iteramos solo sobre las palabras visuales presentes en la query
-        for word_idx, query_weight in enumerate(query_vec):
-            if query_weight > 0 and word_idx in self.inverted_index:
-                
-                # Lista de imagenes que tienen esta palabra
-                posting_list = self.inverted_index[word_idx]
-                
-                for img_id, doc_weight in posting_list:
-                    if img_id not in scores: scores[img_id] = 0
-                    # Acumulamos: peso_query * peso_documento
-                    scores[img_id] += query_weight * doc_weight 
+        # Acumulamos peso_query * peso_documento sobre esas columnas
+        mask = m.metadata.mask(rows) if rows is not None else None
+        scores = inverted_scores(m.tfidf_csc, query_vec, words, max_postings, mask)
 
         # Normalización Final 
-        final_results = []
-        for img_id, dot_product in scores.items():
-            norm_d = self.norms.get(img_id, 0)
-            
-            if norm_q * norm_d > 0:
-                final_score = dot_product / (norm_q * norm_d)
-            else:
-                final_score = 0
-            
-            # Descartar scores muy bajos
-            if final_score > 0.001:
-                final_results.append((img_id, final_score))
-                    
-        # Ordenar
-        top_k = sorted(final_results, key=lambda x: x[1], reverse=True)[:k]
-        return self._format_results(top_k)
+        denom = m.norms * norm_q
+        np.divide(scores, denom, out=scores, where=denom > 0)
+
+        # Descartar scores muy bajos
+        candidates = np.flatnonzero(scores > 0.001)
+        if len(candidates) == 0: return []
+
+        # Top-K sin ordenar todo
+        top = candidates[top_k(scores[candidates], k)]
+
+        return [(str(m.img_ids[i]), s) for i, s in zip(top, scores[top])]
     
     def _format_results(self, raw_results):
         """Ayuda a formatear la salida con metadata"""
@@ -148,7 +496,8 @@ class ImageSearchEngine:
                 "title": meta.get("productDisplayName", "Sin título"),
                 "gender": meta.get("gender", ""),
                 "year": meta.get("year", ""),
-                "url": f"http://127.0.0.1:8000/static/{img_id}" 
+                "url": f"{self.base_url}/static/{img_id}",
+                "thumbnail": f"{self.base_url}/image/thumb/{img_id}"
             })
         return formatted    
     
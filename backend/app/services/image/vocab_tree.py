@@ -0,0 +1,117 @@
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+# Descriptores por bloque al cuantizar (acota el tensor n x branch x 128)
+PREDICT_CHUNK = 4096
+
+
+class VocabularyTree:
+    """
+    Cuantizador jerárquico (k-means jerárquico, Nistér & Stewénius).
+
+    Árbol completo de `branch` hijos y `depth` niveles:
+    branch ** depth palabras visuales (10 x 3 = 1000, 10 x 4 = 10k,
+    10 x 6 = 1M). Asignar un descriptor cuesta branch * depth distancias
+    en vez de branch ** depth del codebook plano.
+
+    Se usa igual que el MiniBatchKMeans del codebook plano
+    (n_clusters, cluster_centers_, predict); se guarda como un arreglo
+    .npy por nivel (codebook.save_codebook).
+
+    Nodos del nivel l: branch ** (l + 1). Los hijos del nodo j del nivel l
+    son los nodos j * branch + c (c = 0..branch-1) del nivel l + 1, así
+    que el id de palabra es directamente el índice de la hoja.
+    """
+
+    def __init__(self, branch=10, depth=3, seed=42):
+        self.branch = branch
+        self.depth = depth
+        self.seed = seed
+        self.n_clusters = branch ** depth
+        self.level_centers = []   # level_centers[l]: (branch ** (l + 1), dim) float32
+
+    @classmethod
+    def from_levels(cls, branch, depth, level_centers):
+        """Árbol ya entrenado a partir de sus centroides por nivel (pueden ser mmap)."""
+        tree = cls(branch, depth)
+        tree.level_centers = list(level_centers)
+        return tree
+
+    @property
+    def cluster_centers_(self):
+        """Centroides de las hojas (uno por palabra visual)."""
+        return self.level_centers[-1]
+
+    # ============================================================
+    # ENTRENAMIENTO
+    # ============================================================
+
+    def _split(self, X, node_center):
+        """k-means con `branch` centroides sobre los puntos de un nodo."""
+        if len(X) >= self.branch:
+            km = MiniBatchKMeans(n_clusters=self.branch, batch_size=min(len(X), 4096),
+                                 n_init=1, random_state=self.seed)
+            km.fit(X)
+            return km.cluster_centers_.astype(np.float32), km.labels_
+
+        # Nodo con pocos puntos: cada punto es un centroide y el resto
+        # repite el del padre (esas hojas quedan vacías)
+        centers = np.repeat(node_center[None, :], self.branch, axis=0)
+        centers[:len(X)] = X
+        return centers.astype(np.float32), np.arange(len(X))
+
+    def fit(self, X):
+        """
+        Entrena nivel por nivel: los puntos de cada nodo se reparten
+        entre sus `branch` hijos con un k-means propio.
+        """
+        X = np.asarray(X, dtype=np.float32)
+        dim = X.shape[1]
+
+        # node[i] = nodo del nivel actual al que pertenece el punto i
+        node = np.zeros(len(X), dtype=np.int64)
+        parents = X.mean(axis=0, keepdims=True)
+        self.level_centers = []
+
+        for level in range(self.depth):
+            n_nodes = self.branch ** level
+            centers = np.empty((n_nodes * self.branch, dim), dtype=np.float32)
+            child = np.empty(len(X), dtype=np.int64)
+
+            order = np.argsort(node, kind="stable")
+            bounds = np.searchsorted(node[order], np.arange(n_nodes + 1))
+
+            for j in range(n_nodes):
+                members = order[bounds[j]:bounds[j + 1]]
+                node_centers, labels = self._split(X[members], parents[j])
+                centers[j * self.branch:(j + 1) * self.branch] = node_centers
+                child[members] = j * self.branch + labels
+
+            self.level_centers.append(centers)
+            parents = centers
+            node = child
+
+        return self
+
+    # ============================================================
+    # CUANTIZACIÓN: O(branch * depth) POR DESCRIPTOR
+    # ============================================================
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        words = np.empty(len(X), dtype=np.int64)
+        offsets = np.arange(self.branch)
+
+        for start in range(0, len(X), PREDICT_CHUNK):
+            chunk = X[start:start + PREDICT_CHUNK]
+            node = np.zeros(len(chunk), dtype=np.int64)
+
+            for centers in self.level_centers:
+                candidates = node[:, None] * self.branch + offsets        # (n, branch)
+                diff = centers[candidates] - chunk[:, None, :]              # (n, branch, dim)
+                best = np.einsum("nbd,nbd->nb", diff, diff).argmin(axis=1)
+                node = candidates[np.arange(len(chunk)), best]
+
+            words[start:start + len(chunk)] = node
+
+        return words
@@ -0,0 +1,206 @@
+import os
+import re
+import csv
+import json
+import numpy as np
+
+INDEX_DIR = "index_text/"
+ATTR_DIR = "attributes"
+
+# Atributos numéricos del dataset de Spotify y su tipo en disco.
+# Se usa float32 para todos: permite NaN como "valor faltante"
+# (NaN nunca cumple un filtro de rango).
+NUMERIC_ATTRIBUTES = {
+    "track_popularity": np.float32,
+    "danceability": np.float32,
+    "energy": np.float32,
+    "key": np.float32,
+    "loudness": np.float32,
+    "mode": np.float32,
+    "speechiness": np.float32,
+    "acousticness": np.float32,
+    "instrumentalness": np.float32,
+    "liveness": np.float32,
+    "valence": np.float32,
+    "tempo": np.float32,
+    "duration_ms": np.float32,
+}
+
+# Formato de filtros: "valence<=0.3,tempo<100,energy>=0.5"
+RE_FILTER = re.compile(r"^\s*(\w+)\s*(<=|>=|<|>|=)\s*(-?\d+(?:\.\d+)?)\s*$")
+
+# Caché en RAM: file_name -> (mtime, doc_ids, {atributo -> columna memmap}, {docId -> fila})
+_COLUMNS = {}
+
+
+# ============================================================
+# CONSTRUCCIÓN (DURANTE build_index)
+# ============================================================
+
+def build_attribute_columns(csv_path, dname: str, file_name: str, doc_ids=None):
+    """
+    Guarda los atributos numéricos del CSV como columnas NumPy (.npy),
+    una por atributo, alineadas por posición de documento:
+
+        attributes/doc_ids.json   -> [docId_0, docId_1, ...]
+        attributes/<atributo>.npy -> columna[i] = valor del docId_i
+
+    Las columnas se abren luego con mmap (no se cargan completas en RAM).
+
+    doc_ids: set opcional de docIds a incluir (p. ej. los de un shard).
+    """
+    attr_dir = os.path.join(INDEX_DIR, file_name, ATTR_DIR)
+    if not os.path.exists(attr_dir):
+        os.makedirs(attr_dir)
+
+    ids = []
+    values = {}
+
+    with open(csv_path, "r", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        present = [a for a in NUMERIC_ATTRIBUTES if a in (reader.fieldnames or [])]
+        values = {a: [] for a in present}
+
+        for row in reader:
+            if doc_ids is not None and row[dname] not in doc_ids:
+                continue
+
+            ids.append(row[dname])
+            for attr in present:
+                try:
+                    values[attr].append(float(row[attr]))
+                except (TypeError, ValueError):
+                    values[attr].append(np.nan)
+
+    for attr, column in values.items():
+        arr = np.asarray(column, dtype=NUMERIC_ATTRIBUTES[attr])
+        np.save(os.path.join(attr_dir, f"{attr}.npy"), arr)
+
+    with open(os.path.join(attr_dir, "doc_ids.json"), "w", encoding="utf-8") as f:
+        json.dump(ids, f, ensure_ascii=False)
+
+    print(f"[ATTR] {len(values)} columnas guardadas para {len(ids)} documentos: {', '.join(values)}")
+
+
+# ============================================================
+# LECTURA (MEMORY-MAPPED)
+# ============================================================
+
+def load_columns(file_name: str):
+    """
+    Abre las columnas con mmap una sola vez por dataset.
+    Retorna: (doc_ids, {atributo -> np.memmap}) o (None, {}) si no existen.
+    """
+    attr_dir = os.path.join(INDEX_DIR, file_name, ATTR_DIR)
+    ids_path = os.path.join(attr_dir, "doc_ids.json")
+
+    if not os.path.exists(ids_path):
+        return None, {}
+
+    mtime = os.path.getmtime(ids_path)
+    cached = _COLUMNS.get(file_name)
+    if cached and cached[0] == mtime:
+        return cached[1], cached[2]
+
+    with open(ids_path, "r", encoding="utf-8") as f:
+        doc_ids = json.load(f)
+
+    columns = {}
+    for attr in NUMERIC_ATTRIBUTES:
+        path = os.path.join(attr_dir, f"{attr}.npy")
+        if os.path.exists(path):
+            columns[attr] = np.load(path, mmap_mode="r")
+
+    doc_rows = {docId: i for i, docId in enumerate(doc_ids)}
+    _COLUMNS[file_name] = (mtime, doc_ids, columns, doc_rows)
+    return doc_ids, columns
+
+
+def load_doc_rows(file_name: str):
+    """
+    {docId -> fila en las columnas}, armado una vez junto con las
+    columnas: el scoring prueba la pertenencia al filtro con
+    mask[doc_rows[docId]]. Retorna None si no hay atributos.
+    """
+    doc_ids, _ = load_columns(file_name)
+    if doc_ids is None:
+        return None
+    return _COLUMNS[file_name][3]
+
+
+# ============================================================
+# FILTROS DE RANGO -> BITMAP
+# ============================================================
+
+def parse_filters(filters: str):
+    """
+    Convierte "valence<=0.3,tempo<100" en {atributo: (min, max)} con
+    límites inclusivos ("<" y ">" se ajustan al float32 adyacente).
+    Lanza ValueError si el formato es inválido.
+    """
+    ranges = {}
+    if not filters:
+        return ranges
+
+    for expr in filters.split(","):
+        if not expr.strip():
+            continue
+
+        match = RE_FILTER.match(expr)
+        if not match:
+            raise ValueError(f"Filtro inválido: '{expr}'")
+
+        attr, op, value = match.groups()
+        if attr not in NUMERIC_ATTRIBUTES:
+            raise ValueError(f"Atributo desconocido: '{attr}'")
+
+        value = np.float32(value)
+        lo, hi = ranges.get(attr, (-np.inf, np.inf))
+
+        if op == "<":
+            hi = min(hi, float(np.nextafter(value, np.float32(-np.inf))))
+        elif op == "<=":
+            hi = min(hi, float(value))
+        elif op == ">":
+            lo = max(lo, float(np.nextafter(value, np.float32(np.inf))))
+        elif op == ">=":
+            lo = max(lo, float(value))
+        else:
+            lo, hi = max(lo, float(value)), min(hi, float(value))
+
+        ranges[attr] = (lo, hi)
+
+    return ranges
+
+
+def build_filter_mask(ranges, file_name: str):
+    """
+    Evalúa los rangos sobre las columnas y retorna un bitmap (np.bool_)
+    alineado con doc_ids. Retorna None si no hay filtros.
+    """
+    if not ranges:
+        return None
+
+    doc_ids, columns = load_columns(file_name)
+    if doc_ids is None:
+        raise ValueError(f"El índice '{file_name}' no tiene atributos; reconstrúyelo")
+
+    mask = np.ones(len(doc_ids), dtype=np.bool_)
+
+    for attr, (lo, hi) in ranges.items():
+        if attr not in columns:
+            raise ValueError(f"El índice '{file_name}' no tiene el atributo '{attr}'")
+
+        column = columns[attr]
+        mask &= (column >= lo) & (column <= hi)
+
+    return mask
+
+
+def allowed_mask(filters: str, file_name: str):
+    """
+    Atajo para el motor de búsqueda: filtros en texto -> bitmap de filas
+    permitidas (o None si no hay filtros). Se consulta con load_doc_rows;
+    no se arma ningún set de docIds por consulta.
+    """
+    return build_filter_mask(parse_filters(filters), file_name)
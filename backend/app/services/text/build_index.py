@@ -1,23 +1,33 @@
 import csv
-import nltk
-from app.services.text.spimi import spimi_invert
-from app.services.text.merge_blocks import merge_blocks
+import shutil
+from app.services.text.spimi import spimi_invert, BLOCK_DIR
+from app.services.text.merge_blocks import merge_blocks, block_sizes
 from app.services.text.documents import build_documents_jsonl
+from app.services.text.suggest import build_suggestions
+from app.services.text.attributes import build_attribute_columns
 import os
 
+INDEX_DIR = "index_text/"
+SHARDS_MANIFEST = "shards.json"
+# Los builds escriben en index_text/<file>.staging/ y recién al terminar
+# reemplazan al índice en uso: un build cancelado o fallido no lo toca.
+STAGING_SUFFIX = ".staging"
+# Archivos que generan otros jobs (dedup) y sobreviven a una reconstrucción
+PRESERVED_FILES = ("duplicates.json",)
 
-def build_index(file: str, didx: int, tidx: int):
+
+def read_dataset(file: str, didx: int, tidx: int):
     """
-    Lee el dataset CSV y ejecuta SPIMI para construir los bloques iniciales.
-    El CSV debe tener:
-        id, texto
+    Lee el dataset CSV.
+    Retorna: (docs, dname, tname, track_names)
+        docs: lista de (docID, texto)
+        track_names: lista de (nombre, popularidad) para el autocompletado
     """
     docs = []
+    track_names = []
 
     csv_path = f"data/{file}.csv"
 
-    nltk.download("stopwords")
-
     dname = ""
     tname = ""
 
@@ -28,18 +38,110 @@ def build_index(file: str, didx: int, tidx: int):
         dname = header[didx]
         tname = header[tidx]
 
+        # Columnas opcionales para el autocompletado
+        nidx = header.index("track_name") if "track_name" in header else None
+        pidx = header.index("track_popularity") if "track_popularity" in header else None
+
         for row in reader:
             docId, text = row[didx], row[tidx]
             docs.append((str(docId), text))
 
-    print("[INDEX] Iniciando SPIMI…")
-    spimi_invert(docs, file_name=file)
-    print("[INDEX] Bloques SPIMI generados.")
+            if nidx is not None and row[nidx]:
+                popularity = row[pidx] if pidx is not None else ""
+                weight = int(popularity) if popularity.isdigit() else 0
+                track_names.append((row[nidx], weight))
+
+    return docs, dname, tname, track_names
+
+
+# ============================================================
+# STAGING Y PUBLICACIÓN
+# ============================================================
+
+def staging_name(file: str):
+    return file + STAGING_SUFFIX
+
+
+def reset_staging(file: str):
+    """Borra índice y bloques de un staging anterior (build cancelado o fallido)."""
+    name = staging_name(file)
+    for path in (os.path.join(INDEX_DIR, name), os.path.join(BLOCK_DIR, name)):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+
+def publish_index(file: str):
+    """
+    Reemplaza index_text/<file>/ por el staging ya completo. Son dos
+    os.replace de directorios (microsegundos sin índice) y el viejo se
+    borra después; los archivos abiertos con mmap siguen siendo válidos.
+    """
+    live = os.path.join(INDEX_DIR, file)
+    staged = os.path.join(INDEX_DIR, staging_name(file))
+    old = live + ".old"
+
+    for name in PRESERVED_FILES:
+        src = os.path.join(live, name)
+        if os.path.exists(src) and not os.path.exists(os.path.join(staged, name)):
+            shutil.copy2(src, os.path.join(staged, name))
+
+    if os.path.exists(old):
+        shutil.rmtree(old)
+    if os.path.exists(live):
+        os.replace(live, old)
+    os.replace(staged, live)
+    if os.path.exists(old):
+        shutil.rmtree(old)
+
+
+def build_index(file: str, didx: int, tidx: int, progress=None):
+    """
+    Lee el dataset CSV y ejecuta SPIMI para construir los bloques iniciales.
+    El CSV debe tener:
+        id, texto
+
+    Todo se construye en el staging y se publica al final (publish_index).
+
+    progress: BuildProgress opcional (fases spimi -> merge -> docs). Si el
+    job se cancela se lanza BuildCancelled y el índice en uso no cambia.
+    """
+    csv_path = f"data/{file}.csv"
+    name = staging_name(file)
+
+    docs, dname, tname, track_names = read_dataset(file, didx, tidx)
+    total_bytes = sum(len(text) for _, text in docs)
+
+    # Bloques de un build anterior (o cancelado) contaminarían el merge
+    reset_staging(file)
+
+    try:
+        if progress:
+            progress.start_phase("spimi", total_bytes, docs_total=len(docs))
+        print("[INDEX] Iniciando SPIMI…")
+        spimi_invert(docs, file_name=name, progress=progress)
+        print("[INDEX] Bloques SPIMI generados.")
+
+        if progress:
+            progress.start_phase("merge", block_sizes(name))
+        print("[BUILD] Mergeando bloques…")
+        merge_blocks(N=len(docs), file_name=name, progress=progress)
+
+        if progress:
+            progress.start_phase("docs", total_bytes)
+        print("[BUILD] Creando documents.jsonl…")
+        build_documents_jsonl(csv_path, dname, tname, file_name=name, progress=progress)
+
+        print("[BUILD] Creando columnas de atributos…")
+        build_attribute_columns(csv_path, dname, file_name=name)
 
-    print("[BUILD] Mergeando bloques…")
-    merge_blocks(N=len(docs), file_name=file)
+        print("[BUILD] Creando autocompletado…")
+        build_suggestions(track_names, file_name=name, texts=(text for _, text in docs))
+    except BaseException:
+        reset_staging(file)
+        raise
 
-    print("[BUILD] Creando documents.jsonl…")
-    build_documents_jsonl(csv_path, dname, tname, file_name=file)
+    # El staging nunca tiene shards.json: si el índice anterior era
+    # particionado, deja de serlo al publicar
+    publish_index(file)
 
     print("[BUILD] Índice textual construido correctamente.")
@@ -0,0 +1,233 @@
+import time
+import uuid
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from app.services.text.build_index import build_index
+from app.services.text.shards import build_sharded_index
+
+# Un solo worker: dos builds a la vez competirían por CPU y disco (y dos
+# del mismo dataset se pisarían los bloques); los demás esperan en cola.
+BUILD_WORKERS = 1
+MAX_FINISHED_JOBS = 50   # historial de jobs terminados que se conserva
+
+_executor = None
+_lock = threading.Lock()
+JOBS = OrderedDict()
+
+
+class BuildCancelled(Exception):
+    """El job se canceló; la construcción se detiene en su siguiente punto de control."""
+
+
+# ============================================================
+# PROGRESO
+# ============================================================
+
+class BuildProgress:
+    """
+    Progreso de una construcción, compartido entre el hilo que construye
+    (spimi_invert, merge_blocks, build_index) y el endpoint de estado.
+
+    Cada fase (spimi, merge, docs) tiene su propio total de bytes, que
+    da el throughput y el ETA de la fase en curso; al cerrarse queda su
+    resumen en `phases`. docs_processed y blocks_written se acumulan
+    durante todo el build. Cancelar solo marca un evento: advance() y
+    start_phase() lanzan BuildCancelled al verlo.
+    """
+
+    def __init__(self):
+        self.phase = "queued"
+        self.docs_total = 0
+        self.docs_processed = 0
+        self.blocks_written = 0
+        self.bytes_total = 0
+        self.bytes_done = 0
+        self.phase_started = None
+        self.phases = {}
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def check(self):
+        if self._cancel.is_set():
+            raise BuildCancelled()
+
+    def _close_phase(self):
+        if self.phase_started is None:
+            return
+        elapsed = time.time() - self.phase_started
+        self.phases[self.phase] = {
+            "seconds": round(elapsed, 2),
+            "bytes": self.bytes_done,
+            "bytes_per_sec": round(self.bytes_done / elapsed, 1) if elapsed > 0 else None,
+        }
+
+    def start_phase(self, phase, bytes_total=0, docs_total=None):
+        self.check()
+        self._close_phase()
+        self.phase = phase
+        self.bytes_total = bytes_total
+        self.bytes_done = 0
+        self.phase_started = time.time()
+        if docs_total is not None:
+            self.docs_total = docs_total
+
+    def advance(self, nbytes=0, docs=0):
+        self.bytes_done += nbytes
+        self.docs_processed += docs
+        self.check()
+
+    def block_written(self):
+        self.blocks_written += 1
+
+    def finish(self):
+        """Cierra la última fase; el snapshot pasa a reportar el build completo."""
+        self._close_phase()
+        self.phase = "done"
+        self.phase_started = None
+
+    def snapshot(self):
+        if self.phase == "done":
+            seconds = sum(p["seconds"] for p in self.phases.values())
+            processed = sum(p["bytes"] for p in self.phases.values())
+            return {
+                "phase": self.phase,
+                "docs_processed": self.docs_processed,
+                "docs_total": self.docs_total,
+                "blocks_written": self.blocks_written,
+                "phase_percent": 100.0,
+                "bytes_per_sec": round(processed / seconds, 1) if seconds > 0 else None,
+                "eta_seconds": 0.0,
+                "phases": self.phases,
+            }
+
+        elapsed = time.time() - self.phase_started if self.phase_started else 0.0
+        rate = self.bytes_done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.bytes_total and rate > 0:
+            eta = round(max(0.0, self.bytes_total - self.bytes_done) / rate, 1)
+
+        return {
+            "phase": self.phase,
+            "docs_processed": self.docs_processed,
+            "docs_total": self.docs_total,
+            "blocks_written": self.blocks_written,
+            "phase_percent": round(min(self.bytes_done / self.bytes_total, 1.0) * 100, 1) if self.bytes_total else None,
+            "bytes_per_sec": round(rate, 1),
+            "eta_seconds": eta,
+            "phases": self.phases,
+        }
+
+
+# ============================================================
+# JOBS
+# ============================================================
+
+class BuildJob:
+    """
+    Un build encolado en el worker.
+    Estados: queued -> running -> done | failed | cancelled
+    """
+
+    def __init__(self, file, didx, tidx, shards):
+        self.id = uuid.uuid4().hex[:12]
+        self.params = {"file": file, "docIdIdx": didx, "textColumnIdx": tidx, "shards": shards}
+        self.status = "queued"
+        self.progress = BuildProgress()
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+
+    def run(self):
+        self.started_at = time.time()
+        p = self.params
+        try:
+            self.progress.check()
+            self.status = "running"
+            if p["shards"] > 1:
+                build_sharded_index(p["file"], p["docIdIdx"], p["textColumnIdx"],
+                                    n_shards=p["shards"], progress=self.progress)
+            else:
+                build_index(p["file"], p["docIdIdx"], p["textColumnIdx"], progress=self.progress)
+        except BuildCancelled:
+            self.status = "cancelled"
+            print(f"[JOBS] Build {self.id} cancelado en la fase '{self.progress.phase}'")
+        except Exception as e:
+            traceback.print_exc()
+            self.status = "failed"
+            self.error = str(e)
+        else:
+            self.progress.finish()
+            self.status = "done"
+        finally:
+            self.finished_at = time.time()
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "status": "cancelling" if self.status == "running" and self.progress.cancel_requested else self.status,
+            "params": self.params,
+            "progress": self.progress.snapshot(),
+            "error": self.error,
+            "elapsed_seconds": round(end - self.started_at, 2) if self.started_at else None,
+        }
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=BUILD_WORKERS, thread_name_prefix="build")
+    return _executor
+
+
+def _prune_finished():
+    """Olvida los jobs terminados más viejos por encima de MAX_FINISHED_JOBS."""
+    finished = [job_id for job_id, job in JOBS.items() if job.finished_at is not None]
+    for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+        del JOBS[job_id]
+
+
+def submit_build(file: str, didx: int, tidx: int, shards: int = 1):
+    """Encola un build y retorna el BuildJob sin esperar a que corra."""
+    job = BuildJob(file, didx, tidx, shards)
+    with _lock:
+        _prune_finished()
+        JOBS[job.id] = job
+    job.future = _get_executor().submit(job.run)
+    return job
+
+
+def get_job(job_id: str):
+    return JOBS.get(job_id)
+
+
+def list_jobs():
+    with _lock:
+        return [job.to_dict() for job in JOBS.values()]
+
+
+def cancel_job(job_id: str):
+    """
+    Cancela un job: si aún está en cola no llega a correr; si está
+    corriendo se detiene en el siguiente punto de control.
+    Retorna el job, o None si no existe.
+    """
+    job = JOBS.get(job_id)
+    if job is None:
+        return None
+    if job.finished_at is None:
+        job.progress.cancel()
+        if job.future is not None and job.future.cancel():
+            job.status = "cancelled"
+            job.finished_at = time.time()
+    return job
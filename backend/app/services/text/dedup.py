@@ -0,0 +1,234 @@
+import os
+import sys
+import json
+import zlib
+import numpy as np
+from collections import defaultdict
+from app.services.text.preprocess import preprocess
+from app.services.text.build_index import read_dataset
+
+INDEX_DIR = "index_text/"
+DUPLICATES_FILE = "duplicates.json"
+
+SHINGLE_SIZE = 3      # shingles de 3 tokens consecutivos
+NUM_PERM = 128        # tamaño de la firma MinHash
+BANDS = 16            # 16 bandas x 8 filas -> umbral LSH ~ (1/16)^(1/8) ≈ 0.71
+THRESHOLD = 0.8       # Jaccard estimado mínimo para considerar duplicado
+
+MERSENNE_PRIME = (1 << 31) - 1
+
+# Caché en RAM: file_name -> (mtime, {docId -> clusterId})
+_CLUSTERS = {}
+# Índices sin duplicates.json ya avisados (un solo WARN por proceso)
+_WARNED_MISSING = set()
+
+
+# ============================================================
+# MINHASH
+# ============================================================
+
+def make_permutations(num_perm=NUM_PERM, seed=1):
+    """
+    Coeficientes (a, b) de las funciones h(x) = (a*x + b) mod p.
+    """
+    rnd = np.random.RandomState(seed)
+    a = rnd.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    b = rnd.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def shingle_hashes(tokens, size=SHINGLE_SIZE):
+    """
+    Hash (crc32, estable entre procesos) de cada shingle de tokens.
+    Textos más cortos que el shingle usan los tokens sueltos.
+    """
+    if len(tokens) < size:
+        grams = tokens
+    else:
+        grams = (" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1))
+
+    return np.fromiter(
+        {zlib.crc32(g.encode("utf-8")) for g in grams},
+        dtype=np.uint64
+    )
+
+
+def minhash_signature(tokens, perms):
+    """
+    Firma MinHash (NUM_PERM mínimos) de una lista de tokens preprocesados.
+    Retorna None si el documento no tiene tokens.
+    """
+    hashes = shingle_hashes(tokens)
+    if hashes.size == 0:
+        return None
+
+    a, b = perms
+    # (num_perm, num_shingles): a*x < 2^31 * 2^32, cabe en uint64
+    values = (np.outer(a, hashes & MERSENNE_PRIME) + b[:, None]) % MERSENNE_PRIME
+    return values.min(axis=1).astype(np.uint32)
+
+
+# ============================================================
+# LSH POR BANDAS + CLUSTERS
+# ============================================================
+
+def _find(parent, x):
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+
+def find_duplicate_clusters(docs, bands=BANDS, threshold=THRESHOLD):
+    """
+    docs: iterable de (docID, texto)
+
+    1. Firma MinHash por documento (tokens de preprocess)
+    2. Cada firma se corta en `bands` bandas; documentos con una banda
+       idéntica caen en el mismo bucket (candidatos)
+    3. Solo los candidatos de un mismo bucket se comparan (Jaccard estimado),
+       todos los pares del bucket: la similitud no es transitiva, comparar
+       solo contra el primero perdería pares que no se parecen a él
+    4. Union-find sobre los pares aceptados -> clusters
+
+    No hay comparación todos-contra-todos.
+    Retorna: lista de clusters (listas de docIDs, tamaño >= 2)
+    """
+    perms = make_permutations()
+    rows = NUM_PERM // bands
+
+    doc_ids = []
+    signatures = []
+
+    for docID, text in docs:
+        sig = minhash_signature(preprocess(text), perms)
+        if sig is not None:
+            doc_ids.append(docID)
+            signatures.append(sig)
+
+    print(f"[DEDUP] Firmas MinHash calculadas: {len(signatures)} documentos")
+
+    if not signatures:
+        return []
+
+    signatures = np.vstack(signatures)
+    parent = list(range(len(doc_ids)))
+    candidates = 0
+
+    for band in range(bands):
+        buckets = defaultdict(list)
+        band_slice = signatures[:, band * rows:(band + 1) * rows]
+
+        for i, row in enumerate(band_slice):
+            buckets[row.tobytes()].append(i)
+
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+
+            members = np.asarray(members)
+            bucket_sigs = signatures[members]
+            for pos in range(len(members) - 1):
+                # Un miembro contra todos los siguientes en una sola comparación vectorizada
+                similarity = np.mean(bucket_sigs[pos + 1:] == bucket_sigs[pos], axis=1)
+                candidates += len(similarity)
+
+                first = _find(parent, int(members[pos]))
+                for other in members[pos + 1:][similarity >= threshold].tolist():
+                    root = _find(parent, other)
+                    if root != first:
+                        parent[root] = first
+
+    groups = defaultdict(list)
+    for i, docID in enumerate(doc_ids):
+        groups[_find(parent, i)].append(docID)
+
+    clusters = [members for members in groups.values() if len(members) > 1]
+
+    print(f"[DEDUP] Pares candidatos verificados: {candidates}")
+    print(f"[DEDUP] Clusters de duplicados: {len(clusters)} ({sum(len(c) for c in clusters)} documentos)")
+
+    return clusters
+
+
+def build_duplicate_clusters(file: str, didx: int, tidx: int):
+    """
+    Job batch: detecta near-duplicates del dataset y guarda
+    index_text/<file>/duplicates.json = {docId: clusterId}
+    (solo documentos que pertenecen a un cluster).
+    """
+    docs, _, _, _ = read_dataset(file, didx, tidx)
+    clusters = find_duplicate_clusters(docs)
+
+    doc_cluster = {}
+    for cluster_id, members in enumerate(clusters):
+        for docID in members:
+            doc_cluster[docID] = cluster_id
+
+    output_dir = os.path.join(INDEX_DIR, file)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    with open(os.path.join(output_dir, DUPLICATES_FILE), "w", encoding="utf-8") as f:
+        json.dump(doc_cluster, f, ensure_ascii=False)
+
+    print(f"[DEDUP] → {os.path.join(output_dir, DUPLICATES_FILE)}")
+
+
+# ============================================================
+# CONSULTA: COLAPSAR DUPLICADOS
+# ============================================================
+
+def load_doc_clusters(file_name: str):
+    """
+    Retorna {docId -> clusterId} (cacheado) o {} si no se ejecutó el job.
+    """
+    path = os.path.join(INDEX_DIR, file_name, DUPLICATES_FILE)
+
+    if not os.path.exists(path):
+        if file_name not in _WARNED_MISSING:
+            _WARNED_MISSING.add(file_name)
+            print(f"[WARN] No existe {path}; no se colapsan duplicados")
+        return {}
+
+    mtime = os.path.getmtime(path)
+    cached = _CLUSTERS.get(file_name)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(path, "r", encoding="utf-8") as f:
+        doc_cluster = json.load(f)
+
+    _CLUSTERS[file_name] = (mtime, doc_cluster)
+    return doc_cluster
+
+
+def collapse_duplicates(ranked, doc_clusters, k, key=lambda item: item[0]):
+    """
+    Recorre `ranked` (ya ordenado por score) y se queda con el primer
+    documento de cada cluster, hasta k resultados.
+    """
+    seen = set()
+    results = []
+
+    for item in ranked:
+        cluster = doc_clusters.get(key(item))
+        if cluster is not None:
+            if cluster in seen:
+                continue
+            seen.add(cluster)
+
+        results.append(item)
+        if len(results) == k:
+            break
+
+    return results
+
+
+if __name__ == "__main__":
+    # Uso: python -m app.services.text.dedup <file> <docIdIdx> <textColumnIdx>
+    if len(sys.argv) != 4:
+        print("Uso: python -m app.services.text.dedup <file> <docIdIdx> <textColumnIdx>")
+        sys.exit(1)
+
+    build_duplicate_clusters(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))
@@ -4,10 +4,13 @@ import csv
 
 DOCS_PATH = "index_text/"
 
-def build_documents_jsonl(csv_path, dname: str, tname: str, file_name: str):
+def build_documents_jsonl(csv_path, dname: str, tname: str, file_name: str, doc_ids=None, progress=None):
     """
     Convierte tu CSV original en un JSONL:
     {"docID":..., "text":..., "title":..., "artist":...}
+
+    doc_ids: set opcional de docIds a incluir (p. ej. los de un shard).
+    progress: BuildProgress opcional; avanza con los caracteres de texto escritos.
     """
 
     out = open(DOCS_PATH + file_name + "/documents.jsonl", "w", encoding="utf-8")
@@ -15,6 +18,9 @@ def build_documents_jsonl(csv_path, dname: str, tname: str, file_name: str):
     with open(csv_path, "r", encoding="utf-8") as f:
         reader = csv.DictReader(f)
         for row in reader:
+            if doc_ids is not None and row[dname] not in doc_ids:
+                continue
+
             # Adaptar a tu CSV real
             doc = {
                 "docId": row[dname],
@@ -23,6 +29,8 @@ def build_documents_jsonl(csv_path, dname: str, tname: str, file_name: str):
             }
             json.dump(doc, out, ensure_ascii=False)
             out.write("\n")
+            if progress:
+                progress.advance(len(row[tname]))
 
     out.close()
     print("[DOCS] Archivo documents.jsonl generado.")
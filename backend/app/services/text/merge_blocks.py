@@ -6,12 +6,21 @@ import heapq
 BLOCK_DIR = "blocks_text/"
 INDEX_DIR = "index_text/"
 BUFFER_SIZE = 8192 * 16  # 128KB por buffer
+PROGRESS_EVERY = 1000  # términos entre reportes de progreso
+FORWARD_TERMS = 50  # términos de mayor peso guardados por documento (forward index)
 
 
-def merge_blocks(N, file_name: str):
+def merge_blocks(N, file_name: str, global_df=None, progress=None):
     """
     Merge de bloques SPIMI usando B buffers con heap (priority queue).
 
+    global_df: dict opcional { term -> df } del corpus completo. Se usa al
+    construir shards para que el idf (y las normas) sean consistentes entre
+    ellos; en ese caso N también debe ser el total global.
+
+    progress: BuildProgress opcional; avanza con los bytes de bloque
+    consumidos (el total de la fase es la suma de block_sizes()).
+
     MODIFICACIÓN CLAVE:
     - El diccionario se escribe ordenado alfabéticamente
     - Esto permite búsquedas binarias posteriores (opcional)
@@ -76,6 +85,10 @@ def merge_blocks(N, file_name: str):
 
     norms = {}
     terms_processed = 0
+    bytes_merged = 0
+
+    # Forward index: docID -> min-heap [(w_t_d, term)] con los FORWARD_TERMS mayores
+    forward = {}
 
     # ============================================================
     # ALMACENAR ENTRADAS DEL DICCIONARIO PARA ORDENAR
@@ -87,19 +100,21 @@ def merge_blocks(N, file_name: str):
     # ============================================================
     while heap:
         term, postings_str, block_idx = heapq.heappop(heap)
+        bytes_merged += len(term) + len(postings_str) + 2
 
         merged_postings = {}
         _parse_postings(postings_str, merged_postings)
 
         while heap and heap[0][0] == term:
             _, postings_str2, block_idx2 = heapq.heappop(heap)
+            bytes_merged += len(term) + len(postings_str2) + 2
             _parse_postings(postings_str2, merged_postings)
             _advance_block(block_handles[block_idx2], block_idx2, heap)
 
         # ============================================================
         # CALCULAR TF-IDF Y ACUMULAR NORMAS
         # ============================================================
-        df = len(merged_postings)
+        df = global_df.get(term, len(merged_postings)) if global_df else len(merged_postings)
         idf = math.log(N / df) if df > 0 else 0
 
         weighted_postings = []
@@ -109,6 +124,12 @@ def merge_blocks(N, file_name: str):
 
             norms[docID] = norms.get(docID, 0.0) + (w_t_d * w_t_d)
 
+            top_terms = forward.setdefault(docID, [])
+            if len(top_terms) < FORWARD_TERMS:
+                heapq.heappush(top_terms, (w_t_d, term))
+            elif w_t_d > top_terms[0][0]:
+                heapq.heapreplace(top_terms, (w_t_d, term))
+
             weighted_postings.append([docID, w_t_d])
 
         # ============================================================
@@ -130,6 +151,10 @@ def merge_blocks(N, file_name: str):
         terms_processed += 1
         _advance_block(block_handles[block_idx], block_idx, heap)
 
+        if progress and terms_processed % PROGRESS_EVERY == 0:
+            progress.advance(bytes_merged)
+            bytes_merged = 0
+
     # ============================================================
     # CERRAR ARCHIVOS DE BLOQUES Y POSTINGS
     # ============================================================
@@ -138,6 +163,9 @@ def merge_blocks(N, file_name: str):
     for fh in block_handles:
         fh.close()
 
+    if progress:
+        progress.advance(bytes_merged)
+
     # ============================================================
     # ESCRIBIR DICCIONARIO ORDENADO ALFABÉTICAMENTE
     # ============================================================
@@ -157,6 +185,11 @@ def merge_blocks(N, file_name: str):
     with open(norms_path, "w", encoding="utf-8") as nf:
         json.dump(norms, nf, indent=2, ensure_ascii=False)
 
+    # ============================================================
+    # ESCRIBIR FORWARD INDEX (términos de mayor peso por documento)
+    # ============================================================
+    forward_path, forward_offsets_path = _write_forward_index(forward, output_dir)
+
     print(f"[MERGE] Índice construido exitosamente:")
     print(f"  ✓ Términos únicos: {terms_processed}")
     print(f"  ✓ Documentos indexados: {len(norms)}")
@@ -165,12 +198,25 @@ def merge_blocks(N, file_name: str):
     print(f"  → {dict_path}")
     print(f"  → {postings_path}")
     print(f"  → {norms_path}")
+    print(f"  → {forward_path}")
+    print(f"  → {forward_offsets_path}")
 
 
 # ============================================================
 # FUNCIONES AUXILIARES
 # ============================================================
 
+def block_sizes(file_name: str):
+    """Bytes de los bloques SPIMI de file_name (total de la fase de merge)."""
+    block_path = os.path.join(BLOCK_DIR, file_name)
+    if not os.path.exists(block_path):
+        return 0
+    return sum(
+        os.path.getsize(os.path.join(block_path, f))
+        for f in os.listdir(block_path) if f.endswith(".txt")
+    )
+
+
 def _parse_postings(postings_str, merged_postings):
     """
     Parsea string de postings y acumula frecuencias.
@@ -185,6 +231,29 @@ def _parse_postings(postings_str, merged_postings):
                 merged_postings[docID] = merged_postings.get(docID, 0) + freq
 
 
+def _write_forward_index(forward, output_dir):
+    """
+    Escribe forward.jsonl: una línea por documento con sus términos
+    ordenados por peso, {"docId": ..., "terms": [[term, w_t_d], ...]},
+    y forward_offsets.json: { docId -> offset } para leer una sola línea.
+    """
+    forward_path = os.path.join(output_dir, "forward.jsonl")
+    offsets_path = os.path.join(output_dir, "forward_offsets.json")
+
+    offsets = {}
+    with open(forward_path, "w", encoding="utf-8", buffering=BUFFER_SIZE) as ff:
+        for docID, top_terms in forward.items():
+            offsets[docID] = ff.tell()
+            terms = [[term, w] for w, term in sorted(top_terms, reverse=True)]
+            json.dump({"docId": docID, "terms": terms}, ff, ensure_ascii=False)
+            ff.write("\n")
+
+    with open(offsets_path, "w", encoding="utf-8") as of:
+        json.dump(offsets, of, ensure_ascii=False)
+
+    return forward_path, offsets_path
+
+
 def _advance_block(file_handle, block_idx, heap):
     """
     Lee la siguiente línea del bloque y la inserta en el heap.
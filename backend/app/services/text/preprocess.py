@@ -5,11 +5,31 @@ from nltk.corpus import stopwords
 
 stemmer = SnowballStemmer("spanish")
 
+
+def ensure_stopwords():
+    """Descarga el corpus de stopwords solo si no está instalado (sin red en cada build)."""
+    try:
+        nltk.data.find("corpora/stopwords")
+    except LookupError:
+        nltk.download("stopwords", quiet=True)
+
+
+ensure_stopwords()
 stop = set(stopwords.words("spanish"))
 
 RE_NON_ALPHANUM = re.compile(r"[^a-z0-9áéíóúñü]+")
 RE_MULTI_SPACES = re.compile(r"\s+")
 
+def tokenize(text: str):
+    """
+    Pasos 1-5 de preprocess (sin stemming): las palabras tal como se
+    escriben, útiles para mostrarlas (autocompletado).
+    """
+    text = RE_NON_ALPHANUM.sub(" ", text.lower())
+    text = RE_MULTI_SPACES.sub(" ", text).strip()
+    return [t for t in text.split() if t not in stop]
+
+
 def preprocess(text: str):
     """
     Preprocesa un texto aplicando:
@@ -1,10 +1,14 @@
 import os
 import json
 import math
+import numpy as np
 from collections import defaultdict
 from app.services.text.preprocess import preprocess
+from app.services.text.attributes import allowed_mask, load_doc_rows, load_columns
+from app.services.text.dedup import load_doc_clusters, collapse_duplicates
 
 INDEX_DIR = "index_text/"
+SMALL_FILTER_DOCS = 64    # filtros con <= N documentos: sus pesos se leen de la línea cruda, sin parsear postings
 
 
 # ============================================================
@@ -95,6 +99,18 @@ def load_postings_for_term(term, term_info, file_name: str):
         return []
 
 
+def _term_infos_by_offset(query_terms, file_name: str):
+    """[(term, (offset, df))] de los términos del diccionario, ordenados por offset."""
+    term_infos = []
+    for term in query_terms:
+        info = get_term_info(term, file_name)
+        if info:
+            term_infos.append((term, info))
+
+    term_infos.sort(key=lambda x: x[1][0])  # Ordenar por offset
+    return term_infos
+
+
 def load_postings_batch_optimized(query_terms, file_name: str):
     """
     Carga postings SOLO de los términos de la query.
@@ -106,19 +122,11 @@ def load_postings_batch_optimized(query_terms, file_name: str):
 
     Retorna: dict { term -> [[docID, weight], ...] }
     """
-    # 1. Obtener info de términos (sin cargar diccionario completo)
-    term_infos = []
-    for term in query_terms:
-        info = get_term_info(term, file_name)
-        if info:
-            term_infos.append((term, info))
-
+    # 1-2. Info de términos (sin cargar diccionario completo), ordenada por offset
+    term_infos = _term_infos_by_offset(query_terms, file_name)
     if not term_infos:
         return {}
 
-    # 2. Ordenar por offset para lectura secuencial
-    term_infos.sort(key=lambda x: x[1][0])  # Ordenar por offset
-
     # 3. Leer postings
     results = {}
     postings_path = os.path.join(INDEX_DIR, file_name, "postings.jsonl")
@@ -133,6 +141,43 @@ def load_postings_batch_optimized(query_terms, file_name: str):
     return results
 
 
+def load_postings_for_docs(query_terms, doc_ids, file_name: str):
+    """
+    Como load_postings_batch_optimized, pero solo con las entradas de
+    doc_ids (pocos documentos que pasaron un filtro): en vez de parsear la
+    lista completa, busca cada ["docId", en la línea cruda. json.dumps
+    del docId reproduce exactamente cómo lo escribió merge_blocks.
+
+    Retorna: dict { term -> [[docID, weight], ...] }
+    """
+    term_infos = _term_infos_by_offset(query_terms, file_name)
+    if not term_infos:
+        return {}
+
+    keys = [(docID, "[" + json.dumps(docID, ensure_ascii=False) + ", ") for docID in doc_ids]
+
+    results = {}
+    postings_path = os.path.join(INDEX_DIR, file_name, "postings.jsonl")
+
+    with open(postings_path, "r", encoding="utf-8") as pf:
+        for term, (offset, _) in term_infos:
+            pf.seek(offset)
+            line = pf.readline()
+            # Saltar el término: sus caracteres no deben confundirse con un docId
+            start = line.index('"postings": ')
+
+            postings = []
+            for docID, key in keys:
+                pos = line.find(key, start)
+                if pos < 0:
+                    continue
+                pos += len(key)
+                postings.append([docID, float(line[pos:line.index("]", pos)])])
+            results[term] = postings
+
+    return results
+
+
 # ============================================================
 # TF-IDF PARA LA QUERY (SIN CARGAR DICCIONARIO COMPLETO)
 # ============================================================
@@ -256,7 +301,7 @@ def get_snippet(text, query_terms, window=40):
 # MOTOR DE BÚSQUEDA OPTIMIZADO (SIN CACHÉ EN RAM)
 # ============================================================
 
-def search_query(q, k=10, file_name="spotify_songs"):
+def search_query(q, k=10, file_name="spotify_songs", filters=None, collapse=False):
     """
     Motor principal de búsqueda COMPLETAMENTE OPTIMIZADO.
 
@@ -270,6 +315,10 @@ def search_query(q, k=10, file_name="spotify_songs"):
         q: string con la consulta
         k: top K resultados
         file_name: nombre del dataset indexado
+        filters: filtros de rango sobre atributos, p. ej. "valence<=0.3,tempo<100"
+                 (se aplican DENTRO del bucle de scoring, no sobre el top-K)
+        collapse: si es True, deja un solo documento por cluster de
+                  near-duplicates (requiere haber corrido dedup.py)
 
     Salida:
         lista de documentos ordenados por score
@@ -294,9 +343,47 @@ def search_query(q, k=10, file_name="spotify_songs"):
     if not wq:
         return []
 
-    # 4. Cargar postings SOLO de términos de la query
+    # 3.1 Bitmap de filtros por atributos (columnas memory-mapped)
+    #     Lanza ValueError si los filtros son inválidos.
+    allowed = allowed_mask(filters, file_name)
+
+    if allowed is not None and not allowed.any():
+        return []
+
+    doc_clusters = load_doc_clusters(file_name) if collapse else None
+
+    # 4-10. Scoring y carga de los top-K documentos
+    return rank_documents(wq, terms, k, file_name, allowed, doc_clusters)
+
+
+def rank_documents(wq, terms, k, file_name: str, allowed=None, doc_clusters=None):
+    """
+    Scoring de coseno para un vector de query YA calculado (pasos 4-10).
+
+    Separado de search_query para poder ejecutarlo sobre un shard con
+    un vector de query global (ver shards.py).
+
+    Entrada:
+        wq: dict( term -> weight_normalizado )
+        terms: tokens de la query (para el snippet)
+        allowed: bitmap de filas permitidas por los filtros (allowed_mask), o None
+        doc_clusters: dict { docId -> clusterId } para colapsar duplicados, o None
+    """
+
+    # 4. Cargar postings SOLO de términos de la query. Con un filtro que
+    #    deja pocos documentos se leen solo sus pesos (sin parsear listas)
+    doc_rows = None
     try:
-        postings_batch = load_postings_batch_optimized(wq.keys(), file_name)
+        if allowed is None:
+            postings_batch = load_postings_batch_optimized(wq.keys(), file_name)
+        elif np.count_nonzero(allowed) <= SMALL_FILTER_DOCS:
+            doc_ids, _ = load_columns(file_name)
+            postings_batch = load_postings_for_docs(
+                wq.keys(), [doc_ids[row] for row in np.flatnonzero(allowed)], file_name
+            )
+        else:
+            postings_batch = load_postings_batch_optimized(wq.keys(), file_name)
+            doc_rows = load_doc_rows(file_name)
     except Exception as e:
         print(f"[ERROR] Error cargando postings: {e}")
         return []
@@ -310,8 +397,15 @@ def search_query(q, k=10, file_name="spotify_songs"):
 
         postings = postings_batch[term]
 
-        for docID, w_t_d in postings:
-            scores[docID] += wq_t * w_t_d
+        if doc_rows is None:
+            for docID, w_t_d in postings:
+                scores[docID] += wq_t * w_t_d
+        else:
+            # Documentos fuera del filtro se descartan antes de acumular
+            for docID, w_t_d in postings:
+                row = doc_rows.get(docID)
+                if row is not None and allowed[row]:
+                    scores[docID] += wq_t * w_t_d
 
     # 6. Cargar normas SOLO UNA VEZ (necesario para normalización)
     # NOTA: Las normas son pequeñas comparadas con postings,
@@ -335,7 +429,12 @@ def search_query(q, k=10, file_name="spotify_songs"):
 
     # 8. Ordenar top-K
     results = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-    results = results[:k]
+
+    if doc_clusters:
+        # Un documento por cluster; se sigue bajando en el ranking hasta tener K
+        results = collapse_duplicates(results, doc_clusters, k)
+    else:
+        results = results[:k]
 
     # 9. Construir índice de documentos (pequeño, solo offsets)
     doc_index = build_doc_index_optimized(file_name)
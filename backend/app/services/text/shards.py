@@ -0,0 +1,288 @@
+import os
+import json
+import heapq
+import threading
+import multiprocessing as mp
+from collections import defaultdict
+from app.services.executors import RestartingProcessPool
+from app.services.text.build_index import read_dataset, staging_name, reset_staging, publish_index, INDEX_DIR, SHARDS_MANIFEST
+from app.services.text.spimi import spimi_invert, BLOCK_DIR
+from app.services.text.merge_blocks import merge_blocks, block_sizes
+from app.services.text.documents import build_documents_jsonl
+from app.services.text.attributes import build_attribute_columns, parse_filters, allowed_mask
+from app.services.text.suggest import build_suggestions
+from app.services.text.preprocess import preprocess
+from app.services.text.search_engine import compute_query_weights_optimized, rank_documents
+from app.services.text.dedup import load_doc_clusters, collapse_duplicates
+from app.services.text.similar import load_forward_terms, forward_query_vector, DEFAULT_TERMS
+
+# Pools de procesos compartidos por las consultas particionadas, uno por
+# cantidad de shards (nunca se reemplaza un pool con consultas en curso,
+# salvo que esté roto: ver RestartingProcessPool)
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+# Con colapso, cada shard devuelve k * COLLAPSE_OVERFETCH: los duplicados
+# de distintos shards recién se descartan en el coordinador
+COLLAPSE_OVERFETCH = 4
+
+
+def shard_name(file_name: str, shard_id: int):
+    """
+    Nombre del shard como sub-dataset: index_text/<file_name>/shard_<i>/
+    """
+    return f"{file_name}/shard_{shard_id}"
+
+
+# ============================================================
+# CONSTRUCCIÓN DE SHARDS (PARTICIÓN POR DOCUMENTOS)
+# ============================================================
+
+def build_sharded_index(file: str, didx: int, tidx: int, n_shards=4, progress=None):
+    """
+    Construye N shards particionados por documento con idf GLOBAL.
+
+    1. Reparte los documentos round-robin entre los shards
+    2. SPIMI independiente por shard
+    3. Intercambio de df: se suman los df de los bloques de todos los shards
+    4. Merge de cada shard con el df y N globales (idf y normas consistentes)
+    5. Diccionario global (solo df) en index_text/<file>/ para calcular
+       el vector de la query una sola vez en el coordinador
+
+    Como build_index, se construye en el staging y se publica al final.
+
+    progress: BuildProgress opcional; cada fase cubre todos los shards.
+    """
+    csv_path = f"data/{file}.csv"
+    staged = staging_name(file)
+
+    docs, dname, tname, track_names = read_dataset(file, didx, tidx)
+    N = len(docs)
+    total_bytes = sum(len(text) for _, text in docs)
+
+    partitions = [docs[i::n_shards] for i in range(n_shards)]
+
+    # Bloques viejos de otro build contaminarían el merge
+    reset_staging(file)
+
+    print(f"[SHARDS] Construyendo {n_shards} shards para {N} documentos…")
+    try:
+        if progress:
+            progress.start_phase("spimi", total_bytes, docs_total=N)
+
+        for i, part in enumerate(partitions):
+            print(f"[SHARDS] Shard {i}: SPIMI sobre {len(part)} documentos")
+            spimi_invert(part, file_name=shard_name(staged, i), progress=progress)
+
+        print("[SHARDS] Intercambiando df entre shards…")
+        global_df = collect_global_df(staged, n_shards)
+
+        if progress:
+            progress.start_phase("merge", sum(block_sizes(shard_name(staged, i)) for i in range(n_shards)))
+        for i in range(n_shards):
+            print(f"[SHARDS] Shard {i}: merge con idf global")
+            merge_blocks(N=N, file_name=shard_name(staged, i), global_df=global_df, progress=progress)
+
+        if progress:
+            progress.start_phase("docs", total_bytes)
+        for i, part in enumerate(partitions):
+            name = shard_name(staged, i)
+            ids = {docId for docId, _ in part}
+            build_documents_jsonl(csv_path, dname, tname, file_name=name, doc_ids=ids, progress=progress)
+            build_attribute_columns(csv_path, dname, file_name=name, doc_ids=ids)
+
+        write_global_dictionary(global_df, staged)
+
+        with open(os.path.join(INDEX_DIR, staged, SHARDS_MANIFEST), "w", encoding="utf-8") as f:
+            json.dump({"shards": n_shards, "N": N}, f)
+
+        build_suggestions(track_names, file_name=staged, texts=(text for _, text in docs))
+    except BaseException:
+        reset_staging(file)
+        raise
+
+    publish_index(file)
+
+    print(f"[SHARDS] Índice particionado construido: {n_shards} shards, {len(global_df)} términos")
+
+
+def collect_global_df(file_name: str, n_shards: int):
+    """
+    Suma el df de cada término sobre los bloques SPIMI de todos los shards.
+
+    Cada documento queda completo en un único bloque, así que el df de un
+    término es la cantidad total de postings en las líneas de ese término.
+    """
+    global_df = defaultdict(int)
+
+    for i in range(n_shards):
+        block_dir = os.path.join(BLOCK_DIR, shard_name(file_name, i))
+
+        for bf in sorted(os.listdir(block_dir)):
+            if not bf.endswith(".txt"):
+                continue
+
+            with open(os.path.join(block_dir, bf), "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split(":", 1)
+                    if len(parts) == 2 and parts[1]:
+                        global_df[parts[0]] += parts[1].count(";") + 1
+
+    return global_df
+
+
+def write_global_dictionary(global_df, file_name: str):
+    """
+    Escribe index_text/<file>/dictionary.txt con el formato de siempre
+    (term|offset|df), pero con offset -1: en la raíz no hay postings,
+    solo sirve para los df globales (query TF-IDF y autocompletado).
+    """
+    output_dir = os.path.join(INDEX_DIR, file_name)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    with open(os.path.join(output_dir, "dictionary.txt"), "w", encoding="utf-8") as f:
+        for term in sorted(global_df):
+            f.write(f"{term}|-1|{global_df[term]}\n")
+
+
+# ============================================================
+# CONSULTA SCATTER-GATHER
+# ============================================================
+
+def load_manifest(file_name: str):
+    """
+    Retorna {"shards": n, "N": total} o None si el índice no está particionado.
+    """
+    path = os.path.join(INDEX_DIR, file_name, SHARDS_MANIFEST)
+
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def is_sharded(file_name: str):
+    return load_manifest(file_name) is not None
+
+
+def get_pool(n_workers: int):
+    """
+    Pool de procesos de n_workers, creado una sola vez por tamaño.
+
+    Las consultas llegan desde los hilos de text_search: el lock evita
+    crear dos pools a la vez, y spawn (no fork) evita que los workers
+    hereden locks tomados por otros hilos del proceso. Si un worker
+    muere, el pool se recrea y la consulta se reintenta una vez.
+    """
+    with _POOLS_LOCK:
+        pool = _POOLS.get(n_workers)
+        if pool is None:
+            pool = RestartingProcessPool(n_workers, mp.get_context("spawn"))
+            _POOLS[n_workers] = pool
+        return pool
+
+
+def shutdown_pools():
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.shutdown()
+        _POOLS.clear()
+
+
+def _search_shard(args):
+    """
+    Worker: scoring de UN shard con el vector de query global.
+    Retorna su top-K local ya formateado.
+
+    clusters_name: dataset raíz cuyos duplicados se colapsan (o None).
+    Cada worker los carga una vez (load_doc_clusters cachea por mtime)
+    en vez de recibir el dict serializado en cada tarea.
+    """
+    wq, terms, k, name, filters, clusters_name = args
+    doc_clusters = load_doc_clusters(clusters_name) if clusters_name else None
+
+    allowed = allowed_mask(filters, name)
+    if allowed is not None and not allowed.any():
+        return []
+
+    return rank_documents(wq, terms, k, name, allowed, doc_clusters)
+
+
+def search_sharded(q, k=10, file_name="spotify_songs", filters=None, collapse=False):
+    """
+    Coordinador: calcula el vector de la query con los df globales,
+    lo envía a todos los shards en paralelo y mezcla sus top-K.
+
+    Misma salida que search_query.
+    """
+    manifest = load_manifest(file_name)
+    if manifest is None:
+        print(f"[ERROR] '{file_name}' no es un índice particionado")
+        return []
+
+    terms = preprocess(q)
+
+    if not terms:
+        return []
+
+    # Validar filtros en el coordinador (ValueError antes de repartir)
+    parse_filters(filters)
+
+    wq = compute_query_weights_optimized(terms, manifest["N"], file_name)
+
+    if not wq:
+        return []
+
+    # Los clusters de duplicados son globales (un cluster puede cruzar shards)
+    doc_clusters = load_doc_clusters(file_name) if collapse else None
+
+    return _scatter_gather(wq, terms, k, file_name, manifest["shards"], filters, doc_clusters)
+
+
+def similar_sharded(docId, k=10, file_name="spotify_songs", n_terms=DEFAULT_TERMS):
+    """
+    "More like this" sobre un índice particionado: busca el forward index
+    del documento en su shard y reparte el vector truncado a todos.
+
+    Misma salida que similar.similar_documents.
+    """
+    manifest = load_manifest(file_name)
+    if manifest is None:
+        print(f"[ERROR] '{file_name}' no es un índice particionado")
+        return []
+
+    forward_terms = None
+    for i in range(manifest["shards"]):
+        forward_terms = load_forward_terms(docId, shard_name(file_name, i))
+        if forward_terms is not None:
+            break
+
+    if forward_terms is None:
+        return None
+
+    wq = forward_query_vector(forward_terms, n_terms)
+    if not wq:
+        return []
+
+    results = _scatter_gather(wq, list(wq.keys()), k + 1, file_name, manifest["shards"])
+    return [r for r in results if r["docId"] != docId][:k]
+
+
+def _scatter_gather(wq, terms, k, file_name, n_shards, filters=None, doc_clusters=None):
+    """
+    Envía el vector de query a todos los shards en paralelo y mezcla
+    sus top-K (cada lista ya viene ordenada por score).
+    """
+    clusters_name = file_name if doc_clusters else None
+    shard_k = k * COLLAPSE_OVERFETCH if doc_clusters else k
+    tasks = [(wq, terms, shard_k, shard_name(file_name, i), filters, clusters_name) for i in range(n_shards)]
+
+    partials = get_pool(n_shards).map(_search_shard, tasks)
+
+    merged = heapq.merge(*partials, key=lambda r: r["score"], reverse=True)
+
+    if doc_clusters:
+        return collapse_duplicates(merged, doc_clusters, k, key=lambda r: r["docId"])
+
+    return [r for _, r in zip(range(k), merged)]
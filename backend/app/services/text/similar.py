@@ -0,0 +1,92 @@
+import os
+import json
+import math
+from app.services.text.search_engine import rank_documents
+from app.services.text.merge_blocks import FORWARD_TERMS
+
+INDEX_DIR = "index_text/"
+DEFAULT_TERMS = 20  # términos del documento usados como query
+
+# Caché en RAM: file_name -> (mtime, { docId -> offset en forward.jsonl })
+_FORWARD_OFFSETS = {}
+
+
+# ============================================================
+# ACCESO AL FORWARD INDEX
+# ============================================================
+
+def _load_forward_offsets(file_name: str):
+    path = os.path.join(INDEX_DIR, file_name, "forward_offsets.json")
+
+    if not os.path.exists(path):
+        return {}
+
+    mtime = os.path.getmtime(path)
+    cached = _FORWARD_OFFSETS.get(file_name)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(path, "r", encoding="utf-8") as f:
+        offsets = json.load(f)
+
+    _FORWARD_OFFSETS[file_name] = (mtime, offsets)
+    return offsets
+
+
+def load_forward_terms(docId, file_name: str):
+    """
+    Lee UNA línea de forward.jsonl.
+    Retorna: [[term, w_t_d], ...] ordenado por peso, o None si no existe.
+    """
+    offsets = _load_forward_offsets(file_name)
+    if docId not in offsets:
+        return None
+
+    forward_path = os.path.join(INDEX_DIR, file_name, "forward.jsonl")
+    with open(forward_path, "r", encoding="utf-8") as f:
+        f.seek(offsets[docId])
+        return json.loads(f.readline())["terms"]
+
+
+def forward_query_vector(forward_terms, n_terms=DEFAULT_TERMS):
+    """
+    Trunca el vector del documento a sus n_terms términos de mayor peso
+    y lo normaliza, igual que compute_query_weights_optimized.
+
+    return: dict( term -> weight_normalizado )
+    """
+    n_terms = max(1, min(n_terms, FORWARD_TERMS))
+    wq = {term: w for term, w in forward_terms[:n_terms] if w > 0}
+
+    norm_q = math.sqrt(sum(w * w for w in wq.values()))
+    if norm_q > 0:
+        wq = {term: w / norm_q for term, w in wq.items()}
+
+    return wq
+
+
+# ============================================================
+# "MORE LIKE THIS"
+# ============================================================
+
+def similar_documents(docId, k=10, file_name="spotify_songs", n_terms=DEFAULT_TERMS):
+    """
+    Documentos léxicamente similares a docId.
+
+    En vez de re-consultar con la letra completa (cientos de listas de
+    postings), usa los n_terms términos de mayor peso del forward index,
+    así la latencia es la de una query corta.
+
+    Retorna None si el documento no está en el índice.
+    """
+    forward_terms = load_forward_terms(docId, file_name)
+    if forward_terms is None:
+        return None
+
+    wq = forward_query_vector(forward_terms, n_terms)
+    if not wq:
+        return []
+
+    # k + 1: el propio documento siempre sale primero
+    results = rank_documents(wq, list(wq.keys()), k + 1, file_name)
+    return [r for r in results if r["docId"] != docId][:k]
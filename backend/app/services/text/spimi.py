@@ -6,7 +6,7 @@ from app.services.text.preprocess import preprocess
 BLOCK_DIR = "blocks_text/"
 
 
-def spimi_invert(docs, file_name: str, max_memory_mb=10):
+def spimi_invert(docs, file_name: str, max_memory_mb=10, progress=None):
     """
     Construye bloques SPIMI a partir de una lista de documentos.
 
@@ -18,6 +18,8 @@ def spimi_invert(docs, file_name: str, max_memory_mb=10):
     - Dataset pequeño (~1000 docs): 5-10 MB
     - Dataset mediano (~10k docs): 20-50 MB
     - Dataset grande (~100k docs): 100-200 MB
+
+    progress: BuildProgress opcional (docs, bytes y bloques; permite cancelar)
     """
 
     block_dir = os.path.join(BLOCK_DIR, file_name)
@@ -50,6 +52,8 @@ def spimi_invert(docs, file_name: str, max_memory_mb=10):
             term_dict[term][docID] += freq
 
         doc_count += 1
+        if progress:
+            progress.advance(len(text), docs=1)
 
         # Estimar memoria usada (cada 100 documentos para eficiencia)
         if doc_count % 100 == 0:
@@ -64,6 +68,8 @@ def spimi_invert(docs, file_name: str, max_memory_mb=10):
             if memory_estimate >= MEMORY_LIMIT:
                 print(f"[SPIMI] Límite alcanzado con {doc_count} docs, escribiendo bloque {block_id}...")
                 write_block(term_dict, block_id, block_dir)
+                if progress:
+                    progress.block_written()
                 term_dict = defaultdict(dict)
                 block_id += 1
                 doc_count = 0  # Reset contador
@@ -72,6 +78,8 @@ def spimi_invert(docs, file_name: str, max_memory_mb=10):
     if term_dict:
         print(f"[SPIMI] Escribiendo último bloque {block_id}...")
         write_block(term_dict, block_id, block_dir)
+        if progress:
+            progress.block_written()
         block_id += 1
 
     print(f"[SPIMI] ✓ Indexación completa: {block_id} bloque(s) creado(s)")
@@ -0,0 +1,226 @@
+import os
+import re
+import json
+import heapq
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from app.services.text.preprocess import tokenize, stemmer
+
+INDEX_DIR = "index_text/"
+SUGGEST_FILE = "suggest.json"
+
+TOP_N = 10            # completions precalculadas por prefijo
+MAX_PREFIX_LEN = 3    # prefijos cortos (los más frecuentes al tipear)
+
+RE_NON_ALPHANUM = re.compile(r"[^a-z0-9áéíóúñü]+")
+
+# Caché en RAM: file_name -> (mtime, {"tracks": PrefixSuggester, "terms": PrefixSuggester})
+_SUGGESTERS = {}
+
+
+def normalize(text: str):
+    """
+    Normaliza un texto para compararlo por prefijo:
+    minúsculas, sin signos y con espacios simples.
+    """
+    return RE_NON_ALPHANUM.sub(" ", text.lower()).strip()
+
+
+# ============================================================
+# ESTRUCTURA DE PREFIJOS (ARREGLO ORDENADO + TOP-N PRECALCULADO)
+# ============================================================
+
+class PrefixSuggester:
+    """
+    Arreglo ordenado de claves normalizadas.
+
+    - Prefijos de hasta MAX_PREFIX_LEN caracteres: top-N precalculado,
+      la consulta es un lookup en un dict.
+    - Prefijos más largos: búsqueda binaria sobre el arreglo y top-N
+      sobre el rango (pequeño, porque el prefijo ya es selectivo).
+    """
+
+    def __init__(self, keys, labels, scores, top):
+        self.keys = keys
+        self.labels = labels
+        self.scores = scores
+        self.top = top
+
+    @classmethod
+    def build(cls, items, top_n=TOP_N):
+        """
+        items: iterable de (label, score)
+        """
+        best = {}
+        for label, score in items:
+            key = normalize(label)
+            if not key:
+                continue
+            if key not in best or score > best[key][1]:
+                best[key] = (label, score)
+
+        keys = sorted(best)
+        labels = [best[key][0] for key in keys]
+        scores = [best[key][1] for key in keys]
+
+        top = {}
+        for i, key in enumerate(keys):
+            for length in range(1, min(len(key), MAX_PREFIX_LEN) + 1):
+                top.setdefault(key[:length], []).append(i)
+
+        for prefix, idxs in top.items():
+            top[prefix] = heapq.nlargest(top_n, idxs, key=lambda j: scores[j])
+
+        return cls(keys, labels, scores, top)
+
+    def lookup(self, prefix, k=TOP_N):
+        if not prefix:
+            return []
+
+        if len(prefix) <= MAX_PREFIX_LEN:
+            idxs = self.top.get(prefix, [])[:k]
+        else:
+            lo = bisect_left(self.keys, prefix)
+            hi = bisect_right(self.keys, prefix + "\uffff", lo)
+            idxs = heapq.nlargest(k, range(lo, hi), key=lambda j: self.scores[j])
+
+        return [(self.labels[j], self.scores[j]) for j in idxs]
+
+    def to_dict(self):
+        return {
+            "keys": self.keys,
+            "labels": self.labels,
+            "scores": self.scores,
+            "top": self.top,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["keys"], data["labels"], data["scores"], data["top"])
+
+
+# ============================================================
+# CONSTRUCCIÓN (DURANTE build_index)
+# ============================================================
+
+def surface_forms(texts):
+    """
+    {stem -> palabra más frecuente que lo produce} sobre los textos del
+    dataset: el diccionario guarda stems ("coraz") y al usuario se le
+    sugiere la palabra escrita ("corazón"). Cada palabra distinta se
+    stemmiza una sola vez.
+    """
+    counts = Counter()
+    for text in texts:
+        counts.update(tokenize(text))
+
+    best = {}
+    for word, count in counts.items():
+        stem = stemmer.stem(word)
+        if stem not in best or count > best[stem][1]:
+            best[stem] = (word, count)
+
+    return {stem: word for stem, (word, _) in best.items()}
+
+
+def build_suggestions(track_names, file_name: str, texts=()):
+    """
+    Construye suggest.json a partir de:
+    - track_names: lista de (nombre, peso) leída del CSV
+    - dictionary.txt: términos del índice con su df como peso, mostrados
+      con su forma más frecuente en texts (surface_forms)
+
+    NOTA: No lee postings.jsonl, solo el diccionario.
+    """
+    output_dir = os.path.join(INDEX_DIR, file_name)
+    dict_path = os.path.join(output_dir, "dictionary.txt")
+
+    surface = surface_forms(texts)
+
+    terms = []
+    if os.path.exists(dict_path):
+        with open(dict_path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.strip().split("|")
+                if len(parts) == 3:
+                    terms.append((surface.get(parts[0], parts[0]), int(parts[2])))
+
+    tracks = PrefixSuggester.build(track_names)
+    term_suggester = PrefixSuggester.build(terms)
+
+    with open(os.path.join(output_dir, SUGGEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(
+            {"tracks": tracks.to_dict(), "terms": term_suggester.to_dict()},
+            f,
+            ensure_ascii=False
+        )
+
+    print(f"[SUGGEST] Autocompletado generado: {len(tracks.keys)} canciones, {len(term_suggester.keys)} términos")
+
+
+# ============================================================
+# CONSULTA (POR TECLA)
+# ============================================================
+
+def _load_suggesters(file_name: str):
+    """
+    Carga suggest.json una sola vez por dataset.
+    Se recarga si el archivo cambió (p. ej. tras reconstruir el índice).
+    """
+    path = os.path.join(INDEX_DIR, file_name, SUGGEST_FILE)
+
+    if not os.path.exists(path):
+        print(f"[ERROR] No existe el autocompletado: {path}")
+        return None
+
+    mtime = os.path.getmtime(path)
+    cached = _SUGGESTERS.get(file_name)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    suggesters = {
+        "tracks": PrefixSuggester.from_dict(data["tracks"]),
+        "terms": PrefixSuggester.from_dict(data["terms"]),
+    }
+    _SUGGESTERS[file_name] = (mtime, suggesters)
+    return suggesters
+
+
+def suggest(q: str, k=TOP_N, file_name="spotify_songs"):
+    """
+    Devuelve hasta k sugerencias para el texto parcial q:
+    - Nombres de canciones que empiezan con q
+    - Términos del diccionario que completan la última palabra de q
+    """
+    suggesters = _load_suggesters(file_name)
+    if suggesters is None:
+        return []
+
+    prefix = normalize(q)
+    if not prefix:
+        return []
+
+    tracks = suggesters["tracks"].lookup(prefix, k)
+
+    words = prefix.split(" ")
+    head = " ".join(words[:-1])
+    track_keys = {normalize(label) for label, _ in tracks}
+
+    terms = []
+    for term, df in suggesters["terms"].lookup(words[-1], k):
+        text = f"{head} {term}" if head else term
+        if text not in track_keys:
+            terms.append((text, df))
+
+    # Mitad canciones, mitad términos (si falta de uno, se completa con el otro)
+    n_terms = min(len(terms), k // 2)
+    n_tracks = min(len(tracks), k - n_terms)
+    n_terms = min(len(terms), k - n_tracks)
+
+    results = [{"text": label, "type": "track", "score": score} for label, score in tracks[:n_tracks]]
+    results += [{"text": text, "type": "term", "score": df} for text, df in terms[:n_terms]]
+
+    return results
@@ -5,6 +5,14 @@ import numpy as np
 import faiss
 from tabulate import tabulate
 from collections import defaultdict
+from app.services.image.sparse_index import (
+    load_sparse_models, normalize_rows, top_k, load_manifest, impact_order, inverted_scores, print_df_report
+)
+from app.services.image.hnsw import HNSWIndex, hnsw_exists
+from app.services.image.quantized import (
+    load_scalar, load_product, build_scalar_codes, train_product_quantizer,
+    encode_product, scalar_scores, product_scores, rerank
+)
 
 # --- CONFIGURACIÓN ---
 MODELS_DIR = "data/fashion/models"
@@ -12,34 +20,38 @@ MODELS_DIR = "data/fashion/models"
 N_VALUES = [1000, 2000, 4000, 8000, 16000, 32000, 44000]
 K_NEIGHBORS = 8
 NUM_QUERIES = 5 
+BATCH_QUERIES = 100
+HNSW_EF_VALUES = [8, 16, 32, 64, 128, 256]
+RERANK_VALUES = [0, 32, 64, 128]
+STOP_WORD_PCTS = [0, 1, 5, 10]          # % de palabras de mayor df omitidas en la query
+POSTINGS_CAPS = [None, 0.5, 0.2, 0.1]   # tope por lista como fracción de las imágenes
 
-def build_mini_inverted_index(histograms_slice, idf, n_docs):
+def build_mini_inverted_index(vectors_slice, n_docs):
     """
     Construye las estructuras en RAM para simular tu motor (Offline).
     Esto NO se mide en el tiempo de búsqueda.
+    vectors_slice: {img_id: vector TF-IDF denso}
     """
     dense_vectors = [] # Para secuencial
     inverted_index = defaultdict(list) # Para invertido
     norms = [] # Para ambos
     ids_map = [] # Para mapear índice i -> img_id
     
-    keys = list(histograms_slice.keys())
+    keys = list(vectors_slice.keys())
     
     for i, img_id in enumerate(keys):
         ids_map.append(img_id)
-        hist = histograms_slice[img_id]
         
         # Vector real y norma
-        vec = hist * idf
+        vec = vectors_slice[img_id]
         norm = np.linalg.norm(vec)
         norms.append(norm)
         dense_vectors.append(vec)
         
         # Llenar postings
-        for word_idx, val in enumerate(hist):
+        for word_idx, val in enumerate(vec):
             if val > 0:
-                weight = val * idf[word_idx]
-                inverted_index[word_idx].append((i, weight))
+                inverted_index[word_idx].append((i, val))
                 
     return dense_vectors, inverted_index, norms
 
@@ -64,6 +76,18 @@ def search_sequential_strict(query_vec, db_vectors, norms, k=8):
     scores.sort(reverse=True)
     return scores[:k]
 
+def search_sequential_vectorized(query_vec, X_normalized, k=8):
+    """Versión actual de _search_sequential: un producto matriz-vector + argpartition"""
+    q = (query_vec / np.linalg.norm(query_vec)).astype(np.float32)
+    scores = X_normalized @ q
+    return scores[top_k(scores, k)]
+
+def search_sequential_batch(Q, X_normalized, k=8):
+    """Versión en lote (search_batch): un producto matriz-matriz para todas las queries"""
+    Q = Q / np.maximum(np.linalg.norm(Q, axis=1, keepdims=True), 1e-12)
+    scores = np.asarray(X_normalized @ Q.T.astype(np.float32))
+    return [scores[top_k(scores[:, j], k), j] for j in range(Q.shape[0])]
+
 def search_inverted_strict(query_vec, inverted_index, norms, k=8):
     """Simulación de _search_inverted (Acceso Esparso)"""
     norm_q = np.linalg.norm(query_vec)
@@ -94,16 +118,12 @@ def search_inverted_strict(query_vec, inverted_index, norms, k=8):
 def run_benchmark():
     print("--- CARGANDO DATOS COMPLETOS (Espere...) ---")
     try:
-        histograms_full = joblib.load(os.path.join(MODELS_DIR, "histograms.pkl"))
-        idf = joblib.load(os.path.join(MODELS_DIR, "idf_weights.pkl"))
-        all_ids = list(histograms_full.keys())
+        tfidf_csr, _, img_ids, norms_full, _ = load_sparse_models(MODELS_DIR)
+        all_ids = [str(i) for i in img_ids]
         
         # Matriz completa para Faiss
         print("Generando matriz base...")
-        matrix_list = []
-        for img_id in all_ids:
-            matrix_list.append(histograms_full[img_id] * idf)
-        X_full = np.array(matrix_list).astype('float32')
+        X_full = tfidf_csr.toarray().astype('float32')
         print(f"Total datos disponibles: {len(all_ids)}")
         
     except Exception as e:
@@ -112,6 +132,7 @@ def run_benchmark():
 
     results_table = []
     query_vec = X_full[3] # Usamos una imagen como query
+    batch_queries = X_full[:BATCH_QUERIES] # Lote de imágenes para la versión GEMM
 
     print(f"\n--- INICIANDO BENCHMARK (K={K_NEIGHBORS}) ---")
     
@@ -122,10 +143,10 @@ def run_benchmark():
         
         # 1. Preparar las estructuras en RAM para este N
         ids_slice = all_ids[:N]
-        hist_slice = {i: histograms_full[i] for i in ids_slice}
+        vec_slice = {img_id: X_full[i] for i, img_id in enumerate(ids_slice)}
         
         # Construimos el mini motor para el test
-        db_vecs, inv_idx, norms = build_mini_inverted_index(hist_slice, idf, N)
+        db_vecs, inv_idx, norms = build_mini_inverted_index(vec_slice, N)
         
         # ------------------------------------------------
         # TEST 1: SECUENCIAL
@@ -135,6 +156,19 @@ def run_benchmark():
             search_sequential_strict(query_vec, db_vecs, norms, K_NEIGHBORS)
         time_seq = (time.time() - start) / NUM_QUERIES
 
+        # ------------------------------------------------
+        # TEST 1b: SECUENCIAL VECTORIZADO (matriz normalizada)
+        # ------------------------------------------------
+        X_norm = normalize_rows(tfidf_csr[:N], norms_full[:N])
+        start = time.time()
+        for _ in range(NUM_QUERIES):
+            search_sequential_vectorized(query_vec, X_norm, K_NEIGHBORS)
+        time_vec = (time.time() - start) / NUM_QUERIES
+
+        start = time.time()
+        search_sequential_batch(batch_queries, X_norm, K_NEIGHBORS)
+        time_batch = (time.time() - start) / len(batch_queries)
+
         # ------------------------------------------------
         # TEST 2: INDEXADO 
         # ------------------------------------------------
@@ -156,13 +190,168 @@ def run_benchmark():
         results_table.append([
             f"N={N}", 
             f"{time_seq*1000:.2f}", 
+            f"{time_vec*1000:.2f}",
+            f"{time_batch*1000:.3f}",
             f"{time_inv*1000:.2f}",
             f"{time_pg*1000:.2f}"
         ])
 
     print("\nResultados (Tiempo en ms):")
-    headers = ["Tamaño N", "KNN-Secuencial (Py)", "KNN-Indexado (Py)", "KNN-Faiss"]
+    headers = ["Tamaño N", "KNN-Secuencial (Py)", "KNN-Secuencial (GEMV)",
+               f"KNN-Secuencial lote x{BATCH_QUERIES} (por query)", "KNN-Indexado (Py)", "KNN-Faiss"]
+    print(tabulate(results_table, headers=headers, tablefmt="github"))
+
+def run_hnsw_benchmark():
+    """
+    HNSW vs búsqueda exacta sobre el dataset completo:
+    recall@K (fracción del top-K exacto recuperada) y latencia por ef_search.
+    """
+    print("\n--- HNSW: RECALL vs LATENCIA ---")
+    tfidf_csr, _, _, norms, _ = load_sparse_models(MODELS_DIR)
+    X_norm = normalize_rows(tfidf_csr, norms)
+    X_dense = X_norm.toarray()
+
+    if hnsw_exists(MODELS_DIR):
+        hnsw = HNSWIndex.load(MODELS_DIR, X_dense)
+    else:
+        print("No hay grafo HNSW guardado, construyendo el grafo (puede tardar)...")
+        hnsw = HNSWIndex().build(X_dense)
+
+    # Queries: imágenes repartidas por todo el dataset (las vacías no cuentan)
+    rows = np.linspace(0, X_dense.shape[0] - 1, BATCH_QUERIES).astype(int)
+    queries = [X_dense[i] for i in rows if norms[i] > 0]
+
+    # Top-K exacto (referencia)
+    start = time.time()
+    exact = [set(top_k(X_norm @ q, K_NEIGHBORS)) for q in queries]
+    time_exact = (time.time() - start) / len(queries)
+
+    results_table = [["Exacto (GEMV)", "-", "1.000", f"{time_exact*1000:.2f}"]]
+    for ef in HNSW_EF_VALUES:
+        hits = 0
+        start = time.time()
+        for q, truth in zip(queries, exact):
+            ids, _ = hnsw.search(q, K_NEIGHBORS, ef)
+            hits += len(truth & set(ids.tolist()))
+        elapsed = (time.time() - start) / len(queries)
+
+        results_table.append(["HNSW", ef, f"{hits / (len(queries) * K_NEIGHBORS):.3f}", f"{elapsed*1000:.2f}"])
+
+    headers = ["Método", "ef_search", f"Recall@{K_NEIGHBORS}", "Latencia (ms)"]
+    print(tabulate(results_table, headers=headers, tablefmt="github"))
+
+def run_quantization_benchmark():
+    """
+    Scan exhaustivo sobre códigos SQ int8 / PQ vs vectores float:
+    memoria, recall@K frente al top-K exacto y latencia, con y sin re-rank.
+    """
+    print("\n--- CUANTIZACIÓN: MEMORIA / RECALL / LATENCIA ---")
+    tfidf_csr, _, _, norms, _ = load_sparse_models(MODELS_DIR)
+    X_norm = normalize_rows(tfidf_csr, norms)
+    n_rows, dim = X_norm.shape
+
+    sq = load_scalar(MODELS_DIR) or build_scalar_codes(X_norm)
+    pq = load_product(MODELS_DIR)
+    if pq is None:
+        codebooks = train_product_quantizer(X_norm)
+        pq = (encode_product(X_norm, codebooks), codebooks)
+
+    rows = np.linspace(0, n_rows - 1, BATCH_QUERIES).astype(int)
+    queries = [X_norm[i].toarray().ravel() for i in rows if norms[i] > 0]
+
+    start = time.time()
+    exact = [set(top_k(X_norm @ q, K_NEIGHBORS)) for q in queries]
+    time_exact = (time.time() - start) / len(queries)
+
+    dense_mb = n_rows * dim * 8 / 1024 ** 2
+    results_table = [["Float (CSR, GEMV)", "-", f"{dense_mb:.1f} (denso float64)", "1.000", f"{time_exact*1000:.2f}"]]
+
+    methods = [
+        ("SQ int8", sq[0].nbytes, lambda q: scalar_scores(*sq, q)),
+        (f"PQ m={pq[0].shape[1]}", pq[0].nbytes + pq[1].nbytes, lambda q: product_scores(*pq, q)),
+    ]
+    for name, nbytes, score_fn in methods:
+        for n_rerank in RERANK_VALUES:
+            hits = 0
+            start = time.time()
+            for q, truth in zip(queries, exact):
+                scores = score_fn(q)
+                if n_rerank > K_NEIGHBORS:
+                    candidates = top_k(scores, n_rerank)
+                    found = candidates[top_k(rerank(candidates, X_norm, q), K_NEIGHBORS)]
+                else:
+                    found = top_k(scores, K_NEIGHBORS)
+                hits += len(truth & set(found.tolist()))
+            elapsed = (time.time() - start) / len(queries)
+
+            results_table.append([
+                name, n_rerank or "-",
+                f"{nbytes / 1024 ** 2:.1f} (x{dense_mb * 1024 ** 2 / nbytes:.0f} menos)",
+                f"{hits / (len(queries) * K_NEIGHBORS):.3f}", f"{elapsed*1000:.2f}"
+            ])
+
+    headers = ["Vectores", "Re-rank", "Memoria (MB)", f"Recall@{K_NEIGHBORS}", "Latencia (ms)"]
+    print(tabulate(results_table, headers=headers, tablefmt="github"))
+
+def run_pruning_benchmark():
+    """
+    Poda del índice invertido: omitir las palabras de mayor df (min_idf)
+    y cortar cada lista a sus postings de mayor peso (max_postings).
+    Recall@K frente al invertido sin poda, postings recorridos y latencia.
+    """
+    print("\n--- ÍNDICE INVERTIDO: PALABRAS STOP / TOPE DE POSTINGS ---")
+    tfidf_csr, tfidf_csc, _, norms, idf = load_sparse_models(MODELS_DIR)
+    n_rows, n_words = tfidf_csr.shape
+
+    if load_manifest(MODELS_DIR).get("postings_order") != "impact":
+        tfidf_csc = impact_order(tfidf_csc)   # modelo anterior: se ordena en memoria
+
+    doc_freq = np.bincount(tfidf_csr.indices, minlength=n_words)
+    print_df_report(doc_freq, n_rows)
+    list_lengths = np.diff(tfidf_csc.indptr)
+
+    rows = np.linspace(0, n_rows - 1, BATCH_QUERIES).astype(int)
+    queries = [tfidf_csr[i].toarray().ravel() for i in rows if norms[i] > 0]
+
+    def search(q, min_idf=None, max_postings=None):
+        words = np.flatnonzero(q > 0)
+        if min_idf is not None:
+            words = words[idf[words] >= min_idf]
+        scores = inverted_scores(tfidf_csc, q, words, max_postings)
+        denom = norms * np.linalg.norm(q)
+        np.divide(scores, denom, out=scores, where=denom > 0)
+        postings = np.minimum(list_lengths[words], max_postings or n_rows).sum()
+        return top_k(scores, K_NEIGHBORS), postings
+
+    exact = [set(search(q)[0].tolist()) for q in queries]
+
+    results_table = []
+    for pct in STOP_WORD_PCTS:
+        # Las palabras de mayor df son las de menor idf (sin contar las ya descartadas en el build)
+        n_stop = n_words * pct // 100
+        min_idf = np.sort(idf[doc_freq > 0])[n_stop] if n_stop else None
+
+        for cap in POSTINGS_CAPS:
+            max_postings = max(1, int(cap * n_rows)) if cap else None
+            hits = postings = 0
+            start = time.time()
+            for q, truth in zip(queries, exact):
+                found, n_postings = search(q, min_idf, max_postings)
+                hits += len(truth & set(found.tolist()))
+                postings += n_postings
+            elapsed = (time.time() - start) / len(queries)
+
+            results_table.append([
+                f"{pct}% ({n_stop})", max_postings or "-",
+                f"{postings / len(queries):.0f}",
+                f"{hits / (len(queries) * K_NEIGHBORS):.3f}", f"{elapsed*1000:.2f}"
+            ])
+
+    headers = ["Palabras stop", "Tope por lista", "Postings / query", f"Recall@{K_NEIGHBORS}", "Latencia (ms)"]
     print(tabulate(results_table, headers=headers, tablefmt="github"))
 
 if __name__ == "__main__":
-    run_benchmark()
\ No newline at end of file
+    run_benchmark()
+    run_hnsw_benchmark()
+    run_quantization_benchmark()
+    run_pruning_benchmark()
\ No newline at end of file
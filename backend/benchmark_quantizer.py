@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+from tabulate import tabulate
+from app.services.image.descriptor_store import DescriptorStore
+from app.services.image.codebook import predict_words
+from app.services.image.vocab_tree import VocabularyTree
+from app.services.image.sparse_index import build_tf_matrix, apply_idf, normalize_rows, top_k
+
+# --- CONFIGURACIÓN ---
+MODELS_DIR = "data/fashion/models"
+STYLES_CSV = "data/fashion/styles.csv"
+# (branch, depth): el codebook plano se entrena con branch ** depth centroides
+TREE_CONFIGS = [(10, 3), (32, 2), (10, 4)]
+FLAT_MAX_K = 10_000         # por encima el k-means plano es demasiado lento de entrenar
+SAMPLE_SIZE = 3000
+NUM_QUERIES = 200
+K_NEIGHBORS = 8
+SEED = 42
+
+
+def build_index(store, codebook):
+    """TF-IDF normalizado de TODAS las imágenes de la caché con un codebook."""
+    word_rows = store.assign_words(codebook)
+    tf_csr, doc_freq = build_tf_matrix(word_rows, codebook.n_clusters)
+    idf = np.log(len(store) / (doc_freq + 1))
+    tfidf, norms = apply_idf(tf_csr, idf)
+    return normalize_rows(tfidf, norms)
+
+
+def quantization_latency(codebook, query_descriptors):
+    """ms promedio para asignar palabras a los descriptores de UNA imagen de consulta."""
+    start = time.perf_counter()
+    for des in query_descriptors:
+        predict_words(codebook, des)
+    return (time.perf_counter() - start) * 1000 / len(query_descriptors)
+
+
+def precision_at_k(X, queries, labels, k=K_NEIGHBORS):
+    """
+    Calidad de recuperación sin ground truth manual: fracción del top-k
+    (sin la propia imagen) con el mismo articleType que la consulta.
+    """
+    hits, total = 0, 0
+    for q in queries:
+        scores = X.dot(X[q].T).toarray().ravel()
+        scores[q] = -1
+        ranked = top_k(scores, k)
+        hits += sum(labels[r] == labels[q] for r in ranked)
+        total += len(ranked)
+    return hits / max(total, 1)
+
+
+def top_k_overlap(X_a, X_b, queries, k=K_NEIGHBORS):
+    """Intersección media de los top-k de dos índices (1.0 = mismos resultados)."""
+    overlap = 0
+    for q in queries:
+        a = set(top_k(X_a.dot(X_a[q].T).toarray().ravel(), k))
+        b = set(top_k(X_b.dot(X_b[q].T).toarray().ravel(), k))
+        overlap += len(a & b) / k
+    return overlap / len(queries)
+
+
+def run_benchmark():
+    store = DescriptorStore(os.path.join(MODELS_DIR, "descriptors"))
+    print(f"Caché: {store.total_descriptors} descriptores de {len(store)} imágenes")
+
+    styles = pd.read_csv(STYLES_CSV, on_bad_lines='skip')
+    article = dict(zip(styles['id'].astype(str), styles['articleType']))
+    labels = [article.get(os.path.splitext(i)[0]) for i in store.img_ids]
+
+    rng = np.random.default_rng(SEED)
+    candidates = [i for i in range(len(store)) if store.get(i) is not None and labels[i] is not None]
+    queries = rng.choice(candidates, size=min(NUM_QUERIES, len(candidates)), replace=False)
+    query_descriptors = [np.asarray(store.get(i), dtype=np.float32) for i in queries]
+
+    sample = store.sample(SAMPLE_SIZE, seed=SEED)
+    print(f"Muestra de entrenamiento: {sample.shape}")
+
+    results_table = []
+    for branch, depth in TREE_CONFIGS:
+        words = branch ** depth
+        print(f"\n--- {words} palabras ({branch}^{depth}) ---")
+
+        start = time.time()
+        tree = VocabularyTree(branch, depth, seed=SEED).fit(sample)
+        tree_train = time.time() - start
+        X_tree = build_index(store, tree)
+
+        row_tree = ["Árbol", f"{branch}^{depth}", words, f"{tree_train:.1f}",
+                    f"{quantization_latency(tree, query_descriptors):.3f}",
+                    f"{precision_at_k(X_tree, queries, labels):.3f}"]
+
+        if words <= FLAT_MAX_K and words <= len(sample):
+            start = time.time()
+            flat = MiniBatchKMeans(n_clusters=words, batch_size=1000, n_init=1, random_state=SEED).fit(sample)
+            flat_train = time.time() - start
+            X_flat = build_index(store, flat)
+
+            results_table.append(["Plano", "-", words, f"{flat_train:.1f}",
+                                  f"{quantization_latency(flat, query_descriptors):.3f}",
+                                  f"{precision_at_k(X_flat, queries, labels):.3f}", "-"])
+            row_tree.append(f"{top_k_overlap(X_flat, X_tree, queries):.3f}")
+        else:
+            row_tree.append("-")
+
+        results_table.append(row_tree)
+
+    headers = ["Codebook", "Árbol", "Palabras", "Entrenamiento (s)",
+               "Cuantización (ms/img)", f"Precisión@{K_NEIGHBORS} (articleType)",
+               f"Solapamiento top-{K_NEIGHBORS} vs plano"]
+    print("\n" + tabulate(results_table, headers=headers, tablefmt="github"))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        NUM_QUERIES = int(sys.argv[1])
+    run_benchmark()
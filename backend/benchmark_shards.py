@@ -0,0 +1,77 @@
+import time
+import random
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from tabulate import tabulate
+from app.services.text.build_index import build_index, read_dataset
+from app.services.text.shards import build_sharded_index, search_sharded
+from app.services.text.search_engine import search_query
+
+# --- CONFIGURACIÓN ---
+FILE = "spotify_1000"
+DOC_ID_IDX = 0
+TEXT_IDX = 3
+SHARD_VALUES = [1, 2, 4, 8]
+K = 10
+NUM_QUERIES = 200
+CLIENTS = 8          # consultas concurrentes (simula varios usuarios)
+WORDS_PER_QUERY = 3
+
+
+def make_queries(docs, n, words=WORDS_PER_QUERY, seed=42):
+    """Queries cortas tomando palabras reales de las letras."""
+    rnd = random.Random(seed)
+    queries = []
+    while len(queries) < n:
+        _, text = rnd.choice(docs)
+        tokens = text.split()
+        if len(tokens) >= words:
+            start = rnd.randrange(len(tokens) - words + 1)
+            queries.append(" ".join(tokens[start:start + words]))
+    return queries
+
+
+def run_load(search_fn, queries):
+    """Ejecuta las queries con CLIENTS hilos; retorna (QPS, latencias en ms)."""
+    latencies = []
+
+    def one(q):
+        t = time.perf_counter()
+        search_fn(q)
+        latencies.append((time.perf_counter() - t) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CLIENTS) as ex:
+        list(ex.map(one, queries))
+    elapsed = time.perf_counter() - start
+
+    return len(queries) / elapsed, np.array(latencies)
+
+
+def run_benchmark():
+    docs, _, _, _ = read_dataset(FILE, DOC_ID_IDX, TEXT_IDX)
+    queries = make_queries(docs, NUM_QUERIES)
+    rows = []
+
+    print("--- Índice sin particionar (un proceso) ---")
+    build_index(FILE, DOC_ID_IDX, TEXT_IDX)
+    qps, lat = run_load(lambda q: search_query(q, K, FILE), queries)
+    rows.append(["sin shards", f"{qps:.1f}", f"{np.percentile(lat, 50):.2f}", f"{np.percentile(lat, 99):.2f}"])
+
+    for n in SHARD_VALUES:
+        print(f"--- {n} shard(s) ---")
+        build_sharded_index(FILE, DOC_ID_IDX, TEXT_IDX, n_shards=n)
+
+        # Calentar el pool de procesos (no se mide)
+        search_sharded(queries[0], K, FILE)
+
+        qps, lat = run_load(lambda q: search_sharded(q, K, FILE), queries)
+        rows.append([f"{n} shard(s)", f"{qps:.1f}", f"{np.percentile(lat, 50):.2f}", f"{np.percentile(lat, 99):.2f}"])
+
+    print(f"\nResultados ({NUM_QUERIES} queries, {CLIENTS} clientes concurrentes, K={K}):")
+    headers = ["Configuración", "Throughput (q/s)", "p50 (ms)", "p99 (ms)"]
+    print(tabulate(rows, headers=headers, tablefmt="github"))
+
+
+if __name__ == "__main__":
+    run_benchmark()
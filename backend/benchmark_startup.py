@@ -0,0 +1,64 @@
+import sys
+import time
+import multiprocessing as mp
+from tabulate import tabulate
+
+# --- CONFIGURACIÓN ---
+# Simula N workers de uvicorn: cada proceso crea su propio ImageSearchEngine
+WORKER_COUNTS = [1, 2, 4]
+NUM_QUERIES = 20
+QUERY_IMAGE = "data/fashion/images/10005.jpg"
+
+
+def _worker(results):
+    # Import dentro del proceso: mide también el costo de importar el motor
+    start = time.perf_counter()
+    from app.services.image.vector_engine import ImageSearchEngine
+    from app.services.image.sparse_index import process_memory_mb
+
+    engine = ImageSearchEngine()
+    startup = time.perf_counter() - start
+    rss_start, shared_start = process_memory_mb()
+
+    # Unas consultas para tocar las páginas que usa la búsqueda
+    with open(QUERY_IMAGE, "rb") as f:
+        content = f.read()
+    for method in ("inverted", "secuencial"):
+        for _ in range(NUM_QUERIES):
+            engine.search(content, k=8, method=method)
+
+    rss, shared = process_memory_mb()
+    results.put((startup, rss_start, shared_start, rss, shared))
+
+
+def run_benchmark():
+    ctx = mp.get_context("spawn")
+    results_table = []
+
+    for n_workers in WORKER_COUNTS:
+        queue = ctx.Queue()
+        workers = [ctx.Process(target=_worker, args=(queue,)) for _ in range(n_workers)]
+        for w in workers: w.start()
+        stats = [queue.get() for _ in workers]
+        for w in workers: w.join()
+
+        startup = max(s[0] for s in stats)
+        rss = sum(s[3] for s in stats) / n_workers
+        shared = sum(s[4] for s in stats) / n_workers
+
+        results_table.append([
+            n_workers, f"{startup*1000:.0f}",
+            f"{sum(s[1] for s in stats) / n_workers:.1f}",
+            f"{rss:.1f}", f"{shared:.1f}", f"{rss - shared:.1f}"
+        ])
+
+    print("\nArranque y memoria por worker:")
+    headers = ["Workers", "Arranque máx (ms)", "RSS al arrancar (MB)",
+               f"RSS tras {NUM_QUERIES * 2} consultas (MB)", "Compartida (MB)", "Privada (MB)"]
+    print(tabulate(results_table, headers=headers, tablefmt="github"))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        WORKER_COUNTS = [int(x) for x in sys.argv[1:]]
+    run_benchmark()
@@ -1,15 +1,41 @@
+import sys
 import numpy as np
 from sklearn.cluster import MiniBatchKMeans
 import time
-import joblib
 import os
+from app.services.image.descriptor_store import DescriptorStore
+from app.services.image.codebook import load_codebook
+from app.services.image.sparse_index import build_tf_matrix, print_df_report
 
+# Uso:
+#   python estadisticasclusters.py            -> codebook actual
+#   python estadisticasclusters.py 2000 10000 -> re-entrena con K=2000 sobre 10000 imágenes
+# Los descriptores salen de la caché en disco (no se decodifican imágenes).
 models_dir="data/fashion/models"
-kmeans = joblib.load(os.path.join(models_dir, "codebook.pkl"))
-labels = kmeans.labels_ 
+store = DescriptorStore(os.path.join(models_dir, "descriptors"))
+print(f"Caché: {store.total_descriptors} descriptores de {len(store)} imágenes")
+
+if len(sys.argv) > 1:
+    K = int(sys.argv[1])
+    sample_size = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+    sample = store.sample(sample_size)
+    start = time.time()
+    kmeans = MiniBatchKMeans(n_clusters=K, batch_size=1000, n_init='auto').fit(sample.astype(np.float64))
+    print(f"K-Means K={K} sobre {len(sample)} descriptores: {time.time() - start:.1f}s")
+else:
+    kmeans = load_codebook(models_dir)
+
+# Tamaño de cada cluster sobre TODOS los descriptores del dataset
+word_rows = store.assign_words(kmeans)
+labels = np.concatenate([w for w in word_rows if w is not None])
 
 K = kmeans.n_clusters
 counts = np.bincount(labels, minlength=K)
 empty = np.sum(counts == 0)
 print(f"K = {K}  → clusters vacíos: {empty} / {K}")
 print("stats counts -> min, median, mean, max:", counts.min(), np.median(counts), counts.mean(), counts.max())
+
+# Frecuencia documental: palabras presentes en casi todas las imágenes
+# (candidatas a STOP_WORDS_MAX_DF / STOP_WORDS_TOP en el offline_indexer)
+_, doc_freq = build_tf_matrix(word_rows, K)
+print_df_report(doc_freq, len(store))
@@ -11,10 +11,12 @@ export default function Home() {
   const [responseTime, setResponseTime] = useState(undefined)
   const [hasSearched, setHasSearched] = useState(false)
   const [indexBuilt, setIndexBuilt] = useState(false)
+  const [lastSearch, setLastSearch] = useState({ k: 10, file_name: "spotify_songs" })
 
     const handleSearch = async ({ q, k, file_name }) => {
         setIsLoading(true);
         setHasSearched(true);
+        setLastSearch({ k, file_name });
 
         try {
             // Construir URL con query params
@@ -52,6 +54,36 @@ export default function Home() {
         }
     };
 
+    // "More like this": canciones con letra similar (forward index)
+    const handleSimilar = async (docId) => {
+        setIsLoading(true);
+        setHasSearched(true);
+
+        try {
+            const url = new URL(`http://localhost:8000/search/similar/${encodeURIComponent(docId)}`);
+
+            url.searchParams.append("k", lastSearch.k);
+            url.searchParams.append("file_name", lastSearch.file_name);
+
+            const response = await fetch(url.toString());
+
+            if (!response.ok) {
+                throw new Error("Similar search failed");
+            }
+
+            const data = await response.json();
+
+            setResults(data.results || []);
+            setResponseTime(data.execution_time || 0);
+
+        } catch (error) {
+            console.error("Error:", error);
+            setResults([]);
+        } finally {
+            setIsLoading(false);
+        }
+    };
+
     const handleIndexBuilt = () => {
     setIndexBuilt(true)
   }
@@ -91,7 +123,12 @@ export default function Home() {
                   <p className="text-gray-500 text-base">Enter a query and click Search to get started</p>
                 </div>
               ) : (
-                <ResultsList results={results} isLoading={isLoading} responseTime={responseTime} />
+                <ResultsList
+                  results={results}
+                  isLoading={isLoading}
+                  responseTime={responseTime}
+                  onSimilar={handleSimilar}
+                />
               )}
             </div>
           </div>
@@ -34,8 +34,31 @@ export default function IndexBuilder({ onIndexBuilt }) {
         throw new Error(data.error || "Index building failed")
       }
 
+      // The build runs in the background: poll the job until it finishes
+      let job = null
+      while (true) {
+        await new Promise((resolve) => setTimeout(resolve, 1000))
+        const statusResponse = await fetch(`http://localhost:8000${data.status_url}`)
+        job = await statusResponse.json()
+        if (!statusResponse.ok) {
+          throw new Error(job.detail || "Could not read build status")
+        }
+        if (["done", "failed", "cancelled"].includes(job.status)) break
+
+        const { phase, docs_processed, docs_total, eta_seconds } = job.progress
+        setMessageType("success")
+        setMessage(
+          `Building (${phase}): ${docs_processed}/${docs_total} docs` +
+            (eta_seconds != null ? `, ~${Math.ceil(eta_seconds)}s left in this phase` : "")
+        )
+      }
+
+      if (job.status !== "done") {
+        throw new Error(job.error || `Index build ${job.status}`)
+      }
+
       setMessageType("success")
-      setMessage(data.message || "Index built successfully!")
+      setMessage("Index built successfully!")
       setFile("")
       setDocIdIdx(0)
       setTextColumnIdx(3)
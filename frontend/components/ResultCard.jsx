@@ -1,6 +1,6 @@
 "use client"
 
-export default function ResultCard({ result, index }) {
+export default function ResultCard({ result, index, onSimilar }) {
   return (
     <div className="bg-white border border-gray-200 rounded-lg shadow-sm hover:shadow-md transition-shadow duration-200 p-6">
       {/* Result Index and Score */}
@@ -29,6 +29,17 @@ export default function ResultCard({ result, index }) {
         </div>
       )}
 
+      {/* More like this */}
+      {onSimilar && result.docId && (
+        <button
+          type="button"
+          onClick={() => onSimilar(result.docId)}
+          className="mb-3 text-sm font-semibold text-blue-600 hover:text-blue-800"
+        >
+          More like this →
+        </button>
+      )}
+
       {/* Response Time */}
       {result.responseTime !== undefined && (
         <div className="pt-3 border-t border-gray-100">
@@ -2,7 +2,7 @@
 
 import ResultCard from "./ResultCard"
 
-export default function ResultsList({ results, isLoading, responseTime }) {
+export default function ResultsList({ results, isLoading, responseTime, onSimilar }) {
   if (isLoading) {
     return (
       <div className="flex items-center justify-center py-12">
@@ -45,7 +45,7 @@ export default function ResultsList({ results, isLoading, responseTime }) {
       {/* Results Grid */}
       <div className="grid grid-cols-1 md:grid-cols-2 gap-4">
         {results.map((result, index) => (
-          <ResultCard key={index} result={result} index={index + 1} />
+          <ResultCard key={index} result={result} index={index + 1} onSimilar={onSimilar} />
         ))}
       </div>
     </div>
@@ -1,15 +1,56 @@
 "use client"
 
-import { useState } from "react"
+import { useEffect, useRef, useState } from "react"
 
 export default function SearchBar({ onSearch, isLoading }) {
   const [query, setQuery] = useState("")
   const [topK, setTopK] = useState(10)
   const [fileName, setFileName] = useState("spotify_songs")
+  const [suggestions, setSuggestions] = useState([])
+  // El query cambió por elegir una sugerencia: no volver a pedir ni abrir la lista
+  const skipSuggest = useRef(false)
+
+  // Autocompletado mientras se escribe (endpoint /suggest, no toca postings)
+  useEffect(() => {
+    if (skipSuggest.current) {
+      skipSuggest.current = false
+      return
+    }
+
+    const q = query.trim()
+    if (!q) {
+      setSuggestions([])
+      return
+    }
+
+    const controller = new AbortController()
+    const timer = setTimeout(async () => {
+      try {
+        const url = new URL("http://localhost:8000/suggest/")
+        url.searchParams.append("q", q)
+        url.searchParams.append("k", 8)
+        url.searchParams.append("file_name", fileName.trim())
+
+        const response = await fetch(url.toString(), { signal: controller.signal })
+        if (!response.ok) return
+
+        const data = await response.json()
+        setSuggestions(data.suggestions || [])
+      } catch (error) {
+        if (error.name !== "AbortError") setSuggestions([])
+      }
+    }, 80)
+
+    return () => {
+      clearTimeout(timer)
+      controller.abort()
+    }
+  }, [query, fileName])
 
   const handleSubmit = (e) => {
     e.preventDefault()
     if (query.trim()) {
+      setSuggestions([])
       onSearch({
         q: query.trim(),
         k: Number.parseInt(topK),
@@ -35,6 +76,27 @@ export default function SearchBar({ onSearch, isLoading }) {
             rows="6"
             disabled={isLoading}
           />
+          {suggestions.length > 0 && (
+            <ul className="mt-1 border border-gray-200 rounded-lg bg-white shadow-sm divide-y divide-gray-100">
+              {suggestions.map((s) => (
+                <li key={`${s.type}-${s.text}`}>
+                  <button
+                    type="button"
+                    onClick={() => {
+                      // Si el texto no cambia el efecto no corre y no hay nada que saltar
+                      skipSuggest.current = s.text !== query
+                      setQuery(s.text)
+                      setSuggestions([])
+                    }}
+                    className="w-full text-left px-3 py-2 text-sm hover:bg-blue-50 flex justify-between"
+                  >
+                    <span>{s.text}</span>
+                    <span className="text-gray-400">{s.type === "track" ? "song" : "term"}</span>
+                  </button>
+                </li>
+              ))}
+            </ul>
+          )}
         </div>
 
         {/* File Name Input */}